@@ -4,16 +4,22 @@ It will create an Output directory with three files: All Squares, All Images, an
 """
 import os
 import sys
-import pandas as pd
 from tkinter import *
 from tkinter import ttk, filedialog, messagebox
 
+from src.Application.Generate_Squares.Duration_Histograms import concat_square_histograms
 from src.Application.Support.General_Support_Functions import (
     correct_all_recordings_column_types,
     classify_directory,
     concat_csv_files,
     concat_squares_files,
     ToolTip)
+from src.Application.Support.Paint_Schema import (
+    RECORDINGS_SCHEMA,
+    read_csv_with_schema)
+from src.Application.Support.Track_Store import (
+    tracks_exist,
+    concat_tracks)
 from src.Fiji.LoggerConfig import (
     paint_logger,
     paint_logger_change_file_handler_name,
@@ -68,8 +74,7 @@ def compile_project_output(
         if not os.path.isdir(experiment_dir_path):
             continue
 
-        tracks_file = os.path.join(experiment_dir_path, 'All Tracks.csv')
-        if not os.path.exists(tracks_file):
+        if not tracks_exist(experiment_dir_path):
             paint_logger.info(f"Tracks file does not exist in {os.path.basename(experiment_dir_path)}. You may need to (re)run TrackMate.")
             error =True
         else:
@@ -85,7 +90,7 @@ def compile_project_output(
 
         if not error:
             experiments.append(experiment_name)
-            all_tracks.append(tracks_file)
+            all_tracks.append(experiment_dir_path)
             all_squares.append(squares_file)
             all_recordings.append(recordings_file)
             nr_processed += 1
@@ -106,12 +111,12 @@ def compile_project_output(
     if nr_error == 0:
         concat_csv_files(os.path.join(project_dir, 'All Recordings.csv'), all_recordings)
         concat_squares_files(os.path.join(project_dir, 'All Squares.csv'), all_squares)
-        concat_csv_files(os.path.join(project_dir, 'All Tracks.csv'), all_tracks)
+        concat_tracks(project_dir, all_tracks)
+        concat_square_histograms(project_dir, all_tracks)
 
         # Check for duplicates in the All Recordings file
-        df_experiment = pd.read_csv(os.path.join(project_dir, 'All Recordings.csv'),
-                                    dtype={'Max Allowable Variability': float,
-                                           'Min Required Density Ratio': float})
+        df_experiment = read_csv_with_schema(os.path.join(project_dir, 'All Recordings.csv'), RECORDINGS_SCHEMA,
+                                             compact=False)
         if len(df_experiment)  != len(df_experiment['Recording Name'].unique()):
             paint_logger.error("Duplicate entries found in All Recordings file.")
             duplicate_names = set(df_experiment[df_experiment.duplicated(subset='Ext Recording Name', keep=False)]['Ext Recording Name'])
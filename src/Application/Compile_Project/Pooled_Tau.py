@@ -0,0 +1,136 @@
+"""
+Calculates the pooled Tau and R Squared of groups of squares, by default of every combination of Cell Type, Probe,
+Adjuvant and Concentration, for a Project or an Experiment. The Tau of a group is fitted to the sum of the duration
+histograms of its squares, which are read from the Square Histograms file that Generate Squares writes and Compile
+Project merges, so the tracks themselves are not needed. Only the selected squares that were not excluded are used,
+unless --all-squares is given.
+
+Run from the root of the repository:
+    python -m src.Application.Compile_Project.Pooled_Tau <Project or Experiment directory>
+        [--group-by <column> ...] [--all-squares] [--min-tracks-for-tau <n>] [--min-required-r-squared <r2>]
+        [--output <file>]
+"""
+
+import argparse
+import os
+
+import pandas as pd
+
+from src.Application.Generate_Squares.Duration_Histograms import (
+    SQUARE_HISTOGRAMS_FILE_NAME,
+    read_square_histograms)
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import calculate_taus_from_histograms
+from src.Application.Support.Paint_Schema import (
+    SQUARES_SCHEMA,
+    read_csv_with_schema)
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+DEFAULT_GROUP_COLUMNS = ['Cell Type', 'Probe', 'Adjuvant', 'Concentration']
+DEFAULT_OUTPUT_FILE = 'Pooled Tau.csv'
+
+
+def calculate_pooled_taus(
+        paint_path: str,
+        group_columns: list = None,
+        only_selected: bool = True,
+        min_tracks_for_tau: int = None,
+        min_required_r_squared: float = None) -> pd.DataFrame:
+    """
+    Calculate the pooled Tau of every group of squares of a Project or Experiment from the Square Histograms file
+
+    :param paint_path: A Project (that has been compiled) or Experiment directory
+    :param group_columns: The columns of All Squares to group the squares by
+    :param only_selected: Use only the selected squares that are not manually excluded or in an excluded image
+    :param min_tracks_for_tau: The minimum number of tracks for a fit, by default the Generate Squares setting
+    :param min_required_r_squared: The minimum R2 of a fit, by default the Generate Squares setting
+    :return: A table with a row for every group, holding the number of recordings, squares and tracks and the Tau and
+             R Squared, or None if the files are missing
+    """
+
+    group_columns = list(group_columns or DEFAULT_GROUP_COLUMNS)
+    if min_tracks_for_tau is None:
+        min_tracks_for_tau = get_paint_attribute_with_default('Generate Squares', 'Min Tracks to Calculate Tau', 20)
+    if min_required_r_squared is None:
+        min_required_r_squared = get_paint_attribute_with_default('Generate Squares', 'Min Required R Squared', 0.9)
+
+    squares_file = os.path.join(paint_path, 'All Squares.csv')
+    if not os.path.exists(squares_file):
+        paint_logger.error(f"No All Squares file in {paint_path}, run Generate Squares (and Compile Project) first")
+        return None
+    df_square_histograms = read_square_histograms(paint_path)
+    if df_square_histograms is None:
+        paint_logger.error(f"No {SQUARE_HISTOGRAMS_FILE_NAME} file in {paint_path}, run Generate Squares (and Compile "
+                           f"Project) first")
+        return None
+
+    df_squares = read_csv_with_schema(squares_file, SQUARES_SCHEMA)
+    missing_columns = [column for column in group_columns if column not in df_squares.columns]
+    if missing_columns:
+        paint_logger.error(f"Columns {missing_columns} are not in All Squares, the squares can not be grouped by them")
+        return None
+
+    if only_selected:
+        selected = df_squares['Selected'].astype(bool)
+        for excluded_column in ['Square Manually Excluded', 'Image Excluded']:
+            if excluded_column in df_squares.columns:
+                selected &= ~df_squares[excluded_column].astype(bool)
+        df_squares = df_squares[selected]
+
+    # Number the groups, in sorted order, and give every square the number of its group
+    square_groups = df_squares.groupby(group_columns, sort=True, observed=True, dropna=False)
+    df_pooled = square_groups.agg(**{
+        'Nr Recordings': ('Ext Recording Name', 'nunique'),
+        'Nr Squares': ('Square Nr', 'size')}).reset_index()
+    df_square_keys = pd.DataFrame({
+        'Ext Recording Name': df_squares['Ext Recording Name'].astype(str).to_numpy(),
+        'Square Nr': df_squares['Square Nr'].to_numpy(),
+        'Group Nr': square_groups.ngroup().to_numpy()})
+
+    # Sum the histograms of the squares of each group
+    df_square_histograms['Ext Recording Name'] = df_square_histograms['Ext Recording Name'].astype(str)
+    df_group_histograms = df_square_histograms.merge(df_square_keys, on=['Ext Recording Name', 'Square Nr'])
+    frequencies = df_group_histograms.groupby(['Group Nr', 'Track Duration'], sort=True)['Frequency'].sum()
+    durations_of_group = frequencies.index.get_level_values('Track Duration').to_numpy()
+    frequencies_of_group = frequencies.to_numpy()
+    positions_of_group = frequencies.groupby(level='Group Nr').indices
+
+    empty_positions = frequencies_of_group[:0]
+    histograms = []
+    for group_nr in range(len(df_pooled)):
+        positions = positions_of_group.get(group_nr, empty_positions)
+        histograms.append((durations_of_group[positions], frequencies_of_group[positions]))
+
+    taus, r_squareds = calculate_taus_from_histograms(histograms, min_tracks_for_tau, min_required_r_squared)
+    df_pooled['Nr Tracks'] = [int(histogram_frequencies.sum()) for _, histogram_frequencies in histograms]
+    df_pooled['Tau'] = [round(tau, 0) for tau in taus]
+    df_pooled['R Squared'] = [round(r_squared, 3) for r_squared in r_squareds]
+    return df_pooled
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calculate the pooled Tau of groups of squares from the duration '
+                                                 'histograms of the squares')
+    parser.add_argument('paint_path', help='A Project (that has been compiled) or Experiment directory')
+    parser.add_argument('--group-by', nargs='+', default=DEFAULT_GROUP_COLUMNS,
+                        help='The columns of All Squares to group the squares by')
+    parser.add_argument('--all-squares', action='store_true',
+                        help='Use all squares instead of only the selected squares')
+    parser.add_argument('--min-tracks-for-tau', type=int, default=None)
+    parser.add_argument('--min-required-r-squared', type=float, default=None)
+    parser.add_argument('--output', default=None,
+                        help=f"The file to write the results to, by default '{DEFAULT_OUTPUT_FILE}' in the directory")
+    args = parser.parse_args()
+
+    df_pooled = calculate_pooled_taus(
+        args.paint_path, args.group_by, not args.all_squares, args.min_tracks_for_tau, args.min_required_r_squared)
+    if df_pooled is None:
+        return
+    output_file = args.output or os.path.join(args.paint_path, DEFAULT_OUTPUT_FILE)
+    df_pooled.to_csv(output_file, index=False)
+    print(df_pooled.to_string(index=False))
+    print(f"\nResults written to {output_file}")
+
+
+if __name__ == '__main__':
+    main()
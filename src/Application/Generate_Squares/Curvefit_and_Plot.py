@@ -6,7 +6,9 @@ import pandas as pd
 from scipy.optimize import OptimizeWarning
 from scipy.optimize import curve_fit
 
+from src.Application.Generate_Squares.Fit_Cache import get_fit_cache
 from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
 
 
 def mono_exp(x, m, t, b):
@@ -134,6 +136,7 @@ def curve_fit_and_plot(
             fig.savefig(file)
             if verbose:
                 paint_logger.debug("\nWriting plot file: " + file)
+        plt.close(fig)
 
     # Inspect the parameters
     if verbose:
@@ -142,8 +145,491 @@ def curve_fit_and_plot(
         print(f'Y = {m:.3f} * e^(-{t:.3f} * x) + {b:.3f}')
         print(f'Tau = {tau_per_sec * 1e3:.0f} ms')
 
-    plt.close()
-
     # Convert to milliseconds
     tau_per_sec *= 1000
     return tau_per_sec, r_squared
+
+
+# ----------------------------------------------------------------------------------------------------
+# Batched fitting. Many duration histograms are fitted at once with a vectorised Levenberg-Marquardt
+# on mono_exp, starting from the same p0 as curve_fit_and_plot. The histograms are padded to the same
+# number of bins, padded bins have a weight of zero and do not contribute to the fit or to R2.
+# ----------------------------------------------------------------------------------------------------
+
+BATCH_FIT_MAX_ITERATIONS = 400
+BATCH_FIT_TOLERANCE = 1.5e-8
+BATCH_FIT_MAX_LOG_RATE_STEP = np.log(2)
+
+
+def pad_histograms(histograms: list) -> tuple:
+    """
+    Pad duration histograms to the same number of bins.
+
+    :param histograms: A list of (durations, frequencies) pairs
+    :return: The durations, frequencies and a mask of the bins in use, each as an array of nr of histograms x bins
+    """
+
+    nr_of_bins = max((len(durations) for durations, _ in histograms), default=0)
+    x = np.zeros((len(histograms), nr_of_bins))
+    y = np.zeros((len(histograms), nr_of_bins))
+    in_use = np.zeros((len(histograms), nr_of_bins), dtype=bool)
+    for i, (durations, frequencies) in enumerate(histograms):
+        x[i, :len(durations)] = durations
+        y[i, :len(frequencies)] = frequencies
+        in_use[i, :len(durations)] = True
+    return x, y, in_use
+
+
+def fit_mono_exp_batch(x: np.ndarray, y: np.ndarray, in_use: np.ndarray, p0=(2000, 4, 10)) -> tuple:
+    """
+    Fit mono_exp to every row of x and y with a vectorised Levenberg-Marquardt.
+    Fits stop when the cost or the step no longer changes relative to the tolerance. A fit that does not stop within
+    the maximum number of iterations, or that ends with parameters that are not finite, has failed.
+
+    :return: The parameters (nr of histograms x 3: m, t, b) and a boolean array that is True for the successful fits
+    """
+
+    nr_of_fits = x.shape[0]
+    weights = in_use.astype(float)
+    params = np.tile(np.asarray(p0, dtype=float), (nr_of_fits, 1))
+    damping = np.full(nr_of_fits, 1e-3)
+    converged = np.zeros(nr_of_fits, dtype=bool)
+    failed = np.zeros(nr_of_fits, dtype=bool)
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        residuals = (params[:, :1] * np.exp(-params[:, 1:2] * x) + params[:, 2:] - y) * weights
+        cost = np.sum(np.square(residuals), axis=1)
+
+        for _ in range(BATCH_FIT_MAX_ITERATIONS):
+            active = np.flatnonzero(~converged & ~failed)
+            if len(active) == 0:
+                break
+
+            m, t = params[active, 0:1], params[active, 1:2]
+            xa, wa, ra = x[active], weights[active], residuals[active]
+            decay = np.exp(-t * xa) * wa
+            d_m, d_t = decay, -m * xa * decay  # The derivatives of mono_exp to m and t, the derivative to b is 1
+
+            # The normal equations J'J step = -J'r for all active fits, built from the sums of the products
+            jtj = np.empty((len(active), 3, 3))
+            jtj[:, 0, 0] = np.sum(d_m * d_m, axis=1)
+            jtj[:, 0, 1] = jtj[:, 1, 0] = np.sum(d_m * d_t, axis=1)
+            jtj[:, 0, 2] = jtj[:, 2, 0] = np.sum(d_m, axis=1)
+            jtj[:, 1, 1] = np.sum(d_t * d_t, axis=1)
+            jtj[:, 1, 2] = jtj[:, 2, 1] = np.sum(d_t, axis=1)
+            jtj[:, 2, 2] = np.sum(wa, axis=1)
+            gradient = np.stack([np.sum(d_m * ra, axis=1), np.sum(d_t * ra, axis=1), np.sum(ra, axis=1)], axis=1)
+
+            # Marquardt scaling of the damping, with a floor so that a parameter without influence does not make the
+            # system singular
+            diagonal = np.maximum(np.stack([jtj[:, 0, 0], jtj[:, 1, 1], jtj[:, 2, 2]], axis=1), 1e-12)
+            system = jtj + (damping[active, None] * diagonal)[:, :, None] * np.eye(3)
+            step = -np.linalg.solve(system, gradient[:, :, None])[:, :, 0]
+
+            new_params = params[active] + step
+            new_residuals = (new_params[:, :1] * np.exp(-new_params[:, 1:2] * xa) + new_params[:, 2:] -
+                             y[active]) * wa
+            new_cost = np.sum(np.square(new_residuals), axis=1)
+
+            # A step that changes the decay rate by more than a factor is rejected and retried with more damping, as
+            # a too large step. Without this bound a fit can jump to a decay so fast that only the constant remains,
+            # from which it cannot recover
+            too_large = np.abs(np.log(np.abs(new_params[:, 1] / params[active, 1]))) > BATCH_FIT_MAX_LOG_RATE_STEP
+            improved = np.isfinite(new_cost) & (new_cost <= cost[active]) & ~too_large
+            accepted = active[improved]
+
+            # The convergence tests of MINPACK: the actual and predicted relative reduction of the cost are both
+            # small, or the step is small relative to the (scaled) parameters
+            with_cost = np.maximum(cost[active], np.finfo(float).tiny)
+            actual_reduction = np.where(improved, (cost[active] - new_cost) / with_cost, 0)
+            predicted_reduction = (np.einsum('ni,nij,nj->n', step, jtj, step) +
+                                   2 * damping[active] * np.sum(diagonal * np.square(step), axis=1)) / with_cost
+            small_cost_change = (actual_reduction <= BATCH_FIT_TOLERANCE) & (predicted_reduction <= BATCH_FIT_TOLERANCE)
+            scale = np.sqrt(diagonal)
+            small_step = (np.linalg.norm(scale * step, axis=1) <=
+                          BATCH_FIT_TOLERANCE * np.linalg.norm(scale * params[active], axis=1))
+
+            params[accepted] = new_params[improved]
+            residuals[accepted] = new_residuals[improved]
+            cost[accepted] = new_cost[improved]
+            damping[active] = np.where(improved, damping[active] / 10, damping[active] * 10)
+
+            converged[active] = small_cost_change | small_step
+            failed[active] = ~converged[active] & (~np.all(np.isfinite(params[active]), axis=1) |
+                                                   (damping[active] > 1e16))
+
+    successful = converged & ~failed & np.all(np.isfinite(params), axis=1)
+    return params, successful
+
+
+def curve_fit_batch(histograms: list) -> tuple:
+    """
+    The batched equivalent of curve_fit_and_plot (without plotting): fit mono_exp to every duration histogram.
+
+    :param histograms: A list of (durations, frequencies) pairs
+    :return: Arrays with the Tau in ms and the R2 of every histogram; a failed fit has Tau -2 and R2 0
+    """
+
+    if len(histograms) == 0:
+        return np.zeros(0), np.zeros(0)
+
+    x, y, in_use = pad_histograms(histograms)
+    params, successful = fit_mono_exp_batch(x, y, in_use)
+    m, t, b = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+
+    # Determine the quality of the fit as curve_fit_and_plot does
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        nr_of_bins = np.maximum(in_use.sum(axis=1), 1)
+        mean_y = (y * in_use).sum(axis=1, keepdims=True) / nr_of_bins[:, None]
+        squared_diffs = np.sum(np.square(y - (m * np.exp(-t * x) + b)) * in_use, axis=1)
+        squared_diffs_from_mean = np.sum(np.square(y - mean_y) * in_use, axis=1)
+        r_squared = np.where(squared_diffs_from_mean == 0, 0, 1 - squared_diffs / squared_diffs_from_mean)
+        tau = 1000 / t[:, 0]
+
+    tau = np.where(successful, tau, -2)
+    r_squared = np.where(successful, r_squared, 0)
+    return tau, r_squared
+
+
+# ----------------------------------------------------------------------------------------------------
+# Maximum likelihood Tau. Track durations are whole numbers of frame intervals, and TrackMate only keeps
+# tracks with at least MIN_NR_SPOTS_IN_TRACK spots. A track of n spots spans n - 1 frame intervals, so no
+# track is shorter than MIN_NR_SPOTS_IN_TRACK - 1 frame intervals. The number of frame intervals by which a
+# track is longer than that then follows a geometric distribution, the discrete form of the exponential decay
+# that curve_fit fits. The maximum likelihood estimate of its decay follows from the mean duration alone, so no
+# optimiser is needed. The R2 is determined as for the curve fit, over the durations that occur, with the
+# frequencies the estimate predicts.
+# ----------------------------------------------------------------------------------------------------
+
+def get_maximum_likelihood_settings() -> tuple:
+    """
+    :return: The frame interval and the shortest track duration that can occur, both in seconds
+    """
+
+    frame_interval = get_paint_attribute_with_default('Generate Squares', 'Frame Interval', 0.05)
+    min_nr_spots_in_track = get_paint_attribute_with_default('TrackMate', 'MIN_NR_SPOTS_IN_TRACK', 3)
+    return frame_interval, round((min_nr_spots_in_track - 1) * frame_interval, 6)
+
+
+def maximum_likelihood_tau(histograms: list, frame_interval: float, min_duration: float) -> tuple:
+    """
+    Estimate the Tau of every duration histogram with the maximum likelihood estimator of the truncated, discrete
+    exponential distribution. A histogram with durations below min_duration (tracks made with other TrackMate
+    settings) is truncated at its shortest duration instead.
+
+    :param histograms: A list of (durations, frequencies) pairs
+    :return: Arrays with the Tau in ms and the R2 of every histogram; when all tracks have the shortest duration no
+             Tau can be estimated, which is reported as Tau -2 and R2 0
+    """
+
+    if len(histograms) == 0:
+        return np.zeros(0), np.zeros(0)
+
+    x, y, in_use = pad_histograms(histograms)
+    return maximum_likelihood_tau_of_padded_histograms(x, y, in_use, frame_interval, min_duration)
+
+
+def maximum_likelihood_tau_of_padded_histograms(
+        x: np.ndarray, y: np.ndarray, in_use: np.ndarray, frame_interval: float, min_duration: float) -> tuple:
+    """
+    maximum_likelihood_tau for histograms that have been padded with pad_histograms
+    """
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        min_durations = np.minimum(min_duration, np.min(np.where(in_use, x, np.inf), axis=1, keepdims=True))
+        extra_frames = np.where(in_use, np.round((x - min_durations) / frame_interval), 0)
+        nr_tracks = np.sum(y, axis=1, keepdims=True)
+        mean_extra_frames = np.sum(extra_frames * y, axis=1, keepdims=True) / nr_tracks
+
+        # The probability that a track lasts another frame interval, and the decay time that corresponds to it
+        continuation = mean_extra_frames / (1 + mean_extra_frames)
+        tau = 1000 * frame_interval / np.log1p(1 / mean_extra_frames[:, 0])
+
+        predicted = nr_tracks * (1 - continuation) * np.power(continuation, extra_frames)
+        nr_of_bins = np.maximum(in_use.sum(axis=1), 1)
+        mean_y = (y * in_use).sum(axis=1, keepdims=True) / nr_of_bins[:, None]
+        squared_diffs = np.sum(np.square(y - predicted) * in_use, axis=1)
+        squared_diffs_from_mean = np.sum(np.square(y - mean_y) * in_use, axis=1)
+        r_squared = np.where(squared_diffs_from_mean == 0, 0, 1 - squared_diffs / squared_diffs_from_mean)
+
+    successful = (mean_extra_frames[:, 0] > 0) & np.isfinite(tau) & np.isfinite(r_squared)
+    return np.where(successful, tau, -2), np.where(successful, r_squared, 0)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Trust region fitting. Fits mono_exp with MINPACK's trust region Levenberg-Marquardt method (curve_fit's
+# 'lm'), with an analytic Jacobian instead of numerical differentiation, starting from parameters that
+# follow from the histogram itself: a log-linear regression on the head of the histogram, where the decay
+# dominates the constant, gives the amplitude and decay rate. The fixed p0 of curve_fit_and_plot is used
+# when the head does not decay. The amplitude m and decay rate t are bounded to be positive by fitting
+# their logarithms, which keeps the fit in MINPACK rather than in the much slower Python implementation of
+# the bounded trust region reflective method.
+# ----------------------------------------------------------------------------------------------------
+
+TRUST_REGION_TOLERANCE = 1e-8
+TRUST_REGION_HEAD_FRACTION = 0.5
+
+
+def mono_exp_of_log_parameters(x, log_m, log_t, b):
+    return np.exp(log_m - np.exp(log_t) * x) + b
+
+
+def mono_exp_of_log_parameters_jacobian(x, log_m, log_t, b):
+    # The derivatives of mono_exp_of_log_parameters to log_m, log_t and b
+    decay = np.exp(log_m - np.exp(log_t) * x)
+    return np.stack([decay, -np.exp(log_t) * x * decay, np.ones_like(x)], axis=-1)
+
+
+def estimate_mono_exp_parameters(x: np.ndarray, y: np.ndarray) -> list:
+    """
+    Estimate m, t and b of mono_exp from a log-linear regression of the frequencies on the durations of the head of
+    the histogram, weighted by the frequencies (the variance of the log of a count is about one over the count).
+
+    :return: The estimated parameters, or the p0 of curve_fit_and_plot when the head does not decay
+    """
+
+    nr_of_head_bins = max(3, int(np.ceil(len(x) * TRUST_REGION_HEAD_FRACTION)))
+    x_head, y_head = x[:nr_of_head_bins], y[:nr_of_head_bins]
+    if len(x_head) >= 2 and np.ptp(x_head) > 0:
+        slope, intercept = np.polyfit(x_head, np.log(y_head), 1, w=np.sqrt(y_head))
+        if slope < 0 and np.isfinite(intercept):
+            return [float(np.exp(intercept)), float(-slope), 0.0]
+    return [2000, 4, 10]
+
+
+def fit_mono_exp_trust_region(x: np.ndarray, y: np.ndarray) -> tuple:
+    """
+    Fit mono_exp to a duration histogram with the trust region method, the analytic Jacobian and estimated starting
+    parameters
+
+    :return: The parameters m, t and b and the number of function evaluations; the parameters are None when the fit
+             failed
+    """
+
+    m, t, b = estimate_mono_exp_parameters(x, y)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            warnings.simplefilter("ignore", category=OptimizeWarning)
+            params, _, info, _, _ = curve_fit(
+                mono_exp_of_log_parameters, x, y, [np.log(m), np.log(t), b], jac=mono_exp_of_log_parameters_jacobian,
+                method='lm', full_output=True, ftol=TRUST_REGION_TOLERANCE, xtol=TRUST_REGION_TOLERANCE)
+    except Exception:
+        return None, 0
+    log_m, log_t, b = params
+    params = np.array([np.exp(log_m), np.exp(log_t), b])
+    if not np.all(np.isfinite(params)) or params[1] == 0:
+        return None, info['nfev']
+    return params, info['nfev']
+
+
+def curve_fit_trust_region(histograms: list) -> tuple:
+    """
+    Fit mono_exp to every duration histogram with fit_mono_exp_trust_region
+
+    :param histograms: A list of (durations, frequencies) pairs
+    :return: Arrays with the Tau in ms and the R2 of every histogram; a failed fit has Tau -2 and R2 0
+    """
+
+    taus = np.full(len(histograms), -2.0)
+    r_squareds = np.zeros(len(histograms))
+    for i, (durations, frequencies) in enumerate(histograms):
+        x, y = np.asarray(durations, dtype=float), np.asarray(frequencies, dtype=float)
+        params, _ = fit_mono_exp_trust_region(x, y)
+        if params is None:
+            continue
+        m, t, b = params
+
+        # Determine the quality of the fit as curve_fit_and_plot does
+        squared_diffs_from_mean = np.sum(np.square(y - np.mean(y)))
+        if squared_diffs_from_mean != 0:
+            r_squareds[i] = 1 - np.sum(np.square(y - mono_exp(x, m, t, b))) / squared_diffs_from_mean
+        taus[i] = 1000 / t
+    return taus, r_squareds
+
+
+# ----------------------------------------------------------------------------------------------------
+# The Tau fitters that can be selected with 'Tau Fitter' in Paint.json. A fitter takes a list of duration
+# histograms and returns the (Tau in ms, R2) of each, with Tau -2 and R2 0 for a failed fit. Its settings
+# are described in the key of the fit cache, so that results of different fitters are kept apart.
+# ----------------------------------------------------------------------------------------------------
+
+tau_fitters = {}
+
+
+def register_tau_fitter(name: str, fit_histograms, get_settings) -> None:
+    """
+    Make a fitter selectable as Tau Fitter
+
+    :param name: The name of the fitter in Paint.json
+    :param fit_histograms: A function that takes a list of (durations, frequencies) pairs and returns a list with the
+                           (Tau in ms, R2) of every histogram
+    :param get_settings: A function that describes the fitter and its settings, as part of the key of the fit cache
+    """
+
+    tau_fitters[name] = (fit_histograms, get_settings)
+
+
+def fit_histograms_with_curve_fit(histograms: list) -> list:
+    return [curve_fit_and_plot(plot_data=pd.DataFrame({'Frequency': frequencies, 'Track Duration': durations}))
+            for durations, frequencies in histograms]
+
+
+def fit_histograms_in_batch(histograms: list) -> list:
+    taus, r_squareds = curve_fit_batch(histograms)
+    return [(-2 if tau == -2 else tau, r_squared) for tau, r_squared in zip(taus.tolist(), r_squareds.tolist())]
+
+
+def fit_histograms_with_trust_region(histograms: list) -> list:
+    taus, r_squareds = curve_fit_trust_region(histograms)
+    return [(-2 if tau == -2 else tau, r_squared) for tau, r_squared in zip(taus.tolist(), r_squareds.tolist())]
+
+
+def estimate_histograms_with_maximum_likelihood(histograms: list) -> list:
+    taus, r_squareds = maximum_likelihood_tau(histograms, *get_maximum_likelihood_settings())
+    return [(-2 if tau == -2 else tau, r_squared) for tau, r_squared in zip(taus.tolist(), r_squareds.tolist())]
+
+
+def get_maximum_likelihood_fit_settings() -> str:
+    frame_interval, min_duration = get_maximum_likelihood_settings()
+    return f"Maximum Likelihood frame_interval={frame_interval} min_duration={min_duration}"
+
+
+register_tau_fitter(
+    'Curve Fit',
+    fit_histograms_with_curve_fit,
+    lambda: "Curve Fit p0=2000,4,10")
+register_tau_fitter(
+    'Batched',
+    fit_histograms_in_batch,
+    lambda: f"Batched p0=2000,4,10 iterations={BATCH_FIT_MAX_ITERATIONS} tolerance={BATCH_FIT_TOLERANCE} "
+            f"max_log_rate_step={BATCH_FIT_MAX_LOG_RATE_STEP}")
+register_tau_fitter(
+    'Trust Region',
+    fit_histograms_with_trust_region,
+    lambda: f"Trust Region jacobian=analytic p0=log-linear head={TRUST_REGION_HEAD_FRACTION} bounds=m>0,t>0 "
+            f"tolerance={TRUST_REGION_TOLERANCE}")
+register_tau_fitter(
+    'Maximum Likelihood',
+    estimate_histograms_with_maximum_likelihood,
+    get_maximum_likelihood_fit_settings)
+
+
+def get_fit_settings(tau_fitter: str) -> str:
+    """
+    Describe the fitter and its settings, as part of the key of the fit cache
+    """
+
+    return tau_fitters[tau_fitter][1]()
+
+
+def fit_duration_histograms(histograms: list, tau_fitter: str = 'Curve Fit') -> list:
+    """
+    Determine the Tau of every duration histogram with the fitter registered as tau_fitter.
+    Results of histograms that were fitted before with the same fitter are taken from the fit cache.
+
+    :param histograms: A list of (durations, frequencies) pairs
+    :return: A list with the (Tau in ms, R2) of every histogram; a failed fit has Tau -2 and R2 0
+    """
+
+    fit_histograms = tau_fitters[tau_fitter][0]
+
+    fit_cache = get_fit_cache()
+    if fit_cache.enabled:
+        fit_settings = get_fit_settings(tau_fitter)
+        keys = [fit_cache.make_key(durations, frequencies, fit_settings) for durations, frequencies in histograms]
+        cached_fits = fit_cache.get_many(keys)
+    else:
+        keys = list(range(len(histograms)))
+        cached_fits = {}
+
+    # Fit every histogram that is not in the cache, once
+    to_fit = []
+    keys_to_fit = set()
+    for i, key in enumerate(keys):
+        if key not in cached_fits and key not in keys_to_fit:
+            keys_to_fit.add(key)
+            to_fit.append(i)
+
+    fits = fit_histograms([histograms[i] for i in to_fit])
+
+    new_fits = {keys[i]: fit for i, fit in zip(to_fit, fits)}
+    if fit_cache.enabled:
+        fit_cache.put_many(new_fits)
+    return [cached_fits[key] if key in cached_fits else new_fits[key] for key in keys]
+
+
+# ----------------------------------------------------------------------------------------------------
+# Bootstrap confidence intervals of the Tau. Resampling the tracks of a histogram with replacement is, for
+# the histogram, a multinomial draw of the same number of tracks over its durations, with the observed
+# frequencies as probabilities. The replicate histograms are fitted with the Tau Fitter that fitted the Tau
+# itself (fitters that converge differently would give an interval that need not contain the Tau), and the
+# interval follows from the percentiles of the replicate Taus. The random numbers of a histogram are seeded
+# from the histogram itself, so its interval does not depend on the other histograms, the order in which
+# they are processed or the worker that processes them.
+# ----------------------------------------------------------------------------------------------------
+
+BOOTSTRAP_SEED = 0
+BOOTSTRAP_MAX_REPLICATES_PER_BATCH = 20000
+
+
+def make_bootstrap_generator(durations: np.ndarray, frequencies: np.ndarray) -> np.random.Generator:
+    # The durations are in seconds with at most a few decimals, in microseconds they are whole numbers
+    entropy = np.concatenate([np.round(durations * 1e6), frequencies]).astype(np.int64)
+    return np.random.default_rng([BOOTSTRAP_SEED, *entropy.tolist()])
+
+
+def bootstrap_tau(histograms: list, nr_of_replicates: int, confidence_level: float,
+                  tau_fitter: str = 'Curve Fit') -> tuple:
+    """
+    Determine a bootstrap confidence interval for the Tau of every duration histogram
+
+    :param histograms: A list of (durations, frequencies) pairs
+    :param nr_of_replicates: The number of resampled histograms that are fitted for every histogram
+    :param confidence_level: The fraction of the replicate Taus that lies within the interval, e.g. 0.95
+    :param tau_fitter: The fitter registered in tau_fitters with which the replicate histograms are fitted, the one
+                       that fitted the Tau of the histograms
+    :return: Arrays with the lower and upper bound of the interval of every histogram, in ms; both are -2 when none
+             of the replicates could be fitted
+    """
+
+    lower_bounds = np.full(len(histograms), -2.0)
+    upper_bounds = np.full(len(histograms), -2.0)
+    if nr_of_replicates <= 0:
+        return lower_bounds, upper_bounds
+    percentiles = [50 * (1 - confidence_level), 50 * (1 + confidence_level)]
+
+    # The replicates of a number of histograms are drawn, and fitted, at once
+    fit_histograms = tau_fitters[tau_fitter][0]
+    histograms_per_batch = max(1, BOOTSTRAP_MAX_REPLICATES_PER_BATCH // nr_of_replicates)
+    for start in range(0, len(histograms), histograms_per_batch):
+        batch = histograms[start:start + histograms_per_batch]
+        nr_of_bins = max(len(durations) for durations, _ in batch)
+        x = np.zeros((len(batch) * nr_of_replicates, nr_of_bins))
+        y = np.zeros((len(batch) * nr_of_replicates, nr_of_bins))
+        for i, (durations, frequencies) in enumerate(batch):
+            durations = np.asarray(durations, dtype=float)
+            frequencies = np.asarray(frequencies, dtype=np.int64)
+            nr_tracks = frequencies.sum()
+            if nr_tracks == 0:
+                continue
+            replicates = slice(i * nr_of_replicates, (i + 1) * nr_of_replicates)
+            x[replicates, :len(durations)] = durations
+            y[replicates, :len(durations)] = make_bootstrap_generator(durations, frequencies).multinomial(
+                nr_tracks, frequencies / nr_tracks, size=nr_of_replicates)
+
+        # Durations that were not drawn are left out of a replicate, as compile_duration leaves them out
+        in_use = y > 0
+        taus = np.full(len(x), -2.0)
+        drawn = np.flatnonzero(in_use.any(axis=1))
+        fits = fit_histograms([(x[j, in_use[j]], y[j, in_use[j]]) for j in drawn])
+        taus[drawn] = [tau for tau, _ in fits]
+        successful = np.isfinite(taus) & (taus > 0)
+
+        taus = taus.reshape(len(batch), nr_of_replicates)
+        successful = successful.reshape(len(batch), nr_of_replicates)
+        for i in range(len(batch)):
+            if np.any(successful[i]):
+                lower_bounds[start + i], upper_bounds[start + i] = np.percentile(taus[i, successful[i]], percentiles)
+
+    return lower_bounds, upper_bounds
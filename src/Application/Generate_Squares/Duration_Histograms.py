@@ -0,0 +1,209 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from src.Application.Support.Paint_Schema import (
+    SQUARE_HISTOGRAMS_SCHEMA,
+    read_csv_with_schema)
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import (
+    get_paint_attribute_with_default,
+    set_mode_of_replacement_file)
+
+# ----------------------------------------------------------------------------------------------------
+# The duration histograms of the squares of a Recording. The histogram of a set of tracks is the number of
+# tracks per Track Duration, as compile_duration makes it, and the histogram of a set of squares is the sum
+# of the histograms of those squares. The histograms of all squares are therefore made once, as one sparse
+# square x duration matrix, and the histogram of any selection of squares, of a Cell or of the Recording is
+# a sum of rows of that matrix. Changing the selection then costs a sum and a fit, not a scan of the tracks.
+#
+# Generate Squares stores the histograms of all squares of an Experiment in a 'Square Histograms.csv' file
+# next to All Squares, with a row for every square and duration that holds tracks. Compile Project merges
+# them, so that the Tau of any group of squares in a Project can be calculated without reading the tracks.
+# ----------------------------------------------------------------------------------------------------
+
+SQUARE_HISTOGRAMS_FILE_NAME = 'Square Histograms.csv'
+
+
+class DurationHistograms:
+
+    def __init__(self, durations, square_nrs, nr_total_squares: int, used_for_tau=None):
+        """
+        Make the duration histograms of all squares
+
+        :param durations: The Track Duration of each track
+        :param square_nrs: The Square Nr of each track, NaN or negative for tracks outside the grid
+        :param nr_total_squares: The number of squares in the Recording
+        :param used_for_tau: For each track, whether it counts in the histograms (all tracks if None)
+        """
+
+        durations = np.asarray(durations, dtype=float)
+        square_nrs = pd.to_numeric(pd.Series(square_nrs), errors='coerce').fillna(-1).to_numpy().astype(np.int64)
+        in_grid = square_nrs >= 0
+        nr_total_squares = max(int(nr_total_squares), int(square_nrs.max(initial=-1)) + 1)
+
+        # The number of tracks in each square, also of the tracks that are not in the histograms
+        self.nr_tracks_per_square = np.bincount(square_nrs[in_grid], minlength=nr_total_squares)
+
+        # Tracks without a duration are not in a histogram, as compile_duration leaves them out
+        in_histogram = in_grid & ~np.isnan(durations)
+        if used_for_tau is not None:
+            in_histogram &= np.asarray(used_for_tau, dtype=bool)
+        self.durations, duration_bins = np.unique(durations[in_histogram], return_inverse=True)
+        self.counts = csr_matrix(
+            (np.ones(np.count_nonzero(in_histogram), dtype=np.int64), (square_nrs[in_histogram], duration_bins)),
+            shape=(nr_total_squares, len(self.durations)))
+        self.counts.sum_duplicates()
+        self.counts.sort_indices()
+
+    @classmethod
+    def from_tracks(cls, df_tracks: pd.DataFrame, nr_total_squares: int, limit_dc: bool = None):
+        """
+        Make the duration histograms of the squares of the tracks of a Recording. Unless limit_dc is given, tracks
+        with a zero Diffusion Coefficient are left out if 'Exclude zero DC tracks from Tau Calculation' is set,
+        as extra_constraints_on_tracks_for_tau_calculation does.
+        """
+
+        if limit_dc is None:
+            limit_dc = get_paint_attribute_with_default(
+                'Generate Squares', 'Exclude zero DC tracks from Tau Calculation', False)
+        used_for_tau = None
+        if limit_dc:
+            used_for_tau = df_tracks['Diffusion Coefficient'].to_numpy() > 0
+        return cls(df_tracks['Track Duration'].to_numpy(), df_tracks['Square Nr'], nr_total_squares, used_for_tau)
+
+    @property
+    def nr_total_squares(self) -> int:
+        return self.counts.shape[0]
+
+    def to_dataframe(self, recording_name: str) -> pd.DataFrame:
+        """
+        The histograms as rows of the Square Histograms file: the Square Nr, Track Duration and Frequency of every
+        square and duration that holds tracks
+        """
+
+        return pd.DataFrame({
+            'Ext Recording Name': recording_name,
+            'Square Nr': np.repeat(np.arange(self.nr_total_squares), np.diff(self.counts.indptr)),
+            'Track Duration': self.durations[self.counts.indices],
+            'Frequency': self.counts.data})
+
+    def histogram(self, square_nrs=None) -> tuple:
+        """
+        The duration histogram of the tracks in a set of squares
+
+        :param square_nrs: The squares, all squares if None
+        :return: A (durations, frequencies) pair with only the durations that occur, in ascending order
+        """
+
+        if square_nrs is None:
+            frequencies = np.asarray(self.counts.sum(axis=0)).ravel()
+        else:
+            square_nrs = np.unique(self.valid_square_nrs(square_nrs))
+            frequencies = np.asarray(self.counts[square_nrs].sum(axis=0)).ravel()
+        occupied = frequencies > 0
+        return self.durations[occupied], frequencies[occupied]
+
+    def histograms_of_squares(self, square_nrs) -> list:
+        """
+        The duration histogram of each of the squares, as a list of (durations, frequencies) pairs
+        """
+
+        histograms = []
+        for square_nr in self.valid_square_nrs(square_nrs):
+            start, end = self.counts.indptr[square_nr], self.counts.indptr[square_nr + 1]
+            histograms.append((self.durations[self.counts.indices[start:end]], self.counts.data[start:end]))
+        return histograms
+
+    def histograms_of_groups(self, group_of_square) -> dict:
+        """
+        The duration histogram of each group of squares, for instance of each Cell
+
+        :param group_of_square: The group of each square, as a Series indexed by Square Nr (the Cell Id of df_squares
+                                with the Square Nr as index for example)
+        :return: A dictionary with the (durations, frequencies) pair of every group
+        """
+
+        group_of_square = pd.Series(group_of_square)
+        return {group: self.histogram(square_nrs.to_numpy())
+                for group, square_nrs in group_of_square.index.to_series().groupby(group_of_square.to_numpy())}
+
+    def nr_tracks(self, square_nrs=None) -> int:
+        """
+        The number of tracks in a set of squares (all squares if None), including the tracks that are not in the
+        histograms
+        """
+
+        if square_nrs is None:
+            return int(self.nr_tracks_per_square.sum())
+        return int(self.nr_tracks_per_square[np.unique(self.valid_square_nrs(square_nrs))].sum())
+
+    def valid_square_nrs(self, square_nrs) -> np.ndarray:
+        """
+        The Square Nrs as an integer array, without the squares that hold no tracks because they are outside the grid
+        """
+
+        square_nrs = np.asarray(square_nrs, dtype=np.int64)
+        return square_nrs[(square_nrs >= 0) & (square_nrs < self.nr_total_squares)]
+
+
+# ----------------------------------------------------------------------------------------------------
+# The Square Histograms file
+# ----------------------------------------------------------------------------------------------------
+
+def square_histograms_exist(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, SQUARE_HISTOGRAMS_FILE_NAME))
+
+
+def read_square_histograms(directory: str) -> pd.DataFrame:
+    """
+    Read the duration histograms of the squares of an Experiment or Project
+
+    :return: The Ext Recording Name, Square Nr, Track Duration and Frequency of every square and duration that holds
+             tracks, or None if there is no Square Histograms file
+    """
+
+    if not square_histograms_exist(directory):
+        return None
+    return read_csv_with_schema(os.path.join(directory, SQUARE_HISTOGRAMS_FILE_NAME), SQUARE_HISTOGRAMS_SCHEMA)
+
+
+def write_square_histograms(df_square_histograms: pd.DataFrame, directory: str) -> None:
+    """
+    Write the duration histograms of the squares to the Square Histograms file
+    """
+
+    # Written to a temporary file first, so that a reader never sees a partly written file
+    file_descriptor, new_file_path = tempfile.mkstemp(prefix='.Square Histograms ', dir=directory)
+    os.close(file_descriptor)
+    try:
+        df_square_histograms.to_csv(new_file_path, index=False)
+        set_mode_of_replacement_file(new_file_path, os.path.join(directory, SQUARE_HISTOGRAMS_FILE_NAME))
+        os.replace(new_file_path, os.path.join(directory, SQUARE_HISTOGRAMS_FILE_NAME))
+    finally:
+        if os.path.exists(new_file_path):
+            os.remove(new_file_path)
+
+
+def concat_square_histograms(output_directory: str, input_directories: list) -> None:
+    """
+    Merge the Square Histograms files of Experiments into the Square Histograms file of output_directory.
+    Experiments without a Square Histograms file (with squares generated by an earlier version) are left out.
+    """
+
+    histograms_of_experiments = []
+    for input_directory in input_directories:
+        df_square_histograms = read_square_histograms(input_directory)
+        if df_square_histograms is None:
+            paint_logger.warning(f"No {SQUARE_HISTOGRAMS_FILE_NAME} in {os.path.basename(input_directory)}, rerun "
+                                 f"Generate Squares to include it in the pooled Tau calculations")
+            continue
+        histograms_of_experiments.append(df_square_histograms)
+
+    if histograms_of_experiments:
+        write_square_histograms(pd.concat(histograms_of_experiments, ignore_index=True), output_directory)
+    elif square_histograms_exist(output_directory):
+        os.remove(os.path.join(output_directory, SQUARE_HISTOGRAMS_FILE_NAME))
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import sqlite3
+from collections import OrderedDict
+
+import numpy as np
+
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# ----------------------------------------------------------------------------------------------------
+# A cache for the results of fitting duration histograms. The same histograms are fitted again and again:
+# when Generate Squares reruns on unchanged tracks, when the Recording Viewer recalculates the Recording
+# Tau after a change in the selection and in selection sweeps. A fit result is stored under a hash of the
+# durations and frequencies of the histogram and the fit settings, first in memory (least recently used
+# entries are dropped when the cache is full) and, optionally, in a file in the Project directory, so that
+# later runs can use it as well. On disk a result is only two numbers, the Tau and R2, so reading the file
+# never runs code from it; a row that does not hold two numbers is treated as not being in the cache.
+# ----------------------------------------------------------------------------------------------------
+
+FIT_CACHE_FILE_NAME = 'Fit Cache.sqlite'
+FIT_CACHE_VERSION = 1
+FAILED_FIT = (-2, 0)
+
+_fit_cache = None
+
+
+class FitCache:
+    """
+    Fit results keyed by histogram content: an in-memory LRU tier and an optional on-disk tier.
+    A result is a (Tau, R2) pair. In memory it is kept exactly as the fitter returned it; on disk the Tau and R2 are
+    stored as two REAL columns and a failed fit is read back as the fitters return it, (-2, 0).
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.directory = None
+        self.connection = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 or self.connection is not None
+
+    @staticmethod
+    def make_key(durations: np.ndarray, frequencies: np.ndarray, fit_settings: str) -> str:
+        key = hashlib.sha256()
+        key.update(f"{FIT_CACHE_VERSION} {fit_settings} {len(durations)}".encode())
+        key.update(np.ascontiguousarray(durations, dtype=np.float64).tobytes())
+        key.update(np.ascontiguousarray(frequencies, dtype=np.int64).tobytes())
+        return key.hexdigest()
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Look up the results for the keys, first in memory, then on disk
+
+        :return: A dictionary with the results that were found
+        """
+
+        results = {}
+        for key in keys:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                results[key] = self.entries[key]
+                self.memory_hits += 1
+
+        missing_keys = list(dict.fromkeys(key for key in keys if key not in results))
+        if missing_keys and self.connection is not None:
+            try:
+                for i in range(0, len(missing_keys), 500):
+                    chunk = missing_keys[i:i + 500]
+                    rows = self.connection.execute(
+                        f"SELECT key, tau, r_squared FROM taus WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk).fetchall()
+                    for key, tau, r_squared in rows:
+                        result = read_fit(tau, r_squared)
+                        if result is None:
+                            continue
+                        results[key] = result
+                        self._remember(key, result)
+                        self.disk_hits += 1
+            except sqlite3.Error as e:
+                self._close_on_error(e)
+
+        self.misses += sum(1 for key in keys if key not in results)
+        return results
+
+    def put_many(self, results: dict) -> None:
+        """
+        Store new fit results, in memory and, when a Project directory is in use, on disk
+        """
+
+        for key, result in results.items():
+            self._remember(key, result)
+
+        if results and self.connection is not None:
+            try:
+                with self.connection:
+                    self.connection.executemany(
+                        "INSERT OR REPLACE INTO taus (key, tau, r_squared) VALUES (?, ?, ?)",
+                        [(key, float(tau), float(r_squared)) for key, (tau, r_squared) in results.items()])
+            except sqlite3.Error as e:
+                self._close_on_error(e)
+
+    def open_directory(self, directory: str) -> None:
+        """
+        Use the on-disk tier in the specified (Project) directory
+        """
+
+        if self.directory == directory and self.connection is not None:
+            return
+        self.close()
+        try:
+            self.connection = sqlite3.connect(os.path.join(directory, FIT_CACHE_FILE_NAME), timeout=30)
+            with self.connection:
+                # Earlier versions kept the results in a 'fits' table, which is not read any more
+                self.connection.execute("DROP TABLE IF EXISTS fits")
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS taus (key TEXT PRIMARY KEY, tau REAL, r_squared REAL)")
+            self.directory = directory
+        except sqlite3.Error as e:
+            self._close_on_error(e)
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+        self.directory = None
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.memory_hits = self.disk_hits = self.misses = 0
+
+    def statistics(self) -> dict:
+        return {
+            'Memory Hits': self.memory_hits,
+            'Disk Hits': self.disk_hits,
+            'Misses': self.misses,
+            'Entries in Memory': len(self.entries),
+            'Directory': self.directory}
+
+    def _remember(self, key: str, result) -> None:
+        if self.max_size <= 0:
+            return
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _close_on_error(self, e: sqlite3.Error) -> None:
+        paint_logger.warning(f"The fit cache in {self.directory} can not be used and is switched off: {e}")
+        try:
+            self.close()
+        except sqlite3.Error:
+            self.connection = None
+            self.directory = None
+
+
+def read_fit(tau, r_squared):
+    """
+    The fit result of a row of the on-disk tier
+
+    :return: The (Tau, R2) pair, or None when the row does not hold two finite numbers
+    """
+
+    if not all(isinstance(value, (int, float)) and np.isfinite(value) for value in (tau, r_squared)):
+        return None
+    if tau == FAILED_FIT[0]:
+        return FAILED_FIT
+    return tau, r_squared
+
+
+def get_fit_cache() -> FitCache:
+    """
+    The fit cache of this process, created on first use with the size from Paint.json
+    """
+
+    global _fit_cache
+    if _fit_cache is None:
+        _fit_cache = FitCache(int(get_paint_attribute_with_default('Generate Squares', 'Fit Cache Size', 10000)))
+    return _fit_cache
+
+
+def use_fit_cache_directory(project_path: str) -> None:
+    """
+    Keep the fit results on disk in the Project directory as well, if 'Fit Cache on Disk' is set in Paint.json
+    """
+
+    if get_paint_attribute_with_default('Generate Squares', 'Fit Cache on Disk', False):
+        get_fit_cache().open_directory(project_path)
+
+
+def get_fit_cache_statistics() -> dict:
+    """
+    The number of memory hits, disk hits and misses of the fit cache of this process, for profiling
+    """
+
+    return get_fit_cache().statistics()
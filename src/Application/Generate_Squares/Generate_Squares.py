@@ -1,12 +1,15 @@
+import logging.handlers
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
 
 from src.Application.Recording_Viewer.Select_Squares import (
     select_squares_with_parameters,
-    label_selected_squares_and_tracks)
+    label_selected_squares,
+    relabel_tracks)
 from src.Fiji.LoggerConfig import (
     paint_logger,
     paint_logger_change_file_handler_name,
@@ -26,20 +29,68 @@ from src.Application.Generate_Squares.Generate_Squares_Support_Functions import
     add_columns_to_experiment,
     read_recordings_of_experiment,
     read_tracks_of_experiment,
+    prepare_tracks,
     get_row_and_column,
     calculate_tau,
+    calculate_taus_from_histograms,
+    calculate_tau_confidence_intervals,
+    get_tau_bootstrap_settings,
+    TAU_CI_COLUMNS,
     calculate_median_long_track,
     calculate_median_short_track
 )
+from src.Application.Generate_Squares.Square_Engine import generate_squares_of_recording
+from src.Application.Generate_Squares.Duration_Histograms import (
+    DurationHistograms,
+    square_histograms_exist,
+    write_square_histograms)
+from src.Application.Generate_Squares.Recording_Manifest import (
+    MANIFEST_FILE_NAME,
+    get_squares_parameters,
+    fingerprint_recording,
+    read_manifest,
+    write_manifest,
+    remove_manifest)
+from src.Application.Generate_Squares.Square_Table import SquareTable
+from src.Application.Generate_Squares.Plot_Queue import (
+    make_plot_specs,
+    start_plot_queue,
+    get_plot_max)
+from src.Application.Generate_Squares.Fit_Cache import (
+    use_fit_cache_directory,
+    get_fit_cache_statistics)
+from src.Application.Generate_Squares.Track_Stream import needs_streaming
+from src.Application.Generate_Squares.Performance_Report import (
+    start_performance_report,
+    get_performance_report_settings,
+    measure_stage,
+    count_tau_outcomes,
+    collect_stage_records,
+    add_stage_records,
+    write_performance_report)
+from src.Application.Generate_Squares.Shared_Track_Columns import (
+    TRACK_COLUMNS_FOR_SQUARES,
+    share_track_columns,
+    attach_track_columns,
+    release_track_columns)
 
 from src.Application.Support.General_Support_Functions import (
     format_time_nicely)
-
-from src.Fiji.DirectoriesAndLocations import (
-    delete_files_in_directory)
+from src.Application.Support.Paint_Schema import (
+    SQUARES_SCHEMA,
+    read_csv_with_schema)
+from src.Application.Support.Track_Store import (
+    TRACK_SQUARES_COLUMNS,
+    tracks_exist,
+    convert_tracks,
+    write_track_squares,
+    scan_tracks,
+    read_tracks_by_recording,
+    make_empty_tracks)
 
 from src.Fiji.NewPaintConfig import (
-    get_paint_attribute_with_default)
+    get_paint_attribute_with_default,
+    use_paint_config_snapshot)
 
 if not paint_logger_file_name_assigned:
     paint_logger_change_file_handler_name('Generate Squares.log')
@@ -59,10 +110,12 @@ def process_project(
         nr_of_squares_in_row: int,
         min_required_r_squared: float,
         min_tracks_for_tau: int,
-        paint_force: bool = False) -> None:
+        paint_force: bool = False,
+        nr_of_workers: int = 1) -> int:
     """
     This function processes all Recordings in a Project.
     It calls the function 'process_experiment' for each Experiment in the Project.
+    With nr_of_workers larger than 1, the Experiments are processed in parallel in a pool of worker processes.
     """
 
     paint_logger.info(f"Starting generating squares for all recordings in {project_path}")
@@ -70,7 +123,15 @@ def process_project(
     experiment_dirs = os.listdir(project_path)
     experiment_dirs.sort()
 
+    experiment_parameters = {
+        'select_parameters': select_parameters,
+        'nr_of_squares_in_row': nr_of_squares_in_row,
+        'min_required_r_squared': min_required_r_squared,
+        'min_tracks_for_tau': min_tracks_for_tau,
+        'paint_force': paint_force}
+
     nr_experiments_processed = 0
+    experiment_paths_for_workers = []
     for experiment_dir in experiment_dirs:
 
         # Skip if not a directory or if it is in the skipped directories list
@@ -81,30 +142,174 @@ def process_project(
         if any(x in experiment_dir for x in skip_dirs):
             continue
 
-        # Look at the time tags and decide if reprocessing is needed. Always process when the paint_force flag is set
+        # Look at the time tags and decide if reprocessing is needed. Always process when the paint_force flag is set.
+        # When there is a manifest, process_experiment itself decides which Recordings need reprocessing
         if (os.path.exists(os.path.join(project_path, experiment_dir)) and
                 os.path.exists(os.path.join(project_path, experiment_dir, 'All Squares.csv')) and
                 os.path.exists(os.path.join(project_path, experiment_dir, 'All Recordings.csv')) and
-                os.path.exists(os.path.join(project_path, experiment_dir, 'All Tracks.csv')) and
+                tracks_exist(os.path.join(project_path, experiment_dir)) and
+                not os.path.exists(os.path.join(project_path, experiment_dir, MANIFEST_FILE_NAME)) and
                 not paint_force):
             paint_logger.info('')
             paint_logger.info(f"Experiment output exists and skipped: {experiment_dir}")
             paint_logger.info('')
             continue
 
-        # Process the experiment
-        process_experiment(
-            os.path.join(project_path, experiment_dir),
-            select_parameters=select_parameters,
-            nr_of_squares_in_row=nr_of_squares_in_row,
-            min_required_r_squared=min_required_r_squared,
-            min_tracks_for_tau=min_tracks_for_tau,
-            paint_force=paint_force)
+        # Process the experiment, or leave it for the workers
+        if nr_of_workers > 1:
+            experiment_paths_for_workers.append(os.path.join(project_path, experiment_dir))
+        else:
+            process_experiment(os.path.join(project_path, experiment_dir), **experiment_parameters)
         nr_experiments_processed += 1
 
+    if experiment_paths_for_workers:
+        process_experiments_in_pool(experiment_paths_for_workers, experiment_parameters, nr_of_workers)
+
     return nr_experiments_processed
 
 
+def process_project_with_grid_sizes(
+        project_paths: dict,
+        select_parameters: dict,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int,
+        paint_force: bool = False,
+        nr_of_workers: int = 1) -> int:
+    """
+    This function processes all Recordings in a Project for several grid sizes.
+    project_paths maps each number of squares in a row to the Project directory in which the output for that grid size
+    is written. The Project directories hold the same Experiments (copied from the same source), of which the input
+    is read only once, from the first Project directory, by 'process_experiment_with_grid_sizes'.
+    With nr_of_workers larger than 1, the Experiments are processed in parallel in a pool of worker processes.
+    """
+
+    first_project_path = next(iter(project_paths.values()))
+    paint_logger.info(f"Starting generating squares for grid sizes {', '.join(str(nr) for nr in project_paths)} "
+                      f"for all recordings in {first_project_path}")
+    paint_logger.info('')
+    experiment_dirs = os.listdir(first_project_path)
+    experiment_dirs.sort()
+
+    experiment_parameters = {
+        'select_parameters': select_parameters,
+        'min_required_r_squared': min_required_r_squared,
+        'min_tracks_for_tau': min_tracks_for_tau,
+        'paint_force': paint_force}
+
+    nr_experiments_processed = 0
+    experiment_paths_for_workers = []
+    for experiment_dir in experiment_dirs:
+
+        # Skip if not a directory or if it is in the skipped directories list
+        if not os.path.isdir(os.path.join(first_project_path, experiment_dir)):
+            continue
+
+        skip_dirs = ['Output', 'Diagnostics']
+        if any(x in experiment_dir for x in skip_dirs):
+            continue
+
+        # Leave out the grid sizes for which the output exists and that have no manifest, as process_project does
+        experiment_paths = {}
+        for nr_of_squares_in_row, project_path in project_paths.items():
+            experiment_path = os.path.join(project_path, experiment_dir)
+            if (os.path.exists(os.path.join(experiment_path, 'All Squares.csv')) and
+                    os.path.exists(os.path.join(experiment_path, 'All Recordings.csv')) and
+                    tracks_exist(experiment_path) and
+                    not os.path.exists(os.path.join(experiment_path, MANIFEST_FILE_NAME)) and
+                    not paint_force):
+                paint_logger.info(f"Experiment output exists and skipped: {experiment_path}")
+                continue
+            experiment_paths[nr_of_squares_in_row] = experiment_path
+        if not experiment_paths:
+            continue
+
+        # Process the experiment, or leave it for the workers
+        if nr_of_workers > 1:
+            experiment_paths_for_workers.append(experiment_paths)
+        else:
+            process_experiment_with_grid_sizes(experiment_paths, **experiment_parameters)
+        nr_experiments_processed += 1
+
+    if experiment_paths_for_workers:
+        process_experiments_in_pool(experiment_paths_for_workers, experiment_parameters, nr_of_workers,
+                                    process_experiment_with_grid_sizes)
+
+    return nr_experiments_processed
+
+
+def process_experiments_in_pool(
+        experiment_paths: list,
+        experiment_parameters: dict,
+        nr_of_workers: int,
+        process_function=None) -> None:
+    """
+    Processes the Experiments in a pool of worker processes. Each Experiment reads and writes only its own files, so
+    they can be processed independently. The log of each Experiment is reported as one block, in the order of
+    experiment_paths, so the report does not depend on which worker finishes first.
+    Each Experiment is processed with process_function, by default 'process_experiment'.
+    """
+
+    process_function = process_function or process_experiment
+    nr_of_workers = min(nr_of_workers, len(experiment_paths))
+    paint_logger.info(f"Processing {len(experiment_paths)} experiments with {nr_of_workers} workers")
+    with ProcessPoolExecutor(max_workers=nr_of_workers) as executor:
+        futures = [executor.submit(process_experiment_in_worker, experiment_path, experiment_parameters,
+                                   process_function)
+                   for experiment_path in experiment_paths]
+
+        for future in futures:
+            log_records, exception = future.result()
+            for log_record in log_records:
+                paint_logger.handle(log_record)
+            if exception is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise exception
+
+
+class PaintLogCollector(logging.handlers.QueueHandler):
+    """
+    Collects the log records of a worker process, so that they can be handed to the main process and logged there.
+    """
+
+    def __init__(self):
+        super().__init__(queue=None)
+        self.log_records = []
+
+    def enqueue(self, record):
+        self.log_records.append(record)
+
+
+def start_collecting_log_records() -> PaintLogCollector:
+    """
+    Replaces the handlers of the paint logger in a worker process by a collector.
+    """
+
+    log_collector = PaintLogCollector()
+    for handler in list(paint_logger.handlers):
+        paint_logger.removeHandler(handler)
+    paint_logger.addHandler(log_collector)
+    return log_collector
+
+
+def process_experiment_in_worker(experiment_path, experiment_parameters: dict, process_function) -> tuple:
+    """
+    Runs process_function (process_experiment or process_experiment_with_grid_sizes) in a worker process.
+    Nothing is logged directly, the log records are returned to the main process, together with the exception that
+    stopped the processing (if any).
+    """
+
+    log_collector = start_collecting_log_records()
+
+    exception = None
+    try:
+        process_function(experiment_path, **experiment_parameters)
+    except BaseException as e:
+        paint_logger.error(f"Processing of {experiment_path} failed: {e}")
+        exception = e
+
+    return log_collector.log_records, exception
+
+
 # ----------------------------------------------------------------------------------------------------
 # ----------------------------------------------------------------------------------------------------
 # ----------------------------------------------------------------------------------------------------
@@ -120,26 +325,367 @@ def process_experiment(
         nr_of_squares_in_row: int,
         min_required_r_squared: float,
         min_tracks_for_tau: int,
-        paint_force: bool = False) -> None:
+        paint_force: bool = False,
+        nr_of_workers: int = 1) -> None:
     """
     This function processes all Recordings in an Experiment.
     It reads the All Recordings file to find out which Recordings need processing
+    Recordings whose tracks, recording data and parameters did not change since the previous run (as recorded in
+    the manifest) are not processed again, unless paint_force is set.
+    With nr_of_workers larger than 1, the Recordings are processed in parallel in a pool of worker processes.
+    """
+
+    # All settings are taken from one snapshot of Paint.json, so that the run is consistent
+    with use_paint_config_snapshot():
+        # Preparations
+        time_stamp = time.time()
+        start_performance_report()
+
+        # Read the Recordings file, check the integrity and add some columns
+        with measure_stage('Read'):
+            df_recordings_of_experiment = read_recordings_of_experiment(experiment_path)
+        if len(df_recordings_of_experiment) == 0:
+            paint_logger.info(f"No Recordings found in {experiment_path}")
+            return
+
+        # The tracks as written by Run TrackMate are stored in the selected Track Store format
+        convert_tracks(experiment_path)
+
+        # Read the fingerprints of the previous run, and keep its results in case Recordings did not change
+        previous_fingerprints = {} if paint_force else read_manifest(experiment_path)
+        recording_result_columns = ['Tau', 'Density', 'R Squared']
+        if get_tau_bootstrap_settings()[0] > 0:
+            recording_result_columns += TAU_CI_COLUMNS
+        if not set(recording_result_columns).issubset(df_recordings_of_experiment.columns):
+            previous_fingerprints = {}
+        df_previous_results = None
+        if previous_fingerprints:
+            df_previous_results = df_recordings_of_experiment[recording_result_columns]
+
+        # When the tracks do not fit in the memory budget, the Recordings are read and processed one at a time
+        if needs_streaming(experiment_path):
+            track_scan = scan_tracks(experiment_path)
+            if track_scan is not None and track_scan['Contiguous']:
+                generate_squares_of_experiment_streaming(
+                    experiment_path,
+                    df_recordings_of_experiment,
+                    track_scan,
+                    select_parameters,
+                    nr_of_squares_in_row,
+                    min_required_r_squared,
+                    min_tracks_for_tau,
+                    previous_fingerprints,
+                    df_previous_results,
+                    time_stamp)
+                return
+            if track_scan is not None:
+                paint_logger.warning(f"The tracks of a recording are not stored together in {experiment_path}, "
+                                     f"all tracks are read at once")
+
+        # Read the Tracks file and add (or reinitialise two columns for the square and label numbers)
+        with measure_stage('Read'):
+            df_tracks_of_experiment = read_tracks_of_experiment(experiment_path,
+                                                                keep_square_and_label_nrs=bool(previous_fingerprints))
+
+        generate_squares_of_experiment(
+            experiment_path,
+            df_recordings_of_experiment,
+            df_tracks_of_experiment,
+            select_parameters,
+            nr_of_squares_in_row,
+            min_required_r_squared,
+            min_tracks_for_tau,
+            previous_fingerprints,
+            df_previous_results,
+            nr_of_workers,
+            time_stamp)
+
+
+def process_experiment_with_grid_sizes(
+        experiment_paths: dict,
+        select_parameters: dict,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int,
+        paint_force: bool = False,
+        nr_of_workers: int = 1) -> None:
+    """
+    This function processes all Recordings in an Experiment for several grid sizes, reading the input once.
+    experiment_paths maps each number of squares in a row to the Experiment directory in which the output for that
+    grid size is written. All directories hold the same input: the All Recordings and All Tracks files are read from
+    the first one.
+    A grid size is skipped when none of its Recordings changed since the previous run (as recorded in its manifest),
+    otherwise all Recordings are processed for that grid size.
+    """
+
+    # All settings are taken from one snapshot of Paint.json, so that the run is consistent
+    with use_paint_config_snapshot():
+        time_stamp = time.time()
+        input_path = next(iter(experiment_paths.values()))
+        start_performance_report()
+
+        # Read the Recordings and Tracks files once for all grid sizes
+        with measure_stage('Read'):
+            df_recordings_of_experiment = read_recordings_of_experiment(input_path)
+        if len(df_recordings_of_experiment) == 0:
+            paint_logger.info(f"No Recordings found in {input_path}")
+            return
+        for experiment_path in experiment_paths.values():
+            convert_tracks(experiment_path)
+
+        # Tracks that do not fit in the memory budget are read again for every grid size, one Recording at a time
+        if needs_streaming(input_path):
+            for nr_of_squares_in_row, experiment_path in experiment_paths.items():
+                paint_logger.info(f"Generating squares for a grid of {nr_of_squares_in_row} x {nr_of_squares_in_row}")
+                process_experiment(
+                    experiment_path,
+                    select_parameters,
+                    nr_of_squares_in_row,
+                    min_required_r_squared,
+                    min_tracks_for_tau,
+                    paint_force,
+                    1)
+            return
+
+        with measure_stage('Read'):
+            df_tracks_of_experiment = read_tracks_of_experiment(input_path)
+
+        for nr_of_squares_in_row, experiment_path in experiment_paths.items():
+            paint_logger.info(f"Generating squares for a grid of {nr_of_squares_in_row} x {nr_of_squares_in_row}")
+            previous_fingerprints = {} if paint_force else read_manifest(experiment_path)
+            generate_squares_of_experiment(
+                experiment_path,
+                df_recordings_of_experiment.copy(),
+                df_tracks_of_experiment,
+                select_parameters,
+                nr_of_squares_in_row,
+                min_required_r_squared,
+                min_tracks_for_tau,
+                previous_fingerprints,
+                None,
+                nr_of_workers,
+                time_stamp)
+            time_stamp = time.time()
+
+
+def generate_squares_of_experiment(
+        experiment_path: str,
+        df_recordings_of_experiment: pd.DataFrame,
+        df_tracks_of_experiment: pd.DataFrame,
+        select_parameters: dict,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int,
+        previous_fingerprints: dict,
+        df_previous_results: pd.DataFrame,
+        nr_of_workers: int,
+        time_stamp: float) -> None:
+    """
+    Generates the squares of the Recordings of an Experiment that has been read and writes the All Squares, Track
+    Squares, Square Histograms and All Recordings files to experiment_path.
+    The Experiment is skipped when the fingerprints of all Recordings match previous_fingerprints. When
+    df_previous_results (the Tau, Density and R Squared of the previous run) is given, the results of the Recordings
+    that did not change are taken from the existing output files, which requires that df_tracks_of_experiment holds
+    the Square and Label Nrs of the previous run.
+    """
+
+    nr_files = df_tracks_of_experiment['Ext Recording Name'].nunique()
+    df_recordings_of_experiment, recordings_to_process, nr_of_recordings_to_process = select_recordings_to_process(
+        experiment_path, df_recordings_of_experiment, nr_files, select_parameters, nr_of_squares_in_row,
+        min_required_r_squared, min_tracks_for_tau)
+    if recordings_to_process is None:
+        return
+
+    # Determine which Recordings changed since the previous run
+    squares_parameters = get_squares_parameters(
+        select_parameters, nr_of_squares_in_row, min_required_r_squared, min_tracks_for_tau)
+    positions_of_recording = df_tracks_of_experiment.groupby('Ext Recording Name', sort=False, observed=True).indices
+    fingerprints = {}
+    for index, recording_data in recordings_to_process:
+        recording_name = recording_data['Ext Recording Name']
+        fingerprints[recording_name] = fingerprint_recording(
+            recording_data,
+            df_tracks_of_experiment.iloc[positions_of_recording.get(recording_name, [])],
+            squares_parameters)
+    if is_unchanged(experiment_path, fingerprints, previous_fingerprints):
+        return
+
+    previous_squares = read_previous_squares(experiment_path, df_previous_results)
+    recordings_to_reuse = set(recording_name for recording_name, fingerprint in fingerprints.items()
+                              if is_reusable(recording_name, fingerprint, previous_fingerprints, previous_squares))
+    if recordings_to_reuse:
+        paint_logger.info(f"Reusing the squares of {len(recordings_to_reuse)} unchanged recordings in "
+                          f"{experiment_path}")
+
+    # The duration histograms of the squares are plotted in the background, while the next Recordings are processed
+    experiment_results = ExperimentResults(experiment_path, nr_of_squares_in_row)
+    experiment_results.start_plots()
+
+    paint_logger.info(f"Processing {nr_of_recordings_to_process:2d} images in {experiment_path}")
+
+    # With more than one worker, all recordings that changed are processed up front in the pool
+    recording_parameters = make_recording_parameters(
+        select_parameters, experiment_path, nr_of_squares_in_row, min_required_r_squared, min_tracks_for_tau)
+    recordings_to_compute = [(index, recording_data) for index, recording_data in recordings_to_process
+                             if recording_data['Ext Recording Name'] not in recordings_to_reuse]
+    pool_results = {}
+    if nr_of_workers > 1 and len(recordings_to_compute) > 1:
+        pool_results = dict(zip(
+            [index for index, _ in recordings_to_compute],
+            process_recordings_in_pool(df_tracks_of_experiment, recordings_to_compute, recording_parameters,
+                                       nr_of_workers)))
+
+    # --------------------------------------------------------------------------------------------
+    # Loop though selected recordings
+    # --------------------------------------------------------------------------------------------
+
+    for index, recording_data in recordings_to_process:
+        recording_name = recording_data['Ext Recording Name']
+        paint_logger.debug(f"Processing file {len(experiment_results) + 1} of {nr_of_recordings_to_process}: "
+                           f"{recording_name}")
+
+        if index in pool_results:
+            recording_result = pool_results[index]
+        else:
+            df_tracks_of_recording = df_tracks_of_experiment[
+                df_tracks_of_experiment['Ext Recording Name'] == recording_name]
+            if recording_name in recordings_to_reuse:
+                recording_result = previous_results_of_recording(
+                    previous_squares, df_previous_results, index, recording_name, df_tracks_of_recording)
+            else:
+                recording_result = process_tracks_of_recording(
+                    df_tracks_of_recording, recording_data, recording_parameters)
+        if not experiment_results.add(index, recording_name, recording_result):
+            return None
+
+    experiment_results.write(df_recordings_of_experiment, recordings_to_process, fingerprints, squares_parameters)
+    finish_experiment(experiment_path, experiment_results, nr_files, time_stamp, {
+        'Nr of Recordings': len(recordings_to_process),
+        'Nr of Recordings Reused': len(recordings_to_reuse),
+        'Nr of Workers': nr_of_workers,
+        'One Recording at a Time': False})
+
+
+def generate_squares_of_experiment_streaming(
+        experiment_path: str,
+        df_recordings_of_experiment: pd.DataFrame,
+        track_scan: dict,
+        select_parameters: dict,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int,
+        previous_fingerprints: dict,
+        df_previous_results: pd.DataFrame,
+        time_stamp: float) -> None:
+    """
+    Generates the squares of the Recordings of an Experiment like generate_squares_of_experiment, but reads the
+    tracks one Recording at a time, so that only the tracks of one Recording are in memory. Of the tracks, only
+    the key, square and label columns are kept for the Track Squares file and the duration histograms of the squares
+    for the Square Histograms file. The output is the same as that of
+    generate_squares_of_experiment. Recordings are processed one after the other, without a pool of workers.
     """
 
-    # Preparations
-    plot_to_file = get_paint_attribute_with_default('Generate Squares', 'Plot to File', False)
-    time_stamp = time.time()
-    df_squares_of_experiment = pd.DataFrame()
-    df_tracks_of_experiment_with_labels = pd.DataFrame()
+    nr_files = len(track_scan['Recording Names'])
+    df_recordings_of_experiment, recordings_to_process, nr_of_recordings_to_process = select_recordings_to_process(
+        experiment_path, df_recordings_of_experiment, nr_files, select_parameters, nr_of_squares_in_row,
+        min_required_r_squared, min_tracks_for_tau)
+    if recordings_to_process is None:
+        return
+    recordings_of_name = {}
+    for index, recording_data in recordings_to_process:
+        recordings_of_name.setdefault(recording_data['Ext Recording Name'], []).append((index, recording_data))
+
+    squares_parameters = get_squares_parameters(
+        select_parameters, nr_of_squares_in_row, min_required_r_squared, min_tracks_for_tau)
+
+    # The squares of the previous run are small enough to keep, in case Recordings did not change
+    previous_squares = read_previous_squares(experiment_path, df_previous_results)
+
+    paint_logger.info(f"Processing {nr_of_recordings_to_process:2d} images in {experiment_path} "
+                      f"one recording at a time")
+
+    # The plots are started with the first Recording that changed, as the Experiment is skipped when none did
+    experiment_results = ExperimentResults(experiment_path, nr_of_squares_in_row)
+    recording_parameters = make_recording_parameters(
+        select_parameters, experiment_path, nr_of_squares_in_row, min_required_r_squared, min_tracks_for_tau)
+    fingerprints = {}
+    nr_reused = 0
+
+    def process_tracks(recording_name: str, df_tracks_of_recording: pd.DataFrame) -> bool:
+        nonlocal nr_reused
+        for index, recording_data in recordings_of_name[recording_name]:
+            fingerprint = fingerprint_recording(recording_data, df_tracks_of_recording, squares_parameters)
+            fingerprints[recording_name] = fingerprint
+            paint_logger.debug(f"Processing file {len(experiment_results) + 1} of {nr_of_recordings_to_process}: "
+                               f"{recording_name}")
+            if is_reusable(recording_name, fingerprint, previous_fingerprints, previous_squares):
+                recording_result = previous_results_of_recording(
+                    previous_squares, df_previous_results, index, recording_name, df_tracks_of_recording)
+                nr_reused += 1
+            else:
+                experiment_results.start_plots()
+                recording_result = process_tracks_of_recording(
+                    df_tracks_of_recording, recording_data, recording_parameters)
+            if not experiment_results.add(index, recording_name, recording_result):
+                return False
+        return True
+
+    keep_square_and_label_nrs = bool(previous_fingerprints)
+    tracks_by_recording = read_tracks_by_recording(experiment_path, track_scan)
+    while True:
+        with measure_stage('Read'):
+            recording_name, df_tracks_of_recording = next(tracks_by_recording, (None, None))
+            if recording_name in recordings_of_name:
+                df_tracks_of_recording = prepare_tracks(df_tracks_of_recording, keep_square_and_label_nrs)
+        if recording_name is None:
+            break
+        if recording_name not in recordings_of_name:
+            continue
+        if not process_tracks(recording_name, df_tracks_of_recording):
+            return None
+
+    # Recordings without tracks
+    for recording_name in recordings_of_name:
+        if recording_name not in fingerprints:
+            df_tracks_of_recording = prepare_tracks(make_empty_tracks(track_scan), keep_square_and_label_nrs)
+            if not process_tracks(recording_name, df_tracks_of_recording):
+                return None
 
-    # Read the Recordings file, check the integrity and add some columns
-    df_recordings_of_experiment = read_recordings_of_experiment(experiment_path)
-    if len(df_recordings_of_experiment) == 0:
-        paint_logger.info(f"No Recordings found in {experiment_path}")
+    if is_unchanged(experiment_path, fingerprints, previous_fingerprints):
         return
+    if nr_reused:
+        paint_logger.info(f"Reused the squares of {nr_reused} unchanged recordings in {experiment_path}")
+    experiment_results.start_plots()
+
+    experiment_results.write(df_recordings_of_experiment, recordings_to_process, fingerprints, squares_parameters)
+    finish_experiment(experiment_path, experiment_results, nr_files, time_stamp, {
+        'Nr of Recordings': len(recordings_to_process),
+        'Nr of Recordings Reused': nr_reused,
+        'Nr of Workers': 1,
+        'One Recording at a Time': True})
+
+
+# ----------------------------------------------------------------------------------------------------
+# The steps that generate_squares_of_experiment and generate_squares_of_experiment_streaming share. The
+# two differ only in how they get the tracks of each Recording: from the tracks of the Experiment, which are
+# all in memory, or read one Recording at a time.
+# ----------------------------------------------------------------------------------------------------
+
+
+def select_recordings_to_process(
+        experiment_path: str,
+        df_recordings_of_experiment: pd.DataFrame,
+        nr_files: int,
+        select_parameters: dict,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> tuple:
+    """
+    Add the parameters of this run to the Recordings and select the Recordings to process
 
-    # Read the Tracks file and add (or reinitialise two columns for the square and label numbers)
-    df_tracks_of_experiment = read_tracks_of_experiment(experiment_path)
+    :param nr_files: The number of Recordings of which there are tracks
+    :return: The Recordings with the parameters added, a list with the (index, recording data) of the Recordings to
+             process (None when there is nothing to process) and the number of Recordings that are marked to process
+    """
 
     # Add some parameters that the user just specified to the experiment
     df_recordings_of_experiment = add_columns_to_experiment(
@@ -151,77 +697,335 @@ def process_experiment(
         select_parameters['max_allowable_variability'])
 
     # Determine how many names there are from Recordings and Tracks and compare
-    nr_files_tracks = df_tracks_of_experiment['Ext Recording Name'].nunique()
-
     mask = (df_recordings_of_experiment['Process'].fillna('').str.lower().isin(['yes', 'y']) &
             (df_recordings_of_experiment['Nr Tracks'] > 0))
     nr_of_recordings_to_process = mask.sum()
 
-    if nr_of_recordings_to_process != nr_files_tracks:
+    if nr_of_recordings_to_process != nr_files:
         paint_logger.info(f"All Tracks file is not consistent with All Recordings for {experiment_path}")
-    nr_files = nr_files_tracks
     if nr_files <= 0:
         paint_logger.info("No files selected for processing")
-        return
+        return df_recordings_of_experiment, None, nr_of_recordings_to_process
 
-    # --------------------------------------------------------------------------------------------
-    # Loop though selected recordings
-    # --------------------------------------------------------------------------------------------
+    recordings_to_process = [
+        (index, recording_data) for index, recording_data in df_recordings_of_experiment.iterrows()
+        if not (recording_data['Process'] in {'No', 'n', 'N'} or recording_data['Nr Tracks'] == -1)]
+    return df_recordings_of_experiment, recordings_to_process, nr_of_recordings_to_process
 
-    current_image_nr = 1
-    processed = 0
 
-    paint_logger.info(f"Processing {nr_of_recordings_to_process:2d} images in {experiment_path}")
-    for index, recording_data in df_recordings_of_experiment.iterrows():
+def is_unchanged(experiment_path: str, fingerprints: dict, previous_fingerprints: dict) -> bool:
+    """
+    Whether no Recording changed since the previous run, in which case the Experiment is skipped
+    """
 
-        if recording_data['Process'] in {'No', 'n', 'N'} or recording_data['Nr Tracks'] == -1:
-            continue
+    # Squares generated before the Square Histograms file existed are processed again to add it
+    if previous_fingerprints and fingerprints == previous_fingerprints and square_histograms_exist(experiment_path):
+        paint_logger.info(f"No recordings changed since the previous run, skipped {experiment_path}")
+        return True
+    return False
 
-        recording_name = recording_data['Ext Recording Name']
 
-        # Process the Recording
-        paint_logger.debug(f"Processing file {current_image_nr} of {nr_of_recordings_to_process}: {recording_name}")
+def read_previous_squares(experiment_path: str, df_previous_results: pd.DataFrame) -> dict:
+    """
+    The squares of the previous run, for the Recordings that did not change
 
-        df_tracks_of_recording = df_tracks_of_experiment[
-            df_tracks_of_experiment['Ext Recording Name'] == recording_name]
-        df_squares_of_recording, df_tracks_of_recording, recording_tau, recording_r_squared, recording_density = process_recording(
-            df_tracks_of_recording,
-            select_parameters,
-            recording_data,
-            experiment_path,
-            recording_name,
-            nr_of_squares_in_row,
-            min_required_r_squared,
-            min_tracks_for_tau,
-            plot_to_file)
-        if df_squares_of_recording is None:
-            paint_logger.error("Aborted with error")
-            return None
+    :return: The squares of every Recording in All Squares, empty when no previous results can be reused
+    """
+
+    squares_file_path = os.path.join(experiment_path, 'All Squares.csv')
+    if df_previous_results is None or not os.path.exists(squares_file_path):
+        return {}
+    df_previous_squares = read_csv_with_schema(squares_file_path, SQUARES_SCHEMA)
+    return {recording_name: df_squares_of_recording for recording_name, df_squares_of_recording
+            in df_previous_squares.groupby('Ext Recording Name', sort=False, observed=True)}
 
-        # Update the Experiment with the results
-        df_recordings_of_experiment.at[index, 'Ext Recording Name'] = recording_name
-        df_recordings_of_experiment.at[index, 'Tau'] = round(recording_tau, 0)
-        df_recordings_of_experiment.at[index, 'Density'] = round(recording_density, 5)
-        df_recordings_of_experiment.at[index, 'R Squared'] = round(recording_r_squared, 3)
 
-        current_image_nr += 1
-        processed += 1
-        df_squares_of_experiment = pd.concat([df_squares_of_experiment, df_squares_of_recording], ignore_index=True)
-        df_tracks_of_experiment_with_labels = pd.concat([df_tracks_of_experiment_with_labels, df_tracks_of_recording],
-                                                        ignore_index=True)
+def is_reusable(recording_name: str, fingerprint: str, previous_fingerprints: dict, previous_squares: dict) -> bool:
+    return recording_name in previous_squares and previous_fingerprints.get(recording_name) == fingerprint
 
-    # Save the updated tracks to the All Tracks file (the square and label columns have been updated)
-    df_tracks_of_experiment_with_labels.to_csv(os.path.join(experiment_path, 'All Tracks.csv'), index=False)
 
-    # Save df_squares_of_experiment into the All Recordings file
-    df_recordings_of_experiment.to_csv(os.path.join(experiment_path, "All Recordings.csv"), index=False)
+def previous_results_of_recording(
+        previous_squares: dict,
+        df_previous_results: pd.DataFrame,
+        index,
+        recording_name: str,
+        df_tracks_of_recording: pd.DataFrame) -> tuple:
+    """
+    The results of a Recording that did not change, taken from the previous run, in the form process_recording
+    returns them. The tracks hold the Square and Label Nrs of the previous run.
+    """
+
+    recording_tau, recording_density, recording_r_squared, *recording_tau_ci = df_previous_results.loc[index]
+    return (previous_squares[recording_name], df_tracks_of_recording, recording_tau, recording_r_squared,
+            recording_density, recording_tau_ci)
+
+
+def make_recording_parameters(
+        select_parameters: dict,
+        experiment_path: str,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> dict:
+    """
+    The parameters with which every Recording of the Experiment is processed, see process_tracks_of_recording
+    """
+
+    return {
+        'select_parameters': select_parameters,
+        'experiment_path': experiment_path,
+        'nr_of_squares_in_row': nr_of_squares_in_row,
+        'min_required_r_squared': min_required_r_squared,
+        'min_tracks_for_tau': min_tracks_for_tau,
+        'square_engine': get_paint_attribute_with_default('Generate Squares', 'Square Engine', 'Vectorised'),
+        'performance_report': get_performance_report_settings()}
 
-    # Make a unique index and then save df_squares_of_experiment into the All Squares file
-    df_squares_of_experiment = create_unique_key_for_squares(df_squares_of_experiment)
-    df_squares_of_experiment.to_csv(os.path.join(experiment_path, "All Squares.csv"), index=False)
+
+def process_tracks_of_recording(
+        df_tracks_of_recording: pd.DataFrame,
+        recording_data: pd.Series,
+        recording_parameters: dict) -> tuple:
+    """
+    Clear the square and label numbers of the tracks of a Recording and process it with process_recording
+    """
+
+    df_tracks_of_recording['Square Nr'] = None
+    df_tracks_of_recording['Label Nr'] = None
+    return process_recording(
+        df_tracks_of_recording,
+        recording_parameters['select_parameters'],
+        recording_data,
+        recording_parameters['experiment_path'],
+        recording_data['Ext Recording Name'],
+        recording_parameters['nr_of_squares_in_row'],
+        recording_parameters['min_required_r_squared'],
+        recording_parameters['min_tracks_for_tau'],
+        recording_parameters['square_engine'])
+
+
+class ExperimentResults:
+    """
+    The results of the Recordings of an Experiment: the squares, the Tau, Density and R Squared of every Recording,
+    the Square and Label Nr of every track and the duration histograms of the squares. The results are collected as
+    the Recordings are processed and written together, in the order of All Recordings. With 'Plot to File', the plots
+    of the squares are rendered in the background from the moment start_plots is called; the plots of Recordings
+    that were added before are kept until then.
+    """
+
+    def __init__(self, experiment_path: str, nr_of_squares_in_row: int):
+        self.experiment_path = experiment_path
+        self.nr_of_squares_in_row = nr_of_squares_in_row
+        self.recording_results = {}
+        self.track_squares_of_recordings = {}
+        self.square_histograms_of_recordings = {}
+        self.plot_to_file = get_paint_attribute_with_default('Generate Squares', 'Plot to File', False)
+        self.plot_max_x = get_plot_max()
+        self.plot_queue = None
+        self.pending_plot_specs = []
+
+    def __len__(self):
+        return len(self.recording_results)
+
+    def start_plots(self) -> None:
+        if self.plot_to_file and self.plot_queue is None:
+            self.plot_queue = start_plot_queue(self.experiment_path)
+            self.plot_queue.put(self.pending_plot_specs)
+            self.pending_plot_specs = []
+
+    def add(self, index, recording_name: str, recording_result: tuple) -> bool:
+        """
+        Add the results of a Recording, as process_recording returns them
+
+        :return: False when the Recording could not be processed, in which case the Experiment is aborted
+        """
+
+        df_squares_of_recording, df_tracks_of_recording, recording_tau, recording_r_squared, recording_density, \
+            recording_tau_ci = recording_result
+        if df_squares_of_recording is None:
+            paint_logger.error("Aborted with error")
+            if self.plot_queue is not None:
+                self.plot_queue.close()
+            return False
+
+        self.recording_results[index] = (
+            df_squares_of_recording, recording_tau, recording_density, recording_r_squared, recording_tau_ci)
+        self.track_squares_of_recordings[index] = df_tracks_of_recording[TRACK_SQUARES_COLUMNS]
+        self.square_histograms_of_recordings[index] = DurationHistograms.from_tracks(
+            df_tracks_of_recording, self.nr_of_squares_in_row * self.nr_of_squares_in_row).to_dataframe(recording_name)
+        if self.plot_to_file:
+            plot_specs = make_plot_specs(
+                df_squares_of_recording, self.square_histograms_of_recordings[index], self.plot_max_x)
+            if self.plot_queue is not None:
+                self.plot_queue.put(plot_specs)
+            else:
+                self.pending_plot_specs.extend(plot_specs)
+        return True
+
+    def write(
+            self,
+            df_recordings_of_experiment: pd.DataFrame,
+            recordings_to_process: list,
+            fingerprints: dict,
+            squares_parameters: dict) -> None:
+        """
+        Write the Track Squares, Square Histograms, All Recordings and All Squares files and the manifest
+        """
+
+        # The manifest is written again once all output files are complete
+        remove_manifest(self.experiment_path)
+
+        with measure_stage('Write'):
+            # Save the square and label of every track to the Track Squares file, the tracks themselves do not change
+            write_track_squares(pd.concat(
+                [self.track_squares_of_recordings[index] for index, _ in recordings_to_process], ignore_index=True),
+                self.experiment_path)
+
+            # Save the duration histogram of every square, for pooled Tau calculations without the tracks
+            write_square_histograms(pd.concat(
+                [self.square_histograms_of_recordings[index] for index, _ in recordings_to_process],
+                ignore_index=True), self.experiment_path)
+
+            # Update the Experiment with the results and collect the squares of all recordings in one table
+            squares_of_experiment = SquareTable(
+                len(recordings_to_process) * self.nr_of_squares_in_row * self.nr_of_squares_in_row)
+            for index, recording_data in recordings_to_process:
+                df_squares_of_recording, recording_tau, recording_density, recording_r_squared, recording_tau_ci = \
+                    self.recording_results[index]
+                df_recordings_of_experiment.at[index, 'Ext Recording Name'] = recording_data['Ext Recording Name']
+                df_recordings_of_experiment.at[index, 'Tau'] = round(recording_tau, 0)
+                df_recordings_of_experiment.at[index, 'Density'] = round(recording_density, 5)
+                df_recordings_of_experiment.at[index, 'R Squared'] = round(recording_r_squared, 3)
+                for tau_ci_column, tau_ci_bound in zip(TAU_CI_COLUMNS, recording_tau_ci):
+                    df_recordings_of_experiment.at[index, tau_ci_column] = round(tau_ci_bound, 0)
+                squares_of_experiment.add_rows(df_squares_of_recording)
+
+            # Save df_squares_of_experiment into the All Recordings file
+            df_recordings_of_experiment.to_csv(
+                os.path.join(self.experiment_path, "All Recordings.csv"), index=False)
+
+            # Make a unique index and then save df_squares_of_experiment into the All Squares file
+            df_squares_of_experiment = create_unique_key_for_squares(squares_of_experiment.to_dataframe())
+            df_squares_of_experiment.to_csv(os.path.join(self.experiment_path, "All Squares.csv"), index=False)
+
+            # Record the fingerprints, so that a next run only processes the Recordings that changed
+            write_manifest(self.experiment_path, fingerprints, squares_parameters)
+
+
+def finish_experiment(
+        experiment_path: str,
+        experiment_results: ExperimentResults,
+        nr_files: int,
+        time_stamp: float,
+        run_statistics: dict) -> None:
+    """
+    Wait for the plots that are still being rendered and report the run
+    """
+
+    if experiment_results.plot_queue is not None:
+        with measure_stage('Plot'):
+            experiment_results.plot_queue.close()
 
     run_time = round(time.time() - time_stamp, 1)
     paint_logger.info(f"Processed  {nr_files:2d} images in {experiment_path} in {format_time_nicely(run_time)}")
+    paint_logger.debug(f"Fit cache of the main process: {get_fit_cache_statistics()}")
+    write_performance_report(experiment_path, time.time() - time_stamp, {
+        **run_statistics,
+        'Fit Cache': get_fit_cache_statistics()})
+
+
+def process_recordings_in_pool(
+        df_tracks_of_experiment: pd.DataFrame,
+        recordings_to_process: list,
+        recording_parameters: dict,
+        nr_of_workers: int) -> list:
+    """
+    Processes the Recordings of an Experiment in a pool of worker processes.
+    The track columns needed for the squares are placed in shared memory, ordered by Recording, so that each worker
+    reads only the rows of its own Recording and no DataFrames have to be pickled. Workers return their squares and
+    the Square Nr and Label Nr of each track, which are assigned to the tracks of the Experiment here.
+    The results are returned in the order of recordings_to_process, in the same form as process_recording returns them.
+    """
+
+    # Order the track rows by Recording, so that the rows of each Recording form one block
+    positions_of_recording = df_tracks_of_experiment.groupby('Ext Recording Name', sort=False, observed=True).indices
+    recording_positions = [
+        positions_of_recording.get(recording_data['Ext Recording Name'], np.array([], dtype=np.int64))
+        for _, recording_data in recordings_to_process]
+    ends = np.cumsum([len(positions) for positions in recording_positions])
+    starts = ends - [len(positions) for positions in recording_positions]
+
+    shared_columns, shared_memory_blocks = share_track_columns(
+        df_tracks_of_experiment, TRACK_COLUMNS_FOR_SQUARES, np.concatenate(recording_positions))
+
+    recording_results = []
+    try:
+        nr_of_workers = min(nr_of_workers, len(recordings_to_process))
+        paint_logger.info(f"Processing {len(recordings_to_process)} recordings with {nr_of_workers} workers")
+        with ProcessPoolExecutor(max_workers=nr_of_workers) as executor:
+            futures = [executor.submit(process_recording_in_worker, shared_columns, int(start), int(end),
+                                       recording_data, recording_parameters)
+                       for (_, recording_data), start, end in zip(recordings_to_process, starts, ends)]
+
+            for future, positions in zip(futures, recording_positions):
+                log_records, stage_records, exception, result = future.result()
+                for log_record in log_records:
+                    paint_logger.handle(log_record)
+                add_stage_records(stage_records)
+                if exception is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise exception
+
+                # Give the tracks of the Recording their square and label numbers
+                df_squares_of_recording, square_nrs, label_nrs, recording_tau, recording_r_squared, recording_density, \
+                    recording_tau_ci = result
+                df_tracks_of_recording = df_tracks_of_experiment.iloc[positions]
+                df_tracks_of_recording['Square Nr'] = square_nrs
+                df_tracks_of_recording['Label Nr'] = label_nrs
+                recording_results.append((df_squares_of_recording, df_tracks_of_recording, recording_tau,
+                                          recording_r_squared, recording_density, recording_tau_ci))
+    finally:
+        release_track_columns(shared_memory_blocks, unlink=True)
+
+    return recording_results
+
+
+def process_recording_in_worker(
+        shared_columns: dict,
+        start: int,
+        end: int,
+        recording_data: pd.Series,
+        recording_parameters: dict) -> tuple:
+    """
+    Runs process_recording in a worker process on the shared track rows start up to end.
+    Returns the collected log records, the stage records of the performance report, the exception that stopped the
+    processing (if any) and the results: the squares, the Square Nr and Label Nr of each track and the Tau, R Squared,
+    Density and Tau confidence interval of the Recording.
+    """
+
+    log_collector = start_collecting_log_records()
+    start_performance_report(recording_parameters['performance_report'])
+
+    exception = None
+    result = None
+    df_tracks_of_recording, shared_memory_blocks = attach_track_columns(shared_columns, start, end)
+    try:
+        recording_name = recording_data['Ext Recording Name']
+        df_tracks_of_recording['Ext Recording Name'] = recording_name
+        df_tracks_of_recording['Unique Key'] = np.arange(start, end)
+        df_tracks_of_recording.set_index('Unique Key', inplace=True, drop=False)
+
+        df_squares_of_recording, df_tracks_of_recording, recording_tau, recording_r_squared, recording_density, \
+            recording_tau_ci = process_tracks_of_recording(df_tracks_of_recording, recording_data, recording_parameters)
+        result = (df_squares_of_recording,
+                  df_tracks_of_recording['Square Nr'].to_numpy(),
+                  df_tracks_of_recording['Label Nr'].to_numpy(),
+                  recording_tau, recording_r_squared, recording_density, recording_tau_ci)
+    except BaseException as e:
+        paint_logger.error(f"Processing of {recording_data['Ext Recording Name']} failed: {e}")
+        exception = e
+    finally:
+        release_track_columns(shared_memory_blocks, unlink=False)
+
+    return log_collector.log_records, collect_stage_records(), exception, result
 
 
 # ----------------------------------------------------------------------------------------------------
@@ -242,30 +1046,22 @@ def process_recording(
         nr_of_squares_in_row: int,
         min_required_r_squared: float,
         min_tracks_for_tau: int,
-        plot_to_file: False) -> tuple:
+        square_engine: str = 'Vectorised') -> tuple:
     """
     This function processes a single Recording in an Experiment. It creates a grid of squares.
     For each square, the Tau and Density ratio is calculated. The squares are then filtered on visibility.
+    The squares are generated by the vectorised engine, unless square_engine is 'Per Square', in which case the
+    original square by square path is used (kept for parity testing).
     """
 
-    # Create the Plot directory if needed
-    if plot_to_file:
-        plot_dir = os.path.join(experiment_path, 'Plot')
-        if not os.path.exists(plot_dir):
-            os.makedirs(plot_dir)
-        else:
-            delete_files_in_directory(plot_dir)
+    # Fit results can be kept on disk in the Project directory, which holds the Experiment directories
+    use_fit_cache_directory(os.path.dirname(os.path.normpath(experiment_path)))
 
     # -----------------------------------------------------------------------------------------------------
     # A df_squares_of_recording dataframe is generated and, if the 'process_square_tau' flag is set, for every square the
     # Tau and Density are calculated. The results are stored in 'All Squares'.
     # -----------------------------------------------------------------------------------------------------
 
-    # Create the tau_matrix
-    tau_matrix = np.zeros((nr_of_squares_in_row, nr_of_squares_in_row), dtype=int)
-
-    # Create an empty squares dataframe, that will contain the data for each square
-    df_squares_of_recording = pd.DataFrame()
     nr_total_squares = int(nr_of_squares_in_row * nr_of_squares_in_row)
     square_area = calc_area_of_square(nr_of_squares_in_row)
 
@@ -273,45 +1069,66 @@ def process_recording(
     # Generate the data for a square in a row and append it to the squares dataframe
     # --------------------------------------------------------------------------------------------
 
-    for square_seq_nr in range(nr_total_squares):
-        # Calculate the square_data and column number from the sequence number (all are 0-based)
-        row_nr, col_nr = get_row_and_column(square_seq_nr, nr_of_squares_in_row)
-        concentration = float(recording_data['Concentration'])
-
-        square_data = process_square(
-            df_tracks_of_recording,
+    if square_engine == 'Per Square':
+        with measure_stage('Binning', recording_name):
+            # Create an empty squares table, that will contain the data for each square
+            squares_of_recording = SquareTable(nr_total_squares)
+            for square_seq_nr in range(nr_total_squares):
+                # Calculate the square_data and column number from the sequence number (all are 0-based)
+                row_nr, col_nr = get_row_and_column(square_seq_nr, nr_of_squares_in_row)
+                concentration = float(recording_data['Concentration'])
+
+                square_data = process_square(
+                    df_tracks_of_recording,
+                    df_tracks_of_recording,
+                    recording_data,
+                    nr_of_squares_in_row,
+                    concentration,
+                    min_required_r_squared,
+                    min_tracks_for_tau,
+                    square_area,
+                    square_seq_nr,
+                    row_nr,
+                    col_nr)
+
+                # And add it to the squares table
+                squares_of_recording.add_record(square_data)
+            df_squares_of_recording = squares_of_recording.to_dataframe()
+    else:
+        df_squares_of_recording, df_tracks_of_recording = generate_squares_of_recording(
             df_tracks_of_recording,
             recording_data,
             nr_of_squares_in_row,
-            concentration,
+            float(recording_data['Concentration']),
             min_required_r_squared,
             min_tracks_for_tau,
-            square_area,
-            square_seq_nr,
-            row_nr,
-            col_nr)
-
-        # And add it to the squares dataframe and the recording_tau to the tau_matrix
-        df_squares_of_recording = pd.concat([df_squares_of_recording, pd.DataFrame.from_records([square_data])])
-        tau_matrix[row_nr, col_nr] = int(square_data['Tau'])
-
-    nr_tracks_in_background = calc_average_track_count_in_background_squares(df_squares_of_recording,
-                                                                             int(0.1 * nr_total_squares))
-    if nr_tracks_in_background == 0:
-        df_squares_of_recording['Density Ratio'] = 999.9  # Special code
-    else:
-        df_squares_of_recording['Density Ratio'] = round(df_squares_of_recording['Nr Tracks'] / nr_tracks_in_background,
-                                                         1)
+            square_area)
 
-    # Assign labels in All Squares, so that selected tracks are assigned to squares.
-    select_squares_with_parameters(
-        df_squares=df_squares_of_recording,
-        select_parameters=select_parameters,
-        nr_of_squares_in_row=nr_of_squares_in_row,
-        only_valid_tau=True)
-    df_squares_of_recording = create_unique_key_for_squares(df_squares_of_recording)
-    df_squares_of_recording, df_tracks_of_recording = label_selected_squares_and_tracks(df_squares_of_recording,
-                                                                                        df_tracks_of_recording)
+    count_tau_outcomes(recording_name, df_squares_of_recording['Tau'])
+
+    with measure_stage('Selection', recording_name):
+        nr_tracks_in_background = calc_average_track_count_in_background_squares(df_squares_of_recording,
+                                                                                 int(0.1 * nr_total_squares))
+        if nr_tracks_in_background == 0:
+            df_squares_of_recording['Density Ratio'] = 999.9  # Special code
+        else:
+            df_squares_of_recording['Density Ratio'] = round(
+                df_squares_of_recording['Nr Tracks'] / nr_tracks_in_background, 1)
+
+        # Assign labels in All Squares, so that selected tracks are assigned to squares.
+        select_squares_with_parameters(
+            df_squares=df_squares_of_recording,
+            select_parameters=select_parameters,
+            nr_of_squares_in_row=nr_of_squares_in_row,
+            only_valid_tau=True)
+        df_squares_of_recording = create_unique_key_for_squares(df_squares_of_recording)
+
+    # Labeling and the merge of the labels into the tracks are measured separately (this is what
+    # label_selected_squares_and_tracks does, which returns the tracks it was given)
+    with measure_stage('Labeling', recording_name):
+        label_selected_squares(df_squares_of_recording)
+    with measure_stage('Relabel Merge', recording_name):
+        relabel_tracks(df_squares_of_recording, df_tracks_of_recording)
 
     # ----------------------------------------------------------------------------------------------------
     # Now do the single mode processing: determine a single Tau and Density per image, i.e., for all squares
@@ -321,16 +1138,20 @@ def process_recording(
     # Refresh df_tracks_of_recording now to pick up Label and Square Nrs
     df_tracks_of_recording = df_tracks_of_recording[df_tracks_of_recording['Ext Recording Name'] == recording_name]
 
-    recording_tau, recording_r_squared, recording_density = calculate_tau_and_density_for_recording(
-        df_squares_of_recording,
-        df_tracks_of_recording,
-        min_tracks_for_tau,
-        min_required_r_squared,
-        nr_of_squares_in_row,
-        float(recording_data['Concentration']),
-        select_parameters)
+    with measure_stage('Recording Tau', recording_name):
+        recording_tau, recording_r_squared, recording_density, *recording_tau_ci = \
+            calculate_tau_and_density_for_recording(
+                df_squares_of_recording,
+                df_tracks_of_recording,
+                min_tracks_for_tau,
+                min_required_r_squared,
+                nr_of_squares_in_row,
+                float(recording_data['Concentration']),
+                select_parameters,
+                nr_of_bootstrap_replicates=get_tau_bootstrap_settings()[0])
 
-    return df_squares_of_recording, df_tracks_of_recording, recording_tau, recording_r_squared, recording_density
+    return (df_squares_of_recording, df_tracks_of_recording, recording_tau, recording_r_squared, recording_density,
+            recording_tau_ci)
 
 
 # ----------------------------------------------------------------------------------------------------
@@ -364,26 +1185,30 @@ def process_square(
     df_tracks_of_experiment.loc[df_tracks_of_square['Unique Key'], 'Square Nr'] = int(square_seq_nr)
 
     # Provide reasonable values for squares not containing any tracks
+    nr_of_bootstrap_replicates, _ = get_tau_bootstrap_settings()
     nr_of_tracks_in_square = len(df_tracks_of_square)
     if nr_of_tracks_in_square == 0:
         r_squared = 0
         tau = -1
+        tau_ci = (-1, -1)
         density = 0
         variability = 0
     else:
-        # Calculate the Tau and R squared for the square
+        # Calculate the Tau and R squared (and the confidence interval of the Tau, if requested) for the square
         df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks_of_square)
-        tau, r_squared = calculate_tau(
+        tau, r_squared, *tau_ci = calculate_tau(
             df_tracks_for_tau,
             min_tracks_for_tau,
-            min_required_r_squared)
+            min_required_r_squared,
+            nr_of_bootstrap_replicates=nr_of_bootstrap_replicates)
 
         # Calculate the density for the square
         density = calculate_density(
             nr_tracks=nr_of_tracks_in_square, area=square_area, time=100, concentration=concentration)
 
         # Calculate the variability for the square
-        variability = calc_variability(df_tracks_of_square, square_seq_nr, nr_of_squares_in_row, 10)
+        granularity = get_paint_attribute_with_default('Generate Squares', 'Variability Granularity', 10)
+        variability = calc_variability(df_tracks_of_square, square_seq_nr, nr_of_squares_in_row, granularity)
 
     # Create the new squares record to add all the data for this square
     square_data = {
@@ -416,6 +1241,8 @@ def process_square(
         'Density Ratio': 0.0,
         'Tau': round(tau, 0),
         'R Squared': round(r_squared, 2),
+        **({'Tau CI Low': round(tau_ci[0], 0), 'Tau CI High': round(tau_ci[1], 0)}
+           if nr_of_bootstrap_replicates > 0 else {}),
 
         'Median Diffusion Coefficient': round(df_tracks_of_square['Diffusion Coefficient'].median(), 4),
         'Mean Diffusion Coefficient': round(df_tracks_of_square['Diffusion Coefficient'].mean(), 4),
@@ -458,13 +1285,19 @@ def calculate_tau_and_density_for_recording(
         min_required_r_squared: float,
         nr_of_squares_in_row: int,
         concentration: float,
-        select_parameters: dict
+        select_parameters: dict,
+        duration_histograms: DurationHistograms = None,
+        nr_of_bootstrap_replicates: int = 0
 ) -> tuple:
     """
     This function calculates a single Tau and Density for a Recording. It does this by considering all the tracks
     in the image that meet the selection criteria.
     Note that also squares are included for which no square Tau could be calculated (provided they meet the selection
     criteria). The Tau and Density are calculated for the entire image, not for individual squares.
+    The Tau is fitted to the sum of the duration histograms of the selected squares. These are made from
+    df_recording_tracks, unless the duration histograms of the Recording are passed in.
+    With nr_of_bootstrap_replicates the bootstrap confidence interval of the Tau is calculated as well (see
+    calculate_tau_confidence_intervals) and the lower and upper bound are returned after the Tau, R2 and Density.
     """
 
     # Within that recording use all the selected squares. Note: no need to filter out squares with Ta < 0
@@ -473,25 +1306,27 @@ def calculate_tau_and_density_for_recording(
         select_parameters=select_parameters,
         nr_of_squares_in_row=nr_of_squares_in_row,
         only_valid_tau=False)
-    df_squares_for_single_tau = df_squares[df_squares['Selected']]
-
-    # Select only the tracks that fall within these squares.
-    # The following code filters df_tracks to include rows where Square Nr values match those
-    # in df_squares_for_single_tau
+    square_nrs_for_single_tau = df_squares.loc[df_squares['Selected'], 'Square Nr'].to_numpy()
 
-    df_tracks_for_tau = df_recording_tracks[
-        df_recording_tracks['Square Nr'].isin(df_squares_for_single_tau['Square Nr'])]
-    nr_of_tracks_for_single_tau = len(df_tracks_for_tau)
+    # The tracks that fall within these squares are counted for the Density and their durations are used for the Tau
+    if duration_histograms is None:
+        duration_histograms = DurationHistograms.from_tracks(df_recording_tracks, nr_of_squares_in_row ** 2)
+    nr_of_tracks_for_single_tau = duration_histograms.nr_tracks(square_nrs_for_single_tau)
 
-    df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks_for_tau)
-    tau, r_squared = calculate_tau(
-        df_tracks_for_tau,
+    histogram = duration_histograms.histogram(square_nrs_for_single_tau)
+    taus, r_squareds = calculate_taus_from_histograms(
+        [histogram],
         min_tracks_for_tau,
         min_required_r_squared)
+    tau, r_squared = taus[0], r_squareds[0]
 
     # Calculate the Density
     area = calc_area_of_square(nr_of_squares_in_row)
     density = calculate_density(
         nr_tracks=nr_of_tracks_for_single_tau, area=area, time=100, concentration=concentration)
 
+    if nr_of_bootstrap_replicates > 0:
+        tau_ci_lows, tau_ci_highs = calculate_tau_confidence_intervals(
+            [histogram], taus, nr_of_bootstrap_replicates)
+        return tau, r_squared, density, tau_ci_lows[0], tau_ci_highs[0]
     return tau, r_squared, density
@@ -40,6 +40,7 @@ class GenerateSquaresDialog:
         min_required_r_squared = get_paint_attribute_with_default ('Generate Squares', 'Min Required R Squared', 0.9)
         min_required_density_ratio = get_paint_attribute_with_default ('Generate Squares', 'Min Required Density Ratio', 2)
         max_allowable_variability = get_paint_attribute_with_default ('Generate Squares', 'Max Allowable Variability', 10)
+        nr_of_workers = get_paint_attribute_with_default ('Generate Squares', 'Nr of Workers', 1)
 
         self.project_directory = get_paint_attribute_with_default ('User Directories', 'Project Directory', '')
         self.experiment_directory = get_paint_attribute_with_default ('User Directories', 'Experiment Directory', '')
@@ -58,6 +59,7 @@ class GenerateSquaresDialog:
         self.min_required_r_squared = tk.DoubleVar(value=min_required_r_squared)
         self.min_required_density_ratio = tk.DoubleVar(value=min_required_density_ratio)
         self.max_allowable_variability = tk.DoubleVar(value=max_allowable_variability)
+        self.nr_of_workers = tk.IntVar(value=nr_of_workers)
 
     def create_ui(self, _root):
         """Create and layout the UI components."""
@@ -98,6 +100,7 @@ class GenerateSquaresDialog:
         msg_min_required_r_squared = "The minimum required R-squared value for the tracks. Tau values with lower R-squared values are discarded."
         msg_min_required_density_ratio = "The minimum required density ratio for the tracks. Used to distinguish 'cell' squares from background"
         msg_max_allowable_variability = "The maximum allowable variability for the tracks. Used to filter out squares with high variability."
+        msg_nr_of_workers = "The number of Experiments of a Project, or Recordings of an Experiment, that are processed in parallel. Use 1 to process them one after the other."
 
         params = [
             ("Nr of Squares in Row", self.nr_of_squares_in_row, 1, msg_nr_of_squares),
@@ -105,6 +108,7 @@ class GenerateSquaresDialog:
             ("Min allowable R-squared", self.min_required_r_squared, 3, msg_min_required_r_squared),
             ("Min Required Density Ratio", self.min_required_density_ratio, 4, msg_min_required_density_ratio),
             ("Max Allowable Variability", self.max_allowable_variability, 5, msg_max_allowable_variability),
+            ("Nr of Workers", self.nr_of_workers, 6, msg_nr_of_workers),
         ]
 
         for label_text, var, row, tooltip in params:
@@ -167,12 +171,15 @@ class GenerateSquaresDialog:
             messagebox.showwarning(title='Warning', message="The selected directory does not exist")
             return
 
+        generate_parameters = {}
         self.level, _ = classify_directory(self.paint_directory)
         if self.level == 'Project':
             generate_function = process_project
+            generate_parameters['nr_of_workers'] = self.nr_of_workers.get()
             self.project_directory = self.paint_directory
         elif self.level == 'Experiment':
             generate_function = process_experiment
+            generate_parameters['nr_of_workers'] = self.nr_of_workers.get()
             self.experiment_directory = self.paint_directory
         else:
             msg = "The selected directory does not seem to be a project directory, nor an experiment directory"
@@ -194,7 +201,8 @@ class GenerateSquaresDialog:
             nr_of_squares_in_row=self.nr_of_squares_in_row.get(),
             min_required_r_squared=self.min_required_r_squared.get(),
             min_tracks_for_tau=self.min_tracks_for_tau.get(),
-            paint_force=True
+            paint_force=True,
+            **generate_parameters
         )
         run_time = time.time() - start_time
         paint_logger.info(f"Total processing time is {format_time_nicely(run_time)}")
@@ -207,6 +215,7 @@ class GenerateSquaresDialog:
         update_paint_attribute('Generate Squares', 'Min Required R Squared', self.min_required_r_squared.get())
         update_paint_attribute('Generate Squares', 'Min Required Density Ratio', self.min_required_density_ratio.get())
         update_paint_attribute('Generate Squares', 'Max Allowable Variability', self.max_allowable_variability.get())
+        update_paint_attribute('Generate Squares', 'Nr of Workers', self.nr_of_workers.get())
 
         update_paint_attribute('User Directories', 'Project Directory', self.project_directory)
         update_paint_attribute('User Directories', 'Experiment Directory', self.experiment_directory)
@@ -5,14 +5,25 @@ import numpy as np
 import pandas as pd
 
 from src.Application.Generate_Squares.Curvefit_and_Plot import (
+    bootstrap_tau,
     compile_duration,
-    curve_fit_and_plot
+    fit_duration_histograms,
+    tau_fitters
 )
+from src.Application.Support.Paint_Schema import (
+    RECORDINGS_SCHEMA,
+    read_csv_with_schema)
+from src.Application.Support.Track_Store import read_tracks
 from src.Fiji.LoggerConfig import paint_logger
 from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
 
 pd.options.mode.copy_on_write = True
 
+_warned_for_unknown_tau_fitter = False
+
+# The columns of All Squares and All Recordings with the bootstrap confidence interval of the Tau
+TAU_CI_COLUMNS = ['Tau CI Low', 'Tau CI High']
+
 
 def calculate_density(nr_tracks: int, area: float, time: float, concentration: float) -> float:
     """
@@ -84,7 +95,7 @@ def calc_variability(df_tracks, square_nr, nr_of_squares_in_row, granularity):
         height = width
 
         # Get the grid indices for this track and update the matrix
-        xi, yi = get_indices(x, y, width, height, square_nr, nr_of_squares_in_row, 10)
+        xi, yi = get_indices(x, y, width, height, square_nr, nr_of_squares_in_row, granularity)
         matrix[yi, xi] += 1
 
     # Calculate the variability by dividing the standard deviation by the average
@@ -97,6 +108,48 @@ def calc_variability(df_tracks, square_nr, nr_of_squares_in_row, granularity):
     return variability
 
 
+def calc_variability_of_squares(x, y, square_nrs, nr_of_squares_in_row: int, granularity: int) -> np.ndarray:
+    """
+    The variability of all squares of a Recording at once. The tracks are counted in one histogram over all
+    squares x the granularity x granularity grid cells in each square, from which the standard deviation and the
+    average per square follow. The result matches calc_variability for each square.
+    :param x: The Track X Locations
+    :param y: The Track Y Locations
+    :param square_nrs: The square sequence number of each track, -1 for tracks outside the grid
+    :param nr_of_squares_in_row: The number of rows and columns in the image
+    :param granularity: Specifies how fine the grid is that is created in each square
+    :return: An array with the variability of every square, 0 for squares without tracks
+    """
+
+    nr_total_squares = nr_of_squares_in_row * nr_of_squares_in_row
+    width = 82.0864 / nr_of_squares_in_row
+    height = width
+
+    square_nrs = np.asarray(square_nrs)
+    in_grid = square_nrs >= 0
+    square_nrs = square_nrs[in_grid]
+    x = np.asarray(x, dtype=float)[in_grid]
+    y = np.asarray(y, dtype=float)[in_grid]
+
+    # Determine the grid indices of the tracks as get_indices does (int() truncates towards zero)
+    x0 = (square_nrs % nr_of_squares_in_row) * width
+    y0 = (square_nrs // nr_of_squares_in_row) * height
+    xi = np.trunc(((x - x0) / width) * granularity).astype(np.int64).clip(0, granularity - 1)
+    yi = np.trunc(((y - y0) / height) * granularity).astype(np.int64).clip(0, granularity - 1)
+
+    # Count the tracks of all squares in one histogram, with one row of grid cells per square
+    cells = (square_nrs * granularity + yi) * granularity + xi
+    matrix = np.bincount(cells, minlength=nr_total_squares * granularity * granularity)
+    matrix = matrix.reshape(nr_total_squares, granularity * granularity)
+
+    # Calculate the variability by dividing the standard deviation by the average
+    std = np.std(matrix, axis=1)
+    mean = np.mean(matrix, axis=1)
+    variability = np.zeros(nr_total_squares)
+    np.divide(std, mean, out=variability, where=mean != 0)
+    return variability
+
+
 def get_indices(x1: float, y1: float, width: float, height: float, square_seq_nr: int, nr_of_squares_in_row: int,
                 granularity: int) -> tuple[int, int]:
     """
@@ -216,7 +269,7 @@ def extra_constraints_on_tracks_for_tau_calculation(df_tracks_in_square):
 
 
 def create_unique_key_for_tracks(df):
-    df['Unique Key'] = df['Ext Recording Name'] + ' - ' + df['Track Label'].str.split('_').str[1]
+    df['Unique Key'] = df['Ext Recording Name'].astype(str) + ' - ' + df['Track Label'].str.split('_').str[1]
     df.set_index('Unique Key', inplace=True, drop=False)
 
     # Reorder the columns
@@ -259,6 +312,13 @@ def add_columns_to_experiment(
     df_experiment.loc[mask, 'Density'] = 0
     df_experiment.loc[mask, 'R Squared'] = 0.0
 
+    # The confidence interval of the Tau is only there when it is calculated, not left over from an earlier run
+    if get_tau_bootstrap_settings()[0] > 0:
+        df_experiment.loc[mask, 'Tau CI Low'] = 0
+        df_experiment.loc[mask, 'Tau CI High'] = 0
+    else:
+        df_experiment = df_experiment.drop(columns=TAU_CI_COLUMNS, errors='ignore')
+
     return df_experiment
 
 
@@ -280,34 +340,154 @@ def pack_select_parameters(
     return select_parameters
 
 
+def get_tau_fitter() -> str:
+    """
+    The fitter for the Tau: 'Curve Fit' fits every histogram with scipy's curve_fit, 'Batched' fits all histograms
+    of a Recording at once with the vectorised fitter, 'Trust Region' fits every histogram with the analytic Jacobian
+    from an estimated starting point and 'Maximum Likelihood' estimates the Tau from the mean track duration, without
+    fitting
+    """
+
+    global _warned_for_unknown_tau_fitter
+
+    tau_fitter = get_paint_attribute_with_default('Generate Squares', 'Tau Fitter', 'Curve Fit')
+    if tau_fitter not in tau_fitters:
+        if not _warned_for_unknown_tau_fitter:
+            paint_logger.error(f"Unknown Tau Fitter '{tau_fitter}' in Paint.json, the Tau is fitted with "
+                               f"'Curve Fit'. Known fitters: {', '.join(tau_fitters)}")
+            _warned_for_unknown_tau_fitter = True
+        return 'Curve Fit'
+    return tau_fitter
+
+
 def calculate_tau(
         df_tracks_for_tau: pd.DataFrame,
         min_tracks_for_tau: int,
-        min_required_r_squared: float
+        min_required_r_squared: float,
+        tau_fitter: str = None,
+        nr_of_bootstrap_replicates: int = 0
 ) -> tuple:
     """
     Calculate the Tau for the square if requested. Use error codes:
        -1: too few points to try to fit
        -2: curve fitting tries, but failed
        -3: curve fitting succeeded, but R2 is too low
+    With nr_of_bootstrap_replicates the bootstrap confidence interval of the Tau is calculated as well (see
+    calculate_tau_confidence_intervals) and the lower and upper bound are returned after the Tau and R2.
     """
 
     if len(df_tracks_for_tau) < min_tracks_for_tau:  # Too few points to curve fit
         tau = -1
         r_squared = 0
+        tau_ci = (-1, -1)
     else:
         duration_data = compile_duration(df_tracks_for_tau)
-        tau, r_squared = curve_fit_and_plot(plot_data=duration_data)
+        histogram = (duration_data['Track Duration'].to_numpy(), duration_data['Frequency'].to_numpy())
+        taus, r_squareds = calculate_taus_from_histograms(
+            [histogram], min_tracks_for_tau, min_required_r_squared, tau_fitter)
+        tau, r_squared = taus[0], r_squareds[0]
+        if nr_of_bootstrap_replicates > 0:
+            lower_bounds, upper_bounds = calculate_tau_confidence_intervals(
+                [histogram], taus, nr_of_bootstrap_replicates, tau_fitter=tau_fitter)
+            tau_ci = (lower_bounds[0], upper_bounds[0])
+
+    if nr_of_bootstrap_replicates > 0:
+        return tau, r_squared, *tau_ci
+    return tau, r_squared
+
+
+def calculate_taus_from_histograms(
+        histograms: list,
+        min_tracks_for_tau: int,
+        min_required_r_squared: float,
+        tau_fitter: str = None
+) -> tuple:
+    """
+    Calculate the Tau for many duration histograms, with the same error codes as calculate_tau.
+    The histograms are fitted with the Tau Fitter from Paint.json unless tau_fitter is given (see get_tau_fitter).
+    Histograms that were fitted before are taken from the fit cache.
+
+    :param histograms: A list of (durations, frequencies) pairs, with the durations in ascending order and only bins
+                       that hold tracks, as compile_duration produces them
+    :return: A list of Taus and a list of R2s
+    """
+
+    if tau_fitter is None:
+        tau_fitter = get_tau_fitter()
+
+    taus = [-1] * len(histograms)  # Too few points to curve fit
+    r_squareds = [0] * len(histograms)
+
+    to_fit = [i for i, (_, frequencies) in enumerate(histograms) if np.sum(frequencies) >= min_tracks_for_tau]
+    fits = fit_duration_histograms([histograms[i] for i in to_fit], tau_fitter)
+
+    for i, (tau, r_squared) in zip(to_fit, fits):
         if tau == -2:  # Tau calculation failed
             r_squared = 0
         if r_squared < min_required_r_squared:  # Tau was calculated, but not reliable
             tau = -3
             tau = int(tau)
+        taus[i] = tau
+        r_squareds[i] = r_squared
 
-    return tau, r_squared
+    return taus, r_squareds
 
 
-def calculate_median_long_track(df_tracks):
+def get_tau_bootstrap_settings() -> tuple:
+    """
+    :return: The number of bootstrap replicates for the confidence interval of the Tau (0 when no interval is
+             calculated) and the confidence level of the interval
+    """
+
+    nr_of_replicates = get_paint_attribute_with_default('Generate Squares', 'Tau Bootstrap Replicates', 0)
+    confidence_level = get_paint_attribute_with_default('Generate Squares', 'Tau Confidence Level', 0.95)
+    return int(nr_of_replicates), float(confidence_level)
+
+
+def calculate_tau_confidence_intervals(
+        histograms: list,
+        taus: list,
+        nr_of_bootstrap_replicates: int,
+        confidence_level: float = None,
+        tau_fitter: str = None
+) -> tuple:
+    """
+    Calculate the bootstrap confidence interval of the Taus that calculate_taus_from_histograms determined for the
+    histograms. Only the histograms with a valid Tau are resampled; for the others both bounds are the error code of
+    their Tau. The confidence level is the one from Paint.json unless it is given.
+
+    :return: A list of lower bounds and a list of upper bounds, in ms; both are -2 when none of the replicates of a
+             histogram could be fitted
+    """
+
+    if confidence_level is None:
+        _, confidence_level = get_tau_bootstrap_settings()
+    if tau_fitter is None:
+        tau_fitter = get_tau_fitter()
+
+    lower_bounds = [tau if tau < 0 else -2 for tau in taus]
+    upper_bounds = list(lower_bounds)
+
+    to_resample = [i for i, tau in enumerate(taus) if tau >= 0]
+    bootstrap_lower_bounds, bootstrap_upper_bounds = bootstrap_tau(
+        [histograms[i] for i in to_resample], nr_of_bootstrap_replicates, confidence_level, tau_fitter)
+    for i, lower_bound, upper_bound in zip(to_resample, bootstrap_lower_bounds.tolist(),
+                                           bootstrap_upper_bounds.tolist()):
+        lower_bounds[i] = -2 if lower_bound == -2 else lower_bound
+        upper_bounds[i] = -2 if upper_bound == -2 else upper_bound
+
+    return lower_bounds, upper_bounds
+
+
+def get_background_fraction() -> float:
+    """
+    The fraction of the tracks of a square that is used for the median long and short track durations
+    """
+
+    return get_paint_attribute_with_default('Generate Squares', 'Fraction of Squares to Determine Background', 0.1)
+
+
+def calculate_median_long_track(df_tracks, fraction=None):
     """
     Calculate the average of the long tracks for the square
     The long tracks are defined as the longest 10% of the tracks
@@ -317,14 +497,14 @@ def calculate_median_long_track(df_tracks):
         median_long_track = 0
     else:
         df_tracks.sort_values(by=['Track Duration'], inplace=True)
-        fraction = get_paint_attribute_with_default('Generate Squares',
-                                       'Fraction of Squares to Determine Background', 0.1)
+        if fraction is None:
+            fraction = get_background_fraction()
         nr_tracks_to_average = max(round(fraction * nr_of_tracks),  1)
         median_long_track = df_tracks.tail(nr_tracks_to_average)['Track Duration'].median()
     return median_long_track
 
 
-def calculate_median_short_track(df_tracks):
+def calculate_median_short_track(df_tracks, fraction=None):
     """
     Calculate the average of the long tracks for the square
     The long tracks are defined as the longest 10% of the tracks
@@ -334,37 +514,79 @@ def calculate_median_short_track(df_tracks):
         median_short_track = 0
     else:
         df_tracks.sort_values(by=['Track Duration'], inplace=True)
-        fraction = get_paint_attribute_with_default('Generate Squares',
-                                       'Fraction of Squares to Determine Background', 0.1)
+        if fraction is None:
+            fraction = get_background_fraction()
         nr_tracks_to_average = max(round(fraction * nr_of_tracks),  1)
         median_short_track = df_tracks.head(nr_tracks_to_average)['Track Duration'].median()
     return median_short_track
 
 
-def read_tracks_of_experiment(experiment_path: str) -> pd.DataFrame:
+def calculate_median_long_and_short_tracks_of_squares(
+        durations, square_nrs, nr_total_squares: int, fraction: float) -> tuple:
     """
-    Read the All Tracks file for an Experiment
+    The median long and short track durations of all squares of a Recording at once. The durations are sorted
+    within their square in one pass, after which the longest and shortest tracks of every square are adjacent and
+    their medians can be picked out directly. The result matches calculate_median_long_track and
+    calculate_median_short_track for each square.
+    :param durations: The Track Durations
+    :param square_nrs: The square sequence number of each track, -1 for tracks outside the grid
+    :param nr_total_squares: The number of squares in the Recording
+    :param fraction: The fraction of the tracks of a square that is used, as get_background_fraction returns it
+    :return: An array with the median long track duration and one with the median short track duration of every
+             square, 0 for squares without tracks
+    """
+
+    square_nrs = np.asarray(square_nrs)
+    in_grid = square_nrs >= 0
+    square_nrs = square_nrs[in_grid]
+    durations = np.asarray(durations, dtype=float)[in_grid]
+
+    # Sort the durations by square and within each square, so every square is one ascending block
+    order = np.lexsort((durations, square_nrs))
+    sorted_durations = durations[order]
+    nr_tracks_per_square = np.bincount(square_nrs, minlength=nr_total_squares)
+    ends = np.cumsum(nr_tracks_per_square)
+    starts = ends - nr_tracks_per_square
+
+    # The number of tracks to take the median of, rounded as round() does (half to even)
+    nr_tracks_to_average = np.maximum(np.round(fraction * nr_tracks_per_square), 1).astype(np.int64)
+    non_empty = nr_tracks_per_square > 0
+
+    def median_of_blocks(block_starts):
+        # The median of the nr_tracks_to_average durations from block_starts: the middle value, or the mean of the
+        # two middle values
+        lower = block_starts + (nr_tracks_to_average - 1) // 2
+        upper = block_starts + nr_tracks_to_average // 2
+        medians = np.zeros(nr_total_squares)
+        medians[non_empty] = (sorted_durations[lower[non_empty]] + sorted_durations[upper[non_empty]]) / 2
+        return medians
+
+    median_long_tracks = median_of_blocks(ends - nr_tracks_to_average)
+    median_short_tracks = median_of_blocks(starts)
+    return median_long_tracks, median_short_tracks
+
+
+def read_tracks_of_experiment(experiment_path: str, keep_square_and_label_nrs: bool = False) -> pd.DataFrame:
+    """
+    Read the tracks (the All Tracks file or store) for an Experiment
     Returns an empty DataFrame with required columns if file is empty
+    With keep_square_and_label_nrs set, the Square Nr and Label Nr of a previous run are kept (as integers or None),
+    otherwise they are reinitialised
     """
-    file_path = os.path.join(experiment_path, 'All Tracks.csv')
 
     try:
-        # Check if the file exists and has content
-        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        # Check if the tracks exist and have content
+        df_tracks_of_experiment = read_tracks(experiment_path)
+        if df_tracks_of_experiment is None or len(df_tracks_of_experiment.columns) == 0:
             paint_logger.warning(f"'All Tracks.csv' file in {experiment_path} is empty or doesn't exist")
             # Return empty DataFrame with required columns
             return pd.DataFrame(columns=['Square Nr', 'Label Nr'])
 
-        df_tracks_of_experiment = pd.read_csv(file_path)
-
         if df_tracks_of_experiment.empty:
-            paint_logger.warning(f"No tracks found in {file_path}")
+            paint_logger.warning(f"No tracks found in {experiment_path}")
             return pd.DataFrame(columns=['Square Nr', 'Label Nr'])
 
-        df_tracks_of_experiment = create_unique_key_for_tracks(df_tracks_of_experiment)
-        df_tracks_of_experiment['Square Nr'] = None
-        df_tracks_of_experiment['Label Nr'] = None
-        return df_tracks_of_experiment
+        return prepare_tracks(df_tracks_of_experiment, keep_square_and_label_nrs)
 
     except Exception as e:
         paint_logger.error(f"Error reading 'All Tracks.csv' in {experiment_path}: {str(e)}")
@@ -372,12 +594,27 @@ def read_tracks_of_experiment(experiment_path: str) -> pd.DataFrame:
         return pd.DataFrame(columns=['Square Nr', 'Label Nr'])
 
 
+def prepare_tracks(df_tracks: pd.DataFrame, keep_square_and_label_nrs: bool) -> pd.DataFrame:
+    """
+    Give tracks that were read from an All Tracks file their Unique Key and (re)initialise the Square Nr and Label Nr
+    """
+
+    df_tracks = create_unique_key_for_tracks(df_tracks)
+    for column in ['Square Nr', 'Label Nr']:
+        if keep_square_and_label_nrs and column in df_tracks.columns:
+            numbers = df_tracks[column]
+            df_tracks[column] = numbers.astype('Int64').astype(object).where(numbers.notna(), None)
+        else:
+            df_tracks[column] = None
+    return df_tracks
+
 
 def read_recordings_of_experiment(experiment_path: str) -> pd.DataFrame:
     """
     Read the All Recordings file for an Experiment
     """
-    df_recordings_of_experiment = pd.read_csv(os.path.join(experiment_path, 'All Recordings.csv'))
+    df_recordings_of_experiment = read_csv_with_schema(
+        os.path.join(experiment_path, 'All Recordings.csv'), RECORDINGS_SCHEMA, compact=False)
     if df_recordings_of_experiment is None:
         paint_logger.error(
             f"Function 'process_experiment' failed: Likely, {experiment_path} is not a valid  \
@@ -0,0 +1,212 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# resource is not available on Windows, where the peak RSS is not reported
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ----------------------------------------------------------------------------------------------------
+# The performance report of Generate Squares. When 'Performance Report' is set in Paint.json, the wall
+# time, CPU time and memory of every stage of the processing are recorded per Recording, and written as
+# 'Generate Squares Performance.json' next to the output files of the Experiment, together with the totals
+# per stage and the number of squares per Tau outcome. The peak memory of a stage is measured with
+# tracemalloc, which slows the processing down, so it is only done when 'Trace Memory in Performance Report'
+# is set as well. The peak RSS of the process is always reported (not on Windows).
+# Worker processes collect their stage records, which are handed to the main process with their results.
+# ----------------------------------------------------------------------------------------------------
+
+PERFORMANCE_REPORT_FILE_NAME = 'Generate Squares Performance.json'
+
+STAGES = [
+    'Read',
+    'Binning',
+    'Tau Fitting',
+    'Tau Bootstrap',
+    'Square Statistics',
+    'Selection',
+    'Labeling',
+    'Relabel Merge',
+    'Recording Tau',
+    'Write',
+    'Plot']
+
+TAU_OUTCOMES = {
+    -1: 'Too Few Tracks (-1)',
+    -2: 'Fit Failed (-2)',
+    -3: 'R Squared Too Low (-3)'}
+
+MB = 1024 * 1024
+
+report_settings = {'Enabled': False, 'Trace Memory': False}
+stage_records = []
+
+
+def start_performance_report(settings: dict = None) -> dict:
+    """
+    Start recording the stages of an Experiment, with the settings from Paint.json unless settings are given (as
+    they are in worker processes)
+
+    :return: The settings, to be handed to worker processes
+    """
+
+    if settings is None:
+        settings = {
+            'Enabled': bool(get_paint_attribute_with_default('Generate Squares', 'Performance Report', False)),
+            'Trace Memory': bool(get_paint_attribute_with_default(
+                'Generate Squares', 'Trace Memory in Performance Report', False))}
+    report_settings.update(settings)
+    stage_records.clear()
+    if report_settings['Enabled'] and report_settings['Trace Memory'] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return dict(report_settings)
+
+
+def get_performance_report_settings() -> dict:
+    return dict(report_settings)
+
+
+@contextmanager
+def measure_stage(stage: str, recording_name: str = None):
+    """
+    Record the wall time, CPU time and memory of the code in the with block as a stage of recording_name
+    (of the Experiment as a whole if None). Stages are measured one after the other, they do not nest.
+    """
+
+    if not report_settings['Enabled']:
+        yield
+        return
+
+    trace_memory = report_settings['Trace Memory'] and tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+    start_wall_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    try:
+        yield
+    finally:
+        stage_record = {
+            'Stage': stage,
+            'Recording': recording_name,
+            'Wall Time (s)': time.perf_counter() - start_wall_time,
+            'CPU Time (s)': time.process_time() - start_cpu_time}
+        if trace_memory:
+            stage_record['Peak Memory Increase (MB)'] = (tracemalloc.get_traced_memory()[1] - start_memory) / MB
+        peak_rss = get_peak_rss()
+        if peak_rss is not None:
+            stage_record['Peak RSS (MB)'] = peak_rss
+        stage_records.append(stage_record)
+
+
+def count_tau_outcomes(recording_name: str, taus) -> None:
+    """
+    Record how many squares of a Recording have a fitted Tau and how many have each of the Tau error codes
+    """
+
+    if not report_settings['Enabled']:
+        return
+    tau_outcomes = {'Fitted': 0}
+    tau_outcomes.update({outcome: 0 for outcome in TAU_OUTCOMES.values()})
+    for tau in taus:
+        if tau > 0:
+            tau_outcomes['Fitted'] += 1
+        elif int(tau) in TAU_OUTCOMES:
+            tau_outcomes[TAU_OUTCOMES[int(tau)]] += 1
+    stage_records.append({'Stage': 'Tau Outcomes', 'Recording': recording_name, 'Tau Outcomes': tau_outcomes})
+
+
+def collect_stage_records() -> list:
+    """
+    Hand over the stage records of this process, used by worker processes to return them with their results
+    """
+
+    collected_records = list(stage_records)
+    stage_records.clear()
+    return collected_records
+
+
+def add_stage_records(records: list) -> None:
+    if report_settings['Enabled']:
+        stage_records.extend(records)
+
+
+def get_peak_rss() -> float:
+    """
+    The peak resident set size of the process in MB, or None where it can not be determined
+    """
+
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / MB if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def summarise_stages(records: list) -> dict:
+    stages = {}
+    for record in records:
+        stage = stages.setdefault(record['Stage'], {'Count': 0, 'Wall Time (s)': 0.0, 'CPU Time (s)': 0.0})
+        stage['Count'] += 1
+        stage['Wall Time (s)'] += record['Wall Time (s)']
+        stage['CPU Time (s)'] += record['CPU Time (s)']
+        for memory_key in ['Peak Memory Increase (MB)', 'Peak RSS (MB)']:
+            if memory_key in record:
+                stage[memory_key] = max(stage.get(memory_key, 0.0), record[memory_key])
+    ordered_stages = [stage for stage in STAGES if stage in stages] + [stage for stage in stages if stage not in STAGES]
+    return {stage: round_values(stages[stage]) for stage in ordered_stages}
+
+
+def round_values(values: dict) -> dict:
+    return {key: (round(value, 4) if isinstance(value, float) else value) for key, value in values.items()}
+
+
+def write_performance_report(experiment_path: str, run_time: float, description: dict = None) -> None:
+    """
+    Write the stages recorded since start_performance_report to the performance report of the Experiment
+    """
+
+    if not report_settings['Enabled']:
+        return
+
+    time_records = [record for record in stage_records if record['Stage'] != 'Tau Outcomes']
+    tau_records = [record for record in stage_records if record['Stage'] == 'Tau Outcomes']
+
+    recordings = {}
+    for recording_name in dict.fromkeys(record['Recording'] for record in stage_records
+                                        if record['Recording'] is not None):
+        recordings[recording_name] = {
+            'Stages': summarise_stages([record for record in time_records if record['Recording'] == recording_name])}
+    total_tau_outcomes = {}
+    for record in tau_records:
+        recordings[record['Recording']]['Tau Outcomes'] = record['Tau Outcomes']
+        for outcome, count in record['Tau Outcomes'].items():
+            total_tau_outcomes[outcome] = total_tau_outcomes.get(outcome, 0) + count
+
+    report = {
+        'Experiment': experiment_path,
+        'Time Stamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'Wall Time (s)': round(run_time, 4),
+        'Trace Memory': report_settings['Trace Memory']}
+    report.update(description or {})
+    peak_rss = get_peak_rss()
+    if peak_rss is not None:
+        report['Peak RSS (MB)'] = round(peak_rss, 4)
+    report['Stages'] = summarise_stages(time_records)
+    report['Tau Outcomes'] = total_tau_outcomes
+    report['Recordings'] = recordings
+
+    report_path = os.path.join(experiment_path, PERFORMANCE_REPORT_FILE_NAME)
+    try:
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=4)
+    except OSError as e:
+        paint_logger.error(f"Performance report {report_path} could not be written: {e}")
+    stage_records.clear()
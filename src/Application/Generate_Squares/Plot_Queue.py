@@ -0,0 +1,230 @@
+import multiprocessing
+import os
+import queue
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+from src.Application.Generate_Squares.Curvefit_and_Plot import mono_exp
+from src.Application.Generate_Squares.Performance_Report import TAU_OUTCOMES
+from src.Fiji.DirectoriesAndLocations import delete_files_in_directory
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# ----------------------------------------------------------------------------------------------------
+# The duration histogram plots of 'Plot to File'. Plotting is kept out of the fitting: when the squares
+# of a Recording are done, a lightweight plot spec (the histogram, Tau and R2 of a square) is made for
+# every square that was fitted and put on a queue. Background processes take the specs from the queue
+# and render them with Agg, to a png file per square or, with 'Plot Format' set to 'PDF', as the pages
+# of one pdf file for the Experiment. The fitted curve is not sent along: for the Tau of the fit, the
+# amplitude and constant of mono_exp follow from a linear least squares fit to the histogram.
+# ----------------------------------------------------------------------------------------------------
+
+PLOT_DIRECTORY_NAME = 'Plot'
+PLOT_PDF_FILE_NAME = 'Duration Histograms.pdf'
+PLOT_FORMATS = ['PNG', 'PDF']
+
+
+def make_plot_specs(
+        df_squares_of_recording: pd.DataFrame,
+        df_square_histograms_of_recording: pd.DataFrame,
+        plot_max_x: float) -> list:
+    """
+    Make the plot specs of the squares of a Recording for which a Tau was fitted, that is of all squares except
+    those with too few tracks
+
+    :param df_squares_of_recording: The squares of the Recording, with their Tau and R Squared
+    :param df_square_histograms_of_recording: The duration histograms of the squares, as DurationHistograms.to_dataframe
+                                              makes them
+    :param plot_max_x: The longest duration that is shown, in s
+    :return: A list with a plot spec for every square
+    """
+
+    positions_of_square = df_square_histograms_of_recording.groupby('Square Nr', sort=False).indices
+    durations = df_square_histograms_of_recording['Track Duration'].to_numpy()
+    frequencies = df_square_histograms_of_recording['Frequency'].to_numpy()
+
+    plot_specs = []
+    df_fitted_squares = df_squares_of_recording[df_squares_of_recording['Tau'] != -1]
+    for recording_name, square_nr, tau, r_squared in zip(
+            df_fitted_squares['Ext Recording Name'], df_fitted_squares['Square Nr'], df_fitted_squares['Tau'],
+            df_fitted_squares['R Squared']):
+        positions = positions_of_square.get(square_nr)
+        if positions is None:
+            continue
+        plot_specs.append({
+            'Title': f"{recording_name} - Square {square_nr}",
+            'Durations': durations[positions],
+            'Frequencies': frequencies[positions],
+            'Tau': float(tau),
+            'R Squared': float(r_squared),
+            'Plot Max': plot_max_x})
+    return plot_specs
+
+
+def draw_duration_histogram(plot_spec: dict) -> Figure:
+    """
+    Draw the duration histogram of a plot spec and the curve that was fitted to it, as curve_fit_and_plot does
+    """
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.subplots()
+
+    x = np.asarray(plot_spec['Durations'], dtype=float)
+    y = np.asarray(plot_spec['Frequencies'], dtype=float)
+    tau = plot_spec['Tau']
+    plot_max_x = plot_spec['Plot Max']
+    ax.scatter(x, y, linewidth=1.0, label="Data")
+
+    if tau > 0:
+        t = 1000 / tau
+        (m, b), _, _, _ = np.linalg.lstsq(np.column_stack([np.exp(-t * x), np.ones_like(x)]), y, rcond=None)
+        x_curve = np.linspace(x.min(), max(plot_max_x, x.max()), 200)
+        ax.plot(x_curve, mono_exp(x_curve, m, t, b), linewidth=1.0, label="Fitted")
+        tau_text = f"Tau = {tau:.0f} ms"
+    else:
+        tau_text = f"Tau: {TAU_OUTCOMES.get(int(tau), tau)}"
+
+    x_middle = plot_max_x / 2 - plot_max_x * 0.1
+    y_middle = y.max() / 2
+    ax.text(x_middle, y_middle, tau_text)
+    ax.text(x_middle, 0.8 * y_middle, f"R2 = {plot_spec['R Squared']:.4f}")
+    ax.text(x_middle, 0.6 * y_middle, f"Number of tracks is {int(y.sum())}")
+    ax.text(x_middle, 0.4 * y_middle, f"Zoomed in from 0 to {plot_max_x:.0f} s")
+
+    ax.set_xlim([0, plot_max_x])
+    ax.set_xlabel('Duration [in s]')
+    ax.set_ylabel('Number of tracks')
+    ax.set_title(plot_spec['Title'])
+    ax.legend()
+    return figure
+
+
+def render_plots_from_queue(
+        plot_spec_queue: multiprocessing.Queue,
+        result_queue: multiprocessing.Queue,
+        plot_directory: str,
+        plot_format: str) -> None:
+    """
+    Render the plot specs that are put on the queue until None is received, then report the number of plots that
+    were rendered and the errors on the result queue. Runs in a background process.
+    """
+
+    nr_of_plots = 0
+    errors = []
+    pdf_pages = None
+    try:
+        if plot_format == 'PDF':
+            pdf_pages = PdfPages(os.path.join(plot_directory, PLOT_PDF_FILE_NAME))
+        while True:
+            plot_specs = plot_spec_queue.get()
+            if plot_specs is None:
+                break
+            for plot_spec in plot_specs:
+                try:
+                    figure = draw_duration_histogram(plot_spec)
+                    if pdf_pages is not None:
+                        pdf_pages.savefig(figure)
+                    else:
+                        figure.savefig(os.path.join(plot_directory, plot_spec['Title'] + '.png'))
+                    nr_of_plots += 1
+                except Exception as e:
+                    errors.append(f"{plot_spec['Title']}: {e}")
+    except Exception as e:
+        errors.append(str(e))
+    finally:
+        if pdf_pages is not None:
+            pdf_pages.close()
+        result_queue.put((nr_of_plots, errors))
+
+
+class PlotQueue:
+    """
+    The queue of plot specs of an Experiment and the background processes that render them.
+    The Plot directory of the Experiment is emptied once, when the queue is started.
+    """
+
+    def __init__(self, experiment_path: str, plot_format: str = 'PNG', nr_of_workers: int = 1):
+        if plot_format not in PLOT_FORMATS:
+            paint_logger.error(f"Unknown Plot Format '{plot_format}' in Paint.json, the plots are written as PNG")
+            plot_format = 'PNG'
+        self.plot_directory = os.path.join(experiment_path, PLOT_DIRECTORY_NAME)
+        self.plot_format = plot_format
+        self.nr_of_plots = 0
+
+        if not os.path.exists(self.plot_directory):
+            os.makedirs(self.plot_directory)
+        else:
+            delete_files_in_directory(self.plot_directory)
+
+        # A pdf file can only be written by one process
+        nr_of_workers = 1 if plot_format == 'PDF' else max(1, int(nr_of_workers))
+        self.plot_spec_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self.workers = [
+            multiprocessing.Process(
+                target=render_plots_from_queue,
+                args=(self.plot_spec_queue, self.result_queue, self.plot_directory, plot_format),
+                daemon=True)
+            for _ in range(nr_of_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def put(self, plot_specs: list) -> None:
+        if plot_specs:
+            self.plot_spec_queue.put(plot_specs)
+            self.nr_of_plots += len(plot_specs)
+
+    def close(self) -> None:
+        """
+        Wait until all plots have been rendered and stop the background processes
+        """
+
+        for _ in self.workers:
+            self.plot_spec_queue.put(None)
+
+        # Every worker reports once; a worker that died without reporting is not waited for
+        results = []
+        while len(results) < len(self.workers):
+            try:
+                results.append(self.result_queue.get(timeout=1))
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    while not self.result_queue.empty():
+                        results.append(self.result_queue.get())
+                    break
+        for worker in self.workers:
+            worker.join()
+
+        nr_of_plots = sum(worker_nr_of_plots for worker_nr_of_plots, _ in results)
+        errors = [error for _, worker_errors in results for error in worker_errors]
+        for error in errors[:10]:
+            paint_logger.error(f"Plotting failed: {error}")
+        if nr_of_plots < self.nr_of_plots:
+            paint_logger.error(f"{self.nr_of_plots - nr_of_plots} of {self.nr_of_plots} plots could not be written "
+                               f"to {self.plot_directory}")
+        else:
+            paint_logger.debug(f"Written {nr_of_plots} plots to {self.plot_directory}")
+
+
+def start_plot_queue(experiment_path: str) -> PlotQueue:
+    """
+    Start the plot queue of an Experiment when 'Plot to File' is set
+
+    :return: The plot queue, or None when no plots are made
+    """
+
+    if not get_paint_attribute_with_default('Generate Squares', 'Plot to File', False):
+        return None
+    return PlotQueue(
+        experiment_path,
+        get_paint_attribute_with_default('Generate Squares', 'Plot Format', 'PNG'),
+        get_paint_attribute_with_default('Generate Squares', 'Nr of Plot Workers', 1))
+
+
+def get_plot_max() -> float:
+    return get_paint_attribute_with_default('Generate Squares', 'Plot Max', 5)
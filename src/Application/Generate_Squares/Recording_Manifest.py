@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from src.Application.Support.Track_Store import (
+    track_squares_exist,
+    tracks_exist)
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+pd.options.mode.copy_on_write = True
+
+# ----------------------------------------------------------------------------------------------------
+# The manifest that makes Generate Squares incremental. It is stored next to All Squares and holds a
+# fingerprint for every Recording, calculated from the tracks of the Recording, its row in All Recordings
+# and the parameters that determine the squares. On a rerun only the Recordings whose fingerprint changed
+# are processed again, the results of the others are taken from the existing output files.
+# ----------------------------------------------------------------------------------------------------
+
+MANIFEST_FILE_NAME = 'All Squares Manifest.json'
+MANIFEST_VERSION = 1
+
+# The columns of All Recordings that Generate Squares writes, they are not part of the fingerprint
+RECORDING_OUTPUT_COLUMNS = [
+    'Min Tracks for Tau',
+    'Min Required R Squared',
+    'Nr of Squares in Row',
+    'Max Allowable Variability',
+    'Min Required Density Ratio',
+    'Exclude',
+    'Neighbour Mode',
+    'Tau',
+    'Density',
+    'R Squared',
+    'Tau CI Low',
+    'Tau CI High']
+
+# The columns that Generate Squares adds to the tracks, they are not part of the fingerprint
+TRACK_OUTPUT_COLUMNS = [
+    'Unique Key',
+    'Square Nr',
+    'Label Nr']
+
+
+def get_squares_parameters(
+        select_parameters: dict,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> dict:
+    """
+    Collect the parameters that determine the squares of a Recording, including the ones that are read from Paint.json
+    """
+
+    parameters = {
+        'Nr of Squares in Row': nr_of_squares_in_row,
+        'Min Required R Squared': min_required_r_squared,
+        'Min Tracks for Tau': min_tracks_for_tau,
+        'Select Parameters': select_parameters,
+        'Exclude zero DC tracks from Tau Calculation': get_paint_attribute_with_default(
+            'Generate Squares', 'Exclude zero DC tracks from Tau Calculation', False),
+        'Fraction of Squares to Determine Background': get_paint_attribute_with_default(
+            'Generate Squares', 'Fraction of Squares to Determine Background', 0.1),
+        'Variability Granularity': get_paint_attribute_with_default(
+            'Generate Squares', 'Variability Granularity', 10),
+        'Tau Fitter': get_paint_attribute_with_default('Generate Squares', 'Tau Fitter', 'Curve Fit')}
+
+    # The bootstrap settings are only part of the parameters when the confidence intervals are calculated, so that
+    # the fingerprints of earlier runs stay valid when they are not
+    nr_of_bootstrap_replicates = get_paint_attribute_with_default('Generate Squares', 'Tau Bootstrap Replicates', 0)
+    if nr_of_bootstrap_replicates > 0:
+        parameters['Tau Bootstrap Replicates'] = nr_of_bootstrap_replicates
+        parameters['Tau Confidence Level'] = get_paint_attribute_with_default(
+            'Generate Squares', 'Tau Confidence Level', 0.95)
+
+    # Likewise, the maximum likelihood Tau depends on the frame interval and on the shortest tracks TrackMate keeps
+    if parameters['Tau Fitter'] == 'Maximum Likelihood':
+        parameters['Frame Interval'] = get_paint_attribute_with_default('Generate Squares', 'Frame Interval', 0.05)
+        parameters['MIN_NR_SPOTS_IN_TRACK'] = get_paint_attribute_with_default(
+            'TrackMate', 'MIN_NR_SPOTS_IN_TRACK', 3)
+    return parameters
+
+
+def fingerprint_recording(recording_data: pd.Series, df_tracks_of_recording: pd.DataFrame, parameters: dict) -> str:
+    """
+    Calculate the fingerprint of the input of a Recording: its tracks, its row in All Recordings and the parameters.
+    The columns that Generate Squares writes itself are left out, so the fingerprint is the same before and after
+    the Recording has been processed.
+    """
+
+    fingerprint = hashlib.sha256()
+    fingerprint.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+
+    recording_values = {name: str(value) for name, value in recording_data.items()
+                        if name not in RECORDING_OUTPUT_COLUMNS}
+    fingerprint.update(json.dumps(recording_values, sort_keys=True).encode())
+
+    # The floats are compared in single precision: reading a csv file that was written by pandas can differ in the
+    # last bit from the value that was written, which should not make a Recording look changed
+    track_columns = sorted(column for column in df_tracks_of_recording.columns if column not in TRACK_OUTPUT_COLUMNS)
+    df_track_values = df_tracks_of_recording[track_columns]
+    float_columns = df_track_values.select_dtypes(include='float').columns
+    df_track_values = df_track_values.astype({column: 'float32' for column in float_columns})
+    track_hashes = pd.util.hash_pandas_object(df_track_values, index=False)
+    fingerprint.update(track_hashes.to_numpy().tobytes())
+
+    return fingerprint.hexdigest()
+
+
+def read_manifest(experiment_path: str) -> dict:
+    """
+    Read the fingerprints of the Recordings that were processed in the previous run.
+    An empty dictionary is returned when there is no (valid) manifest or when one of the output files is missing,
+    in which case all Recordings have to be processed.
+    """
+
+    manifest_path = os.path.join(experiment_path, MANIFEST_FILE_NAME)
+    for file_name in ['All Squares.csv', 'All Recordings.csv', MANIFEST_FILE_NAME]:
+        if not os.path.exists(os.path.join(experiment_path, file_name)):
+            return {}
+    if not tracks_exist(experiment_path) or not track_squares_exist(experiment_path):
+        return {}
+
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError) as e:
+        paint_logger.warning(f"Manifest {manifest_path} could not be read, all recordings will be processed: {e}")
+        return {}
+
+    if manifest.get('Version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('Recordings', {})
+
+
+def write_manifest(experiment_path: str, fingerprints: dict, parameters: dict) -> None:
+    """
+    Write the fingerprints of the processed Recordings. The parameters are stored for reference only, they are
+    already part of every fingerprint.
+    """
+
+    manifest = {
+        'Version': MANIFEST_VERSION,
+        'Parameters': parameters,
+        'Recordings': fingerprints}
+
+    manifest_path = os.path.join(experiment_path, MANIFEST_FILE_NAME)
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, default=str)
+
+
+def remove_manifest(experiment_path: str) -> None:
+    """
+    Remove the manifest, so that a failed or forced run never leaves fingerprints that do not match the output files
+    """
+
+    manifest_path = os.path.join(experiment_path, MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
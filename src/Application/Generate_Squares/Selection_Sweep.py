@@ -0,0 +1,297 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
+    calculate_density,
+    calc_area_of_square,
+    calculate_taus_from_histograms,
+    get_tau_fitter)
+from src.Application.Generate_Squares.Duration_Histograms import DurationHistograms
+from src.Application.Generate_Squares.Fit_Cache import use_fit_cache_directory
+from src.Application.Support.Paint_Schema import (
+    RECORDINGS_SCHEMA,
+    SQUARES_SCHEMA,
+    read_csv_with_schema)
+from src.Application.Support.Track_Store import tracks_exist, read_tracks
+from src.Application.Recording_Viewer.Select_Squares import (
+    select_squares_with_parameters,
+    label_selected_squares)
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+pd.options.mode.copy_on_write = True
+
+# ----------------------------------------------------------------------------------------------------
+# The selection parameters only decide which of the already computed squares are used. A sweep therefore
+# does not generate squares again: the squares of every Recording are read from All Squares and the tracks
+# from All Tracks are reduced once to the duration histograms of the squares. For every combination of
+# selection parameters the squares are selected and labelled, the duration histograms of the selected
+# squares are summed and the Recording Tau and Density are calculated from the sum.
+# ----------------------------------------------------------------------------------------------------
+
+# The selection parameters that can be swept, with the column names they get in the results table
+SWEEP_PARAMETER_COLUMNS = {
+    'min_required_density_ratio': 'Min Required Density Ratio',
+    'max_allowable_variability': 'Max Allowable Variability',
+    'min_track_duration': 'Min Track Duration',
+    'max_track_duration': 'Max Track Duration',
+    'min_required_r_squared': 'Min Required R Squared',
+    'neighbour_mode': 'Neighbour Mode'}
+
+# The columns of All Recordings that are copied to the results table to describe the Recording
+RECORDING_COLUMNS = [
+    'Experiment Name',
+    'Ext Recording Name',
+    'Probe',
+    'Probe Type',
+    'Cell Type',
+    'Adjuvant',
+    'Concentration',
+    'Threshold',
+    'Condition Nr',
+    'Replicate Nr']
+
+# The columns of All Squares that the selection needs
+SQUARE_COLUMNS_FOR_SELECTION = [
+    'Square Nr',
+    'Row Nr',
+    'Col Nr',
+    'Nr Tracks',
+    'Density Ratio',
+    'Variability',
+    'Max Track Duration',
+    'R Squared',
+    'Tau',
+    'Square Manually Excluded']
+
+# The recordings of the sweep, set once in every worker process
+_sweep_recordings = None
+
+
+def make_parameter_combinations(parameter_grid: dict, default_parameters: dict) -> list:
+    """
+    Make all combinations of the values in the parameter grid. Parameters that are not in the grid keep their value
+    from default_parameters (a dictionary as made by pack_select_parameters).
+
+    :param parameter_grid: For every parameter to sweep, a list of values, e.g. {'neighbour_mode': ['Free', 'Strict']}
+    :return: A list of select parameter dictionaries
+    """
+
+    unknown_parameters = [name for name in parameter_grid if name not in SWEEP_PARAMETER_COLUMNS]
+    if unknown_parameters:
+        raise ValueError(f"Unknown selection parameters in the sweep: {', '.join(unknown_parameters)}")
+
+    values_per_parameter = [parameter_grid.get(name, [default_parameters[name]]) for name in SWEEP_PARAMETER_COLUMNS]
+    return [dict(zip(SWEEP_PARAMETER_COLUMNS, values)) for values in itertools.product(*values_per_parameter)]
+
+
+def find_experiment_paths(paint_path: str) -> list:
+    """
+    Find the Experiments with generated squares: paint_path itself, or the Experiments of the Project in paint_path
+    """
+
+    def has_squares(path):
+        return (all(os.path.isfile(os.path.join(path, file_name))
+                    for file_name in ['All Recordings.csv', 'All Squares.csv']) and tracks_exist(path))
+
+    if has_squares(paint_path):
+        return [paint_path]
+
+    experiment_paths = []
+    for experiment_dir in sorted(os.listdir(paint_path)):
+        experiment_path = os.path.join(paint_path, experiment_dir)
+        if not os.path.isdir(experiment_path) or any(x in experiment_dir for x in ['Output', 'Diagnostics']):
+            continue
+        if has_squares(experiment_path):
+            experiment_paths.append(experiment_path)
+        else:
+            paint_logger.warning(f"No squares generated in {experiment_path}, the experiment is not part of the sweep")
+    return experiment_paths
+
+
+def read_sweep_recordings(experiment_path: str) -> list:
+    """
+    Read the squares and tracks of the Recordings of an Experiment and reduce them to what the sweep needs.
+
+    :return: A list with for every Recording a dictionary holding its description, its squares and the duration
+             histograms of its squares
+    """
+
+    limit_dc = get_paint_attribute_with_default('Generate Squares', 'Exclude zero DC tracks from Tau Calculation', False)
+
+    df_recordings = read_csv_with_schema(
+        os.path.join(experiment_path, 'All Recordings.csv'), RECORDINGS_SCHEMA, compact=False)
+    df_squares = read_csv_with_schema(os.path.join(experiment_path, 'All Squares.csv'), SQUARES_SCHEMA)
+    df_tracks = read_tracks(experiment_path,
+                            columns=['Ext Recording Name', 'Track Duration', 'Diffusion Coefficient', 'Square Nr'])
+
+    square_columns = [column for column in SQUARE_COLUMNS_FOR_SELECTION if column in df_squares.columns]
+    squares_per_recording = dict(tuple(df_squares.groupby('Ext Recording Name', sort=False, observed=True)))
+    track_positions_per_recording = df_tracks.groupby('Ext Recording Name', sort=False, observed=True).indices
+
+    sweep_recordings = []
+    for _, recording_data in df_recordings.iterrows():
+        recording_name = recording_data['Ext Recording Name']
+        if recording_name not in squares_per_recording:
+            continue
+        df_tracks_of_recording = df_tracks.iloc[track_positions_per_recording.get(recording_name, [])]
+        nr_of_squares_in_row = int(recording_data['Nr of Squares in Row'])
+
+        # Tracks outside the grid have no square, they are never selected
+        duration_histograms = DurationHistograms.from_tracks(
+            df_tracks_of_recording, nr_of_squares_in_row ** 2, limit_dc)
+
+        sweep_recordings.append({
+            'Recording': {column: recording_data[column] for column in RECORDING_COLUMNS if column in recording_data},
+            'Nr of Squares in Row': nr_of_squares_in_row,
+            'Min Tracks for Tau': int(recording_data['Min Tracks for Tau']),
+            'Min Required R Squared': float(recording_data['Min Required R Squared']),
+            'Concentration': float(recording_data['Concentration']),
+            'Squares': squares_per_recording[recording_name][square_columns].reset_index(drop=True),
+            'Duration Histograms': duration_histograms})
+
+    return sweep_recordings
+
+
+def evaluate_recording(sweep_recording: dict, select_parameters: dict) -> tuple:
+    """
+    Select and label the squares of a Recording, as Generate Squares does, and sum the duration histograms of the
+    selected squares for the Recording Tau and Density
+
+    :return: The results for the Recording and the duration histogram of the tracks for the Recording Tau
+    """
+
+    nr_of_squares_in_row = sweep_recording['Nr of Squares in Row']
+    df_squares = sweep_recording['Squares'].copy()
+
+    # The labels, as assigned in All Squares
+    select_squares_with_parameters(df_squares, select_parameters, nr_of_squares_in_row, only_valid_tau=True)
+    label_selected_squares(df_squares)
+    nr_labelled_squares = int(df_squares['Label Nr'].notna().sum())
+
+    # The squares for the Recording Tau and Density, which include squares without a valid Tau
+    select_squares_with_parameters(df_squares, select_parameters, nr_of_squares_in_row, only_valid_tau=False)
+    square_nrs_for_tau = df_squares.loc[df_squares['Selected'], 'Square Nr'].to_numpy()
+
+    duration_histograms = sweep_recording['Duration Histograms']
+    nr_tracks_for_tau = duration_histograms.nr_tracks(square_nrs_for_tau)
+
+    area = calc_area_of_square(nr_of_squares_in_row)
+    density = calculate_density(
+        nr_tracks=nr_tracks_for_tau, area=area, time=100, concentration=sweep_recording['Concentration'])
+
+    results = {
+        'Nr Labelled Squares': nr_labelled_squares,
+        'Nr Squares for Tau': len(square_nrs_for_tau),
+        'Nr Tracks for Tau': nr_tracks_for_tau,
+        'Density': round(density, 5)}
+    return results, duration_histograms.histogram(square_nrs_for_tau)
+
+
+def evaluate_combination(
+        combination_nr: int,
+        select_parameters: dict,
+        tau_fitter: str,
+        sweep_recordings: list = None) -> list:
+    """
+    Evaluate one combination of selection parameters for all Recordings. The Recording Taus are fitted together.
+    In a worker process the Recordings are the ones that were set when the worker started.
+
+    :return: A list with a result row for every Recording
+    """
+
+    if sweep_recordings is None:
+        sweep_recordings = _sweep_recordings
+
+    parameter_values = {column: select_parameters[name] for name, column in SWEEP_PARAMETER_COLUMNS.items()}
+    results = []
+    histograms = []
+    for sweep_recording in sweep_recordings:
+        recording_results, histogram = evaluate_recording(sweep_recording, select_parameters)
+        results.append({
+            'Combination Nr': combination_nr,
+            **sweep_recording['Recording'],
+            'Nr of Squares in Row': sweep_recording['Nr of Squares in Row'],
+            **parameter_values,
+            **recording_results})
+        histograms.append(histogram)
+
+    # The minimum number of tracks and R2 for the fit are those of the Recording, so the Recordings are grouped on them
+    fit_settings = [(sweep_recording['Min Tracks for Tau'], sweep_recording['Min Required R Squared'])
+                    for sweep_recording in sweep_recordings]
+    for min_tracks_for_tau, min_required_r_squared in set(fit_settings):
+        indices = [i for i, settings in enumerate(fit_settings) if settings == (min_tracks_for_tau, min_required_r_squared)]
+        taus, r_squareds = calculate_taus_from_histograms(
+            [histograms[i] for i in indices], min_tracks_for_tau, min_required_r_squared, tau_fitter)
+        for i, tau, r_squared in zip(indices, taus, r_squareds):
+            results[i]['Tau'] = round(tau, 0)
+            results[i]['R Squared'] = round(r_squared, 3)
+
+    # Keep the columns in the order of All Recordings
+    for result in results:
+        result['Density'] = result.pop('Density')
+        result['R Squared'] = result.pop('R Squared')
+    return results
+
+
+def set_sweep_recordings(sweep_recordings: list, project_path: str) -> None:
+    """
+    Keep the Recordings in a worker process, so they are sent to every worker once rather than with every combination.
+    The worker uses the fit cache of the Project as well.
+    """
+
+    global _sweep_recordings
+    _sweep_recordings = sweep_recordings
+    use_fit_cache_directory(project_path)
+
+
+def sweep_selection_parameters(
+        paint_path: str,
+        parameter_grid: dict,
+        default_parameters: dict,
+        nr_of_workers: int = 1) -> pd.DataFrame:
+    """
+    Evaluate every combination of selection parameters in parameter_grid for all Recordings of an Experiment or
+    Project, using the squares that Generate Squares has written. The squares themselves are not generated again.
+    With nr_of_workers larger than 1, the combinations are evaluated in parallel in a pool of worker processes.
+
+    :param paint_path: An Experiment or Project directory for which the squares have been generated
+    :param parameter_grid: For every parameter to sweep, a list of values
+    :param default_parameters: The select parameters for the parameters that are not swept
+    :return: A table with a row for every combination and Recording, holding the parameter values, the number of
+             labelled squares and the Recording Tau, Density and R Squared
+    """
+
+    combinations = make_parameter_combinations(parameter_grid, default_parameters)
+    tau_fitter = get_tau_fitter()
+
+    sweep_recordings = []
+    experiment_paths = find_experiment_paths(paint_path)
+    for experiment_path in experiment_paths:
+        sweep_recordings.extend(read_sweep_recordings(experiment_path))
+    if not sweep_recordings:
+        paint_logger.error(f"No recordings with generated squares found in {paint_path}")
+        return pd.DataFrame()
+
+    # Identical selections give identical histograms, their fits are taken from the fit cache
+    project_path = os.path.dirname(os.path.normpath(experiment_paths[0]))
+    use_fit_cache_directory(project_path)
+
+    paint_logger.info(f"Sweeping {len(combinations)} combinations of selection parameters for "
+                      f"{len(sweep_recordings)} recordings")
+
+    if nr_of_workers > 1 and len(combinations) > 1:
+        nr_of_workers = min(nr_of_workers, len(combinations))
+        with ProcessPoolExecutor(max_workers=nr_of_workers, initializer=set_sweep_recordings,
+                                 initargs=(sweep_recordings, project_path)) as executor:
+            results_per_combination = list(executor.map(
+                evaluate_combination, range(1, len(combinations) + 1), combinations, [tau_fitter] * len(combinations),
+                chunksize=max(1, len(combinations) // (4 * nr_of_workers))))
+    else:
+        results_per_combination = [evaluate_combination(combination_nr, select_parameters, tau_fitter, sweep_recordings)
+                                   for combination_nr, select_parameters in enumerate(combinations, start=1)]
+
+    return pd.DataFrame([result for results in results_per_combination for result in results])
@@ -0,0 +1,92 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+# ----------------------------------------------------------------------------------------------------
+# Support for sharing the track columns of an Experiment with worker processes.
+# Each column is copied once into a shared memory block. Workers attach to the blocks and read only the
+# rows of their own Recording, so the tracks do not have to be pickled and sent to every worker.
+# ----------------------------------------------------------------------------------------------------
+
+# The track columns that are needed to generate the squares of a recording
+TRACK_COLUMNS_FOR_SQUARES = [
+    'Track Duration',
+    'Track X Location',
+    'Track Y Location',
+    'Track Displacement',
+    'Track Max Speed',
+    'Track Mean Speed',
+    'Diffusion Coefficient',
+    'Diffusion Coefficient Ext']
+
+
+def share_track_columns(df_tracks: pd.DataFrame, column_names: list, positions: np.ndarray) -> tuple:
+    """
+    Copy the specified columns of the tracks into shared memory, with the rows in the order given by positions.
+
+    :param df_tracks: The tracks of the Experiment
+    :param column_names: The columns to share
+    :param positions: The row positions to share, in the order in which they are stored
+    :return: A description of the shared columns that can be passed to workers, and the shared memory blocks, which
+             the caller releases with release_track_columns when the workers are done
+    """
+
+    shared_columns = {}
+    shared_memory_blocks = []
+    try:
+        for column_name in column_names:
+            values = df_tracks[column_name].to_numpy()[positions]
+            shared_memory = SharedMemory(create=True, size=max(values.nbytes, 1))
+            shared_memory_blocks.append(shared_memory)
+            shared_values = np.ndarray(values.shape, dtype=values.dtype, buffer=shared_memory.buf)
+            shared_values[:] = values
+            shared_columns[column_name] = (shared_memory.name, values.dtype.str, len(values))
+    except Exception:
+        release_track_columns(shared_memory_blocks, unlink=True)
+        raise
+
+    return shared_columns, shared_memory_blocks
+
+
+def attach_track_columns(shared_columns: dict, start: int, end: int) -> tuple:
+    """
+    Attach to shared track columns and copy rows start up to end into a DataFrame.
+
+    :return: The DataFrame and the shared memory blocks, which the caller releases with release_track_columns
+    """
+
+    track_columns = {}
+    shared_memory_blocks = []
+    for column_name, (shared_memory_name, dtype, length) in shared_columns.items():
+        shared_memory = attach_shared_memory(shared_memory_name)
+        shared_memory_blocks.append(shared_memory)
+        shared_values = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shared_memory.buf)
+        track_columns[column_name] = shared_values[start:end].copy()
+
+    return pd.DataFrame(track_columns), shared_memory_blocks
+
+
+def attach_shared_memory(shared_memory_name: str) -> SharedMemory:
+    """
+    Attach to an existing shared memory block without taking ownership: only the process that created the block may
+    remove it.
+    """
+
+    try:
+        return SharedMemory(name=shared_memory_name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching also registers the block with the resource tracker. Worker processes share the
+        # tracker of the main process, where the block is already registered, so that does no harm.
+        return SharedMemory(name=shared_memory_name)
+
+
+def release_track_columns(shared_memory_blocks: list, unlink: bool) -> None:
+    """
+    Close the shared memory blocks and, in the process that created them, remove them.
+    """
+
+    for shared_memory in shared_memory_blocks:
+        shared_memory.close()
+        if unlink:
+            shared_memory.unlink()
@@ -0,0 +1,275 @@
+import numpy as np
+import pandas as pd
+
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
+    get_square_coordinates,
+    calc_variability_of_squares,
+    calculate_density,
+    calculate_taus_from_histograms,
+    calculate_tau_confidence_intervals,
+    get_tau_bootstrap_settings,
+    get_tau_fitter,
+    calculate_median_long_and_short_tracks_of_squares,
+    get_background_fraction)
+from src.Application.Generate_Squares.Duration_Histograms import DurationHistograms
+from src.Application.Generate_Squares.Performance_Report import measure_stage
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+pd.options.mode.copy_on_write = True
+
+# ----------------------------------------------------------------------------------------------------
+# The vectorised square engine. Instead of scanning all tracks of a recording for every square (as
+# process_square does), every track is assigned its Square Nr in one pass and all per-square columns
+# of All Squares are computed with one grouped reduction.
+# The output is that of the per square path ('Square Engine' set to 'Per Square'), except that the sums and means
+# add the values of a square in another order. These agree with process_square within a relative difference of
+# 1e-12, but when a value sits on a rounding boundary it can end up one unit apart in its last decimal in All Squares.
+# src/Benchmarks/Square_Engine_Parity checks this.
+# ----------------------------------------------------------------------------------------------------
+
+
+def assign_square_nrs(x, y, nr_of_squares_in_row: int) -> np.ndarray:
+    """
+    Assign a square sequence number to every track, using the same geometry as get_square_coordinates:
+    a track belongs to the square when x0 <= x < x1 and y0 <= y < y1.
+
+    :param x: The Track X Locations
+    :param y: The Track Y Locations
+    :param nr_of_squares_in_row: The number of rows and columns in the image
+    :return: An integer array with the square sequence number for each track, -1 for tracks outside the grid
+    """
+
+    width = 82.0864 / nr_of_squares_in_row
+    height = 82.0864 / nr_of_squares_in_row
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    with np.errstate(invalid='ignore'):
+        col = np.floor(x / width)
+        row = np.floor(y / height)
+        col = np.where(np.isfinite(col), col, -1)
+        row = np.where(np.isfinite(row), row, -1)
+
+        # The division can put a track that sits exactly on a boundary in the neighbouring square.
+        # Correct that by comparing against the square edges, calculated as in get_square_coordinates
+        col -= x < col * width
+        col += x >= (col + 1) * width
+        row -= y < row * height
+        row += y >= (row + 1) * height
+
+    valid = (col >= 0) & (col < nr_of_squares_in_row) & (row >= 0) & (row < nr_of_squares_in_row)
+    square_nrs = np.where(valid, row * nr_of_squares_in_row + col, -1).astype(np.int64)
+    return square_nrs
+
+
+def sum_per_square(values: np.ndarray, square_nrs: np.ndarray, nr_total_squares: int) -> tuple:
+    """
+    Sum the values of every square in one pass, skipping missing values as Series.sum does in process_square.
+    The values are added in another order than process_square adds them, so a sum can differ from it in the last bits
+    (well within a relative difference of 1e-12).
+
+    :param values: The values of the tracks
+    :param square_nrs: The Square Nr of each track
+    :param nr_total_squares: The number of squares in the recording
+    :return: The sums and the number of values that are not missing, per square
+    """
+
+    is_present = ~np.isnan(values)
+    sums = np.bincount(square_nrs, weights=np.where(is_present, values, 0.0), minlength=nr_total_squares)
+    counts = np.bincount(square_nrs[is_present], minlength=nr_total_squares)
+    return sums, counts
+
+
+def generate_squares_of_recording(
+        df_tracks_of_recording: pd.DataFrame,
+        recording_data: pd.Series,
+        nr_of_squares_in_row: int,
+        concentration: float,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int,
+        square_area: float) -> tuple:
+    """
+    Calculate all squares of a Recording in one pass over the tracks.
+    The tracks are binned once, the statistics are calculated with one grouped reduction, the variability with one
+    histogram and only the Tau and long/short track calculations are done for each non-empty square.
+
+    :return: The squares dataframe (one row per square, in Square Nr order) and the tracks with the Square Nr set
+    """
+
+    nr_total_squares = int(nr_of_squares_in_row * nr_of_squares_in_row)
+    recording_name = recording_data['Ext Recording Name']
+
+    with measure_stage('Binning', recording_name):
+        # Assign the Square Nr to all tracks. Tracks that are outside the grid keep None, as in process_square
+        square_nrs = assign_square_nrs(
+            df_tracks_of_recording['Track X Location'],
+            df_tracks_of_recording['Track Y Location'],
+            nr_of_squares_in_row)
+        in_grid = square_nrs >= 0
+        square_nr_column = square_nrs.astype(object)
+        square_nr_column[~in_grid] = None
+        df_tracks_of_recording['Square Nr'] = square_nr_column
+
+        # Compute all the per-square statistics with one grouped reduction
+        df_tracks_in_grid = df_tracks_of_recording[in_grid]
+        square_nrs_in_grid = square_nrs[in_grid]
+        df_stats = df_tracks_in_grid.groupby(square_nrs_in_grid, sort=True).agg(
+            nr_tracks=('Track Duration', 'size'),
+            median_dc=('Diffusion Coefficient', 'median'),
+            median_dc_ext=('Diffusion Coefficient Ext', 'median'),
+            median_displacement=('Track Displacement', 'median'),
+            max_displacement=('Track Displacement', 'max'),
+            median_max_speed=('Track Max Speed', 'median'),
+            max_max_speed=('Track Max Speed', 'max'),
+            median_mean_speed=('Track Mean Speed', 'median'),
+            max_mean_speed=('Track Mean Speed', 'max'),
+            max_track_duration=('Track Duration', 'max'),
+            median_track_duration=('Track Duration', 'median'))
+        df_stats = df_stats.reindex(range(nr_total_squares))
+        df_stats['nr_tracks'] = df_stats['nr_tracks'].fillna(0).astype(int)
+
+        # The sums and means are taken with one weighted count over the squares
+        for column, mean_name in [('Diffusion Coefficient', 'mean_dc'), ('Diffusion Coefficient Ext', 'mean_dc_ext')]:
+            sums, counts = sum_per_square(
+                df_tracks_in_grid[column].to_numpy(dtype=float), square_nrs_in_grid, nr_total_squares)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                df_stats[mean_name] = np.where(counts > 0, sums / counts, np.nan)
+        for column, total_name in [
+                ('Track Displacement', 'total_displacement'), ('Track Duration', 'total_track_duration')]:
+            df_stats[total_name], _ = sum_per_square(
+                df_tracks_in_grid[column].to_numpy(dtype=float), square_nrs_in_grid, nr_total_squares)
+
+        nr_tracks_per_square = df_stats['nr_tracks'].to_numpy()
+
+        # The variability of all squares follows from one histogram of the tracks over the squares
+        granularity = get_paint_attribute_with_default('Generate Squares', 'Variability Granularity', 10)
+        variability_of_squares = calc_variability_of_squares(
+            df_tracks_in_grid['Track X Location'],
+            df_tracks_in_grid['Track Y Location'],
+            square_nrs_in_grid,
+            nr_of_squares_in_row,
+            granularity)
+
+    with measure_stage('Tau Fitting', recording_name):
+        # The Tau of all squares is fitted from their duration histograms in one call, so that the histograms can be
+        # fitted together
+        limit_dc = get_paint_attribute_with_default(
+            'Generate Squares', 'Exclude zero DC tracks from Tau Calculation', False)
+        used_for_tau = np.ones(len(df_tracks_in_grid), dtype=bool)
+        if limit_dc:
+            used_for_tau = df_tracks_in_grid['Diffusion Coefficient'].to_numpy() > 0
+        non_empty_squares = np.flatnonzero(nr_tracks_per_square)
+        duration_histograms = DurationHistograms(
+            df_tracks_in_grid['Track Duration'].to_numpy(),
+            square_nrs_in_grid,
+            nr_total_squares,
+            used_for_tau)
+        histograms_of_squares = duration_histograms.histograms_of_squares(non_empty_squares)
+        taus_of_squares, r_squareds_of_squares = calculate_taus_from_histograms(
+            histograms_of_squares,
+            min_tracks_for_tau,
+            min_required_r_squared,
+            get_tau_fitter())
+
+    # The confidence intervals of the Tau are only calculated, and added to the squares, when requested
+    nr_of_bootstrap_replicates, _ = get_tau_bootstrap_settings()
+    tau_ci_lows = [-1] * nr_total_squares
+    tau_ci_highs = [-1] * nr_total_squares
+    if nr_of_bootstrap_replicates > 0:
+        with measure_stage('Tau Bootstrap', recording_name):
+            tau_ci_lows_of_squares, tau_ci_highs_of_squares = calculate_tau_confidence_intervals(
+                histograms_of_squares, taus_of_squares, nr_of_bootstrap_replicates)
+            for i, square_seq_nr in enumerate(non_empty_squares):
+                tau_ci_lows[square_seq_nr] = tau_ci_lows_of_squares[i]
+                tau_ci_highs[square_seq_nr] = tau_ci_highs_of_squares[i]
+
+    with measure_stage('Square Statistics', recording_name):
+        # The median long and short track durations of all squares follow from one sort of the durations
+        median_long_tracks, median_short_tracks = calculate_median_long_and_short_tracks_of_squares(
+            df_tracks_in_grid['Track Duration'].to_numpy(),
+            square_nrs_in_grid,
+            nr_total_squares,
+            get_background_fraction())
+
+        taus = [-1] * nr_total_squares
+        r_squareds = [0] * nr_total_squares
+        densities = [0] * nr_total_squares
+        variabilities = [0] * nr_total_squares
+
+        for i, square_seq_nr in enumerate(non_empty_squares):
+            nr_of_tracks_in_square = int(nr_tracks_per_square[square_seq_nr])
+
+            taus[square_seq_nr], r_squareds[square_seq_nr] = taus_of_squares[i], r_squareds_of_squares[i]
+            densities[square_seq_nr] = calculate_density(
+                nr_tracks=nr_of_tracks_in_square, area=square_area, time=100, concentration=concentration)
+            variabilities[square_seq_nr] = variability_of_squares[square_seq_nr]
+
+        # Assemble the squares, with the columns in the same order and rounding as process_square
+        coordinates = [get_square_coordinates(nr_of_squares_in_row, square_seq_nr)
+                       for square_seq_nr in range(nr_total_squares)]
+        square_seq_nrs = np.arange(nr_total_squares)
+
+        squares = {
+            'Recording Sequence Nr': [recording_data['Recording Sequence Nr']] * nr_total_squares,
+            'Ext Recording Name': [recording_data['Ext Recording Name']] * nr_total_squares,
+            'Experiment Name': [recording_data['Experiment Name']] * nr_total_squares,
+            'Experiment Date': [recording_data['Experiment Date']] * nr_total_squares,
+            'Condition Nr': [recording_data['Condition Nr']] * nr_total_squares,
+            'Replicate Nr': [recording_data['Replicate Nr']] * nr_total_squares,
+            'Square Nr': square_seq_nrs,
+            'Probe': [recording_data['Probe']] * nr_total_squares,
+            'Probe Type': [recording_data['Probe Type']] * nr_total_squares,
+            'Cell Type': [recording_data['Cell Type']] * nr_total_squares,
+            'Adjuvant': [recording_data['Adjuvant']] * nr_total_squares,
+            'Concentration': [recording_data['Concentration']] * nr_total_squares,
+            'Threshold': [recording_data['Threshold']] * nr_total_squares,
+            'Row Nr': square_seq_nrs // nr_of_squares_in_row + 1,
+            'Col Nr': square_seq_nrs % nr_of_squares_in_row + 1,
+            'Label Nr': 0,
+            'Cell Id': 0,
+            'Nr Spots': [recording_data['Nr Spots']] * nr_total_squares,
+            'Nr Tracks': nr_tracks_per_square,
+            'X0': [round(x0, 2) for x0, _, _, _ in coordinates],
+            'Y0': [round(y0, 2) for _, y0, _, _ in coordinates],
+            'X1': [round(x1, 2) for _, _, x1, _ in coordinates],
+            'Y1': [round(y1, 2) for _, _, _, y1 in coordinates],
+            'Selected': True,
+            'Variability': [round(variability, 2) for variability in variabilities],
+            'Density': [round(density, 5) for density in densities],
+            'Density Ratio': 0.0,
+            'Tau': [round(tau, 0) for tau in taus],
+            'R Squared': [round(r_squared, 2) for r_squared in r_squareds],
+            **({'Tau CI Low': [round(tau_ci_low, 0) for tau_ci_low in tau_ci_lows],
+                'Tau CI High': [round(tau_ci_high, 0) for tau_ci_high in tau_ci_highs]}
+               if nr_of_bootstrap_replicates > 0 else {}),
+
+            'Median Diffusion Coefficient': df_stats['median_dc'].round(4).to_numpy(),
+            'Mean Diffusion Coefficient': df_stats['mean_dc'].round(4).to_numpy(),
+
+            'Median Diffusion Coefficient Ext': df_stats['median_dc_ext'].round(4).to_numpy(),
+            'Mean Diffusion Coefficient Ext': df_stats['mean_dc_ext'].round(4).to_numpy(),
+
+            'Median Long Track Duration': [round(median, 3) for median in median_long_tracks],
+            'Median Short Track Duration': [round(median, 3) for median in median_short_tracks],
+
+            'Median Displacement': df_stats['median_displacement'].round(3).to_numpy(),
+            'Max Displacement': df_stats['max_displacement'].round(3).to_numpy(),
+            'Total Displacement': df_stats['total_displacement'].round(3).to_numpy(),
+
+            'Median Max Speed': df_stats['median_max_speed'].round(3).to_numpy(),
+            'Max Max Speed': df_stats['max_max_speed'].round(3).to_numpy(),
+
+            'Median Mean Speed': df_stats['median_mean_speed'].round(3).to_numpy(),
+            'Max Mean Speed': df_stats['max_mean_speed'].round(3).to_numpy(),
+
+            'Max Track Duration': df_stats['max_track_duration'].round(3).to_numpy(),
+            'Total Track Duration': df_stats['total_track_duration'].round(3).to_numpy(),
+            'Median Track Duration': df_stats['median_track_duration'].round(3).to_numpy(),
+
+            'Square Manually Excluded': False,
+            'Image Excluded': False
+        }
+        df_squares_of_recording = pd.DataFrame(squares)
+
+    return df_squares_of_recording, df_tracks_of_recording
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from src.Application.Support.Paint_Schema import common_column_dtype
+
+pd.options.mode.copy_on_write = True
+
+# ----------------------------------------------------------------------------------------------------
+# A columnar table for the squares of an Experiment. Instead of concatenating the squares of every
+# Recording onto a growing DataFrame (which copies all previous squares for every Recording), the rows
+# are copied into one preallocated array per column and converted to a DataFrame once, when the
+# All Squares file is written.
+# ----------------------------------------------------------------------------------------------------
+
+
+class SquareTable:
+    """
+    Preallocated column arrays for the squares of an Experiment, sized for all Recordings x all squares.
+    The arrays are typed by the first rows that are added. When later rows have another type, the column is converted
+    following the same rules as pd.concat, so to_dataframe returns what concatenating the DataFrames would return.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(int(capacity), 1)
+        self.nr_rows = 0
+        self.columns = {}
+
+    def __len__(self):
+        return self.nr_rows
+
+    def add_rows(self, df_squares: pd.DataFrame) -> None:
+        """
+        Copy the squares of a Recording into the table
+        """
+
+        columns = {column_name: df_squares[column_name].to_numpy() for column_name in df_squares.columns}
+        self._add(columns, len(df_squares))
+
+    def add_record(self, square_data: dict) -> None:
+        """
+        Copy the data of a single square into the table
+        """
+
+        columns = {column_name: np.array([value], dtype=value_dtype(value)) for column_name, value in square_data.items()}
+        self._add(columns, 1)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Convert the filled part of the table to a DataFrame, with the columns in the order in which they were added.
+        The DataFrame uses the column arrays of the table, they are not copied.
+        """
+
+        return pd.DataFrame({column_name: column[:self.nr_rows] for column_name, column in self.columns.items()},
+                            copy=False)
+
+    def _add(self, columns: dict, nr_new_rows: int) -> None:
+        if self.nr_rows + nr_new_rows > self.capacity:
+            self._grow(max(2 * self.capacity, self.nr_rows + nr_new_rows))
+
+        start = self.nr_rows
+        end = start + nr_new_rows
+        for column_name, values in columns.items():
+            if column_name not in self.columns:
+                self.columns[column_name] = self._allocate(values.dtype, start)
+            column = self.columns[column_name]
+            common_dtype = common_column_dtype(column.dtype, values.dtype)
+            if common_dtype != column.dtype:
+                column = column.astype(common_dtype)
+                self.columns[column_name] = column
+            column[start:end] = values
+
+        # Columns that these squares do not have are missing values, as in pd.concat
+        for column_name in self.columns:
+            if column_name not in columns:
+                self._fill_missing(column_name, start, end)
+
+        self.nr_rows = end
+
+    def _allocate(self, dtype: np.dtype, nr_missing_rows: int) -> np.ndarray:
+        if nr_missing_rows > 0:
+            # The column appears after earlier squares that did not have it: those rows are missing values
+            dtype = common_column_dtype(dtype, np.dtype(float))
+        column = np.empty(self.capacity, dtype=dtype)
+        if nr_missing_rows > 0:
+            column[:nr_missing_rows] = None if dtype == object else np.nan
+        return column
+
+    def _fill_missing(self, column_name: str, start: int, end: int) -> None:
+        column = self.columns[column_name]
+        if column.dtype.kind not in 'fO':
+            column = column.astype(common_column_dtype(column.dtype, np.dtype(float)))
+            self.columns[column_name] = column
+        column[start:end] = None if column.dtype == object else np.nan
+
+    def _grow(self, capacity: int) -> None:
+        for column_name, column in self.columns.items():
+            grown_column = np.empty(capacity, dtype=column.dtype)
+            grown_column[:self.nr_rows] = column[:self.nr_rows]
+            self.columns[column_name] = grown_column
+        self.capacity = capacity
+
+
+def value_dtype(value) -> np.dtype:
+    """
+    The dtype that pandas gives a column holding a single value
+    """
+
+    if isinstance(value, (bool, np.bool_)):
+        return np.dtype(bool)
+    if isinstance(value, (int, np.integer)):
+        return np.dtype(np.int64)
+    if isinstance(value, (float, np.floating)):
+        return np.dtype(float)
+    return np.dtype(object)
@@ -0,0 +1,51 @@
+from src.Application.Support.Track_Store import get_tracks_size
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# ----------------------------------------------------------------------------------------------------
+# Deciding whether the tracks of an Experiment are processed one Recording at a time. For large Experiments
+# the complete set of tracks does not fit in memory, but the tracks of one Recording do. The memory needed
+# is estimated from the size of the tracks on disk; the reading and writing per Recording is done by the
+# Track_Store module.
+# ----------------------------------------------------------------------------------------------------
+
+# Peak memory of Generate Squares relative to the size of the tracks on disk (measured at about 3.2 for CSV)
+TRACKS_MEMORY_FACTORS = {
+    'CSV': 4,
+    'Parquet': 8,
+    'Feather': 4}
+
+
+def get_memory_budget() -> int:
+    """
+    The memory budget in MB for the tracks of an Experiment, 0 for no budget
+    """
+
+    return int(get_paint_attribute_with_default('Generate Squares', 'Memory Budget (MB)', 8192))
+
+
+def estimate_memory_for_tracks(experiment_path: str) -> float:
+    """
+    An estimate in MB of the memory needed to process all tracks of an Experiment at once
+    """
+
+    track_format, tracks_size = get_tracks_size(experiment_path)
+    if track_format is None:
+        return 0
+    return TRACKS_MEMORY_FACTORS[track_format] * tracks_size / (1024 * 1024)
+
+
+def needs_streaming(experiment_path: str) -> bool:
+    """
+    True if the estimated memory for the tracks of the Experiment exceeds the memory budget
+    """
+
+    memory_budget = get_memory_budget()
+    if memory_budget <= 0:
+        return False
+    memory_needed = estimate_memory_for_tracks(experiment_path)
+    if memory_needed > memory_budget:
+        paint_logger.info(f"The tracks of {experiment_path} need an estimated {memory_needed:.0f} MB, "
+                          f"more than the memory budget of {memory_budget} MB: processing one recording at a time")
+        return True
+    return False
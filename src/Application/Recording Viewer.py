@@ -15,11 +15,12 @@ from tkinter import ttk
 import pandas as pd
 from PIL import Image
 
+from src.Application.Generate_Squares.Duration_Histograms import DurationHistograms
 from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
-    calculate_tau,
-    extra_constraints_on_tracks_for_tau_calculation,
+    calculate_taus_from_histograms,
     calc_area_of_square,
-    calculate_density)
+    calculate_density,
+    create_unique_key_for_tracks)
 from src.Application.Recording_Viewer.Class_Define_Cell_Dialog import DefineCellDialog
 from src.Application.Recording_Viewer.Class_Heatmap_Dialog import HeatMapDialog
 from src.Application.Recording_Viewer.Class_Select_Recording_Dialog import SelectRecordingDialog
@@ -42,6 +43,12 @@ from src.Application.Recording_Viewer.Select_Squares import (
 from src.Application.Support.General_Support_Functions import (
     read_squares_from_file,
     set_application_icon)
+from src.Application.Support.Paint_Schema import (
+    RECORDINGS_SCHEMA,
+    read_csv_with_schema)
+from src.Application.Support.Track_Store import (
+    read_tracks,
+    write_track_squares)
 from src.Fiji.LoggerConfig import (
     paint_logger,
     paint_logger_change_file_handler_name)
@@ -112,6 +119,7 @@ class RecordingViewer:
         self.df_squares = None
         self.df_all_tracks = None
         self.df_experiment = None
+        self.duration_histograms = {}
 
         # UI state variables
         self.start_x = None
@@ -336,9 +344,8 @@ class RecordingViewer:
             self.show_error_and_exit("No 'All Squares.csv.csv' file, Did you select an image directory?")
 
         # Read the 'All Recordings' file
-        self.df_experiment = pd.read_csv(os.path.join(self.user_specified_directory, 'All Recordings.csv'),
-                                         dtype={'Max Allowable Variability': float,
-                                                'Min Required Density Ratio': float})
+        self.df_experiment = read_csv_with_schema(os.path.join(self.user_specified_directory, 'All Recordings.csv'),
+                                                  RECORDINGS_SCHEMA, compact=False)
 
         if self.df_experiment is None:
             self.show_error_and_exit("No 'All Recordings' file, Did you select an image directory?")
@@ -355,11 +362,13 @@ class RecordingViewer:
                 "The recordings in the 'All Squares' file do not align with the 'All Experiments' file")
 
         # Read the 'All Tracks' file
-        self.df_all_tracks = pd.read_csv(os.path.join(self.user_specified_directory, 'All Tracks.csv'))
+        self.df_all_tracks = read_tracks(self.user_specified_directory)
         if self.df_all_tracks is None:
             self.show_error_and_exit("No 'All Tracks' file, Did you select an image directory?")
+        if 'Square Nr' not in self.df_all_tracks.columns:
+            self.show_error_and_exit("No squares assigned to the tracks. Did you run Generate Squares?")
         if 'Unique Key' not in self.df_all_tracks.columns:
-            self.show_error_and_exit("No 'Unique Key' in the All Tracks file. Did you run Generate Squares?")
+            self.df_all_tracks = create_unique_key_for_tracks(self.df_all_tracks)
         self.df_all_tracks.set_index('Unique Key', inplace=True, drop=False)
 
         self.nr_of_squares_in_row = int(self.df_experiment.iloc[0]['Nr of Squares in Row'])
@@ -1246,12 +1255,13 @@ class RecordingViewer:
         # Update the label information in the tracks and squares data corresponding to the image
         dfs, dft = relabel_tracks(df_recording_squares, df_recording_tracks)
 
-        # Update the label information in the All Squares and All Tracks dataframes
-        self.df_all_tracks.update(dft, overwrite=True)
+        # Update the label information in the All Squares and All Tracks dataframes (only the square columns of the
+        # tracks change)
         self.df_all_squares.update(dfs, overwrite=True)
 
         self.df_all_tracks.loc[dft.index, 'Label Nr'] = dft['Label Nr']
         self.df_all_tracks.loc[dft.index, 'Square Nr'] = dft['Square Nr']
+        self.duration_histograms.pop(self.image_name, None)
 
         self.df_all_squares.loc[dfs.index, 'Label Nr'] = dfs['Label Nr']
         self.df_all_squares.loc[dfs.index, 'Square Nr'] = dfs['Square Nr']
@@ -1276,7 +1286,7 @@ class RecordingViewer:
         if save:
             # Save the data
             self.df_all_squares.to_csv(os.path.join(self.user_specified_directory, 'All Squares.csv'), index=False)
-            self.df_all_tracks.to_csv(os.path.join(self.user_specified_directory, 'All Tracks.csv'), index=False)
+            write_track_squares(self.df_all_tracks, self.user_specified_directory)
             self.df_experiment.to_csv(os.path.join(self.user_specified_directory, 'All Recordings.csv'), index=False)
 
         return save
@@ -1429,22 +1439,25 @@ def recalc_recording_tau_and_density(self):
     if 'Square Manually Excluded' in self.df_squares.columns:
         df_squares_for_single_tau = df_squares_for_single_tau[df_squares_for_single_tau['Square Manually Excluded'] == False]
 
-    df_tracks_for_recording = self.df_all_tracks[self.df_all_tracks['Ext Recording Name'] == self.image_name]
+    # The duration histograms of the squares are made once per recording, a new selection only sums them
+    duration_histograms = self.duration_histograms.get(self.image_name)
+    if duration_histograms is None:
+        df_tracks_for_recording = self.df_all_tracks[self.df_all_tracks['Ext Recording Name'] == self.image_name]
+        duration_histograms = DurationHistograms.from_tracks(df_tracks_for_recording, self.nr_of_squares_in_row ** 2)
+        self.duration_histograms[self.image_name] = duration_histograms
+    histogram = duration_histograms.histogram(df_squares_for_single_tau['Square Nr'].to_numpy())
 
-    df_tracks_for_tau = df_tracks_for_recording[
-        df_tracks_for_recording['Square Nr'].isin(df_squares_for_single_tau['Square Nr'])]
-    df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks_for_tau)
-
-    tau, r_squared = calculate_tau(
-        df_tracks_for_tau,
+    taus, r_squareds = calculate_taus_from_histograms(
+        [histogram],
         # self.min_tracks_for_tau,
         10,
         self.min_required_r_squared)
+    tau, r_squared = taus[0], r_squareds[0]
 
     # Calculate the Density values
     area = calc_area_of_square(self.nr_of_squares_in_row)
     density = calculate_density(
-        nr_tracks=len(df_tracks_for_tau),
+        nr_tracks=int(histogram[1].sum()),
         area=area,
         time=100,
         # concentration=self.concentration,   # ToDO
@@ -1,4 +1,7 @@
 import numpy as np
+import pandas as pd
+
+from src.Fiji.LoggerConfig import paint_logger
 
 
 # -------------------------------------------------------------------------------------------------------------
@@ -126,128 +129,87 @@ def _select_squares_actual(
 
 
 
-def select_squares_neighbour_strict(df_squares, nr_of_squares_in_row):
-    """
-    Identifies squares with visible neighbors in strict mode and updates their Selected status.
-    """
-    list_of_squares = []
-
-    for index, square in df_squares.iterrows():
-        if not square['Selected']:
-            continue
-
-        row, col = square['Row Nr'], square['Col Nr']
-        square_nr = square['Square Nr']
-
-        # Define neighboring squares based on position
-        neighbours = get_strict_neighbours(row, col, nr_of_squares_in_row)
+# -------------------------------------------------------------------------------------------------------------
+# The neighbour rules work on the grid of squares. 'Selected' is laid out as a boolean array of recordings x rows x
+# columns and the selected neighbours of every square are counted by convolving it with a 3x3 mask: the 4 squares
+# left, right, above and below for Strict, all 8 surrounding squares for Relaxed. Squares of different recordings are
+# never neighbours.
+#
+# The square by square implementation deselected the squares one after the other, looking at the selection as it was
+# at that moment. That gives the same result as looking at the original selection for all squares at once: a square is
+# only deselected when none of its neighbours is selected, and as the neighbour relation is symmetric, it is then
+# nobody's selected neighbour.
+# -------------------------------------------------------------------------------------------------------------
 
-        # Check if there are visible neighbors
-        has_visible_neighbors = False
-        for nb in neighbours:
-            # Calculate the neighbor index
-            neighbor_index = int((nb[0] - 1) * nr_of_squares_in_row + (nb[1] - 1))
+STRICT_NEIGHBOUR_MASK = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]], dtype=bool)
+RELAXED_NEIGHBOUR_MASK = np.array([[1, 1, 1], [1, 0, 1], [1, 1, 1]], dtype=bool)
 
-            # Check if the neighbor exists and is visible
-            if neighbor_index in df_squares.index and df_squares.loc[neighbor_index, 'Selected']:
-                has_visible_neighbors = True
-                break  # Exit early if any visible neighbor is found
 
-        # Update visibility based on visible neighbors
-        df_squares.at[square_nr, 'Selected'] = has_visible_neighbors
-        if has_visible_neighbors:
-            list_of_squares.append(square_nr)
+def select_squares_neighbour_strict(df_squares, nr_of_squares_in_row):
+    """
+    Deselects the selected squares that have no selected square to their left or right, or above or below them.
+    """
 
-    return df_squares, list_of_squares
+    return select_squares_with_neighbours(df_squares, nr_of_squares_in_row, STRICT_NEIGHBOUR_MASK)
 
 
 def select_squares_neighbour_relaxed(df_squares, nr_of_squares_in_row):
     """
-    Updates visibility of squares based on relaxed neighborhood conditions,
-    ensuring isolated border squares are eliminated.
+    Deselects the selected squares that have no selected square among the eight squares around them.
     """
-    # Keep track of squares that remain selected
-    list_of_squares = []
-
-    for index, square in df_squares.iterrows():
-        if not square['Selected']:
-            continue  # Skip unselected squares
 
-        row, col = square['Row Nr'], square['Col Nr']
-        square_nr = square['Square Nr']
+    return select_squares_with_neighbours(df_squares, nr_of_squares_in_row, RELAXED_NEIGHBOUR_MASK)
 
-        # Get neighbors
-        neighbours = get_relaxed_neighbours(row, col, nr_of_squares_in_row)
 
-        # Check the visibility of neighbors
-        has_visible_neighbors = False
-        for nb in neighbours:
-            # Calculate neighbor index
-            neighbor_index = (nb[0] - 1) * nr_of_squares_in_row + (nb[1] - 1)
+def select_squares_with_neighbours(df_squares, nr_of_squares_in_row, neighbour_mask):
+    """
+    Deselects the selected squares without a selected neighbour, the neighbours being the positions of neighbour_mask,
+    a 3x3 boolean array centred on the square. Returns df_squares and the Square Nrs of the squares still selected.
+    Squares with a Square Nr outside the grid (from another 'Nr of Squares in Row') have no neighbours.
+    """
 
-            # Ensure the neighbor exists in the grid and is selected
-            if neighbor_index in df_squares.index and df_squares.loc[neighbor_index, 'Selected']:
-                has_visible_neighbors = True
-                break  # Exit early if any visible neighbor is found
+    if len(df_squares) == 0:
+        return df_squares, []
 
-        # Update 'Selected' status based on neighbors
-        if has_visible_neighbors:
-            list_of_squares.append(square_nr)
-        else:
-            df_squares.at[square_nr, 'Selected'] = False  # Mark as not visible
+    selected = df_squares['Selected'].to_numpy(dtype=bool)
+    square_nrs = pd.to_numeric(df_squares['Square Nr'], errors='coerce').to_numpy(dtype=float)
+    if 'Ext Recording Name' in df_squares.columns:
+        recording_nrs, recording_names = pd.factorize(df_squares['Ext Recording Name'], use_na_sentinel=False)
+    else:
+        recording_nrs, recording_names = np.zeros(len(df_squares), dtype=int), ['']
 
-    return df_squares, list_of_squares
+    # Squares that are not on the grid are left out of it
+    in_grid = (square_nrs >= 0) & (square_nrs < nr_of_squares_in_row * nr_of_squares_in_row)
+    if not in_grid.all():
+        for recording_nr in np.unique(recording_nrs[~in_grid]):
+            paint_logger.warning(
+                f"Recording {recording_names[recording_nr]} has squares with a Square Nr outside the grid of "
+                f"{nr_of_squares_in_row} x {nr_of_squares_in_row} squares, these have no neighbours")
+    square_nrs = np.where(in_grid, square_nrs, 0).astype(int)
+    rows, cols = np.divmod(square_nrs, nr_of_squares_in_row)
 
+    # Squares that are not in df_squares count as not selected
+    selected_grid = np.zeros((recording_nrs.max() + 1, nr_of_squares_in_row, nr_of_squares_in_row), dtype=bool)
+    selected_grid[recording_nrs[in_grid], rows[in_grid], cols[in_grid]] = selected[in_grid]
+    has_selected_neighbour = count_selected_neighbours(selected_grid, neighbour_mask) > 0
 
-def get_strict_neighbours(row, col, nr_of_squares_in_row):
-    """
-    Returns neighboring positions for strict neighborhood rule.
-    """
-    left = (row, max(col - 1, 1))
-    right = (row, min(col + 1, nr_of_squares_in_row))
-    above = (max(row - 1, 1), col)
-    below = (min(row + 1, nr_of_squares_in_row), col)
-
-    if row == 1:
-        return [right, below] if col == 1 else \
-            [left, below] if col == nr_of_squares_in_row else \
-                [left, right, below]
-    elif row == nr_of_squares_in_row:
-        return [right, above] if col == 1 else \
-            [left, above] if col == nr_of_squares_in_row else \
-                [left, right, above]
-    else:
-        return [right, below, above] if col == 1 else \
-            [left, below, above] if col == nr_of_squares_in_row else \
-                [left, right, below, above]
+    still_selected = selected & in_grid & has_selected_neighbour[recording_nrs, rows, cols]
+    df_squares['Selected'] = still_selected
+    return df_squares, square_nrs[still_selected].tolist()
 
 
-def get_relaxed_neighbours(row, col, nr_of_squares_in_row):
+def count_selected_neighbours(selected_grid, neighbour_mask):
     """
-    Returns all eight possible neighboring positions for relaxed neighborhood rule,
-    strictly considering grid boundaries.
+    Counts the selected neighbours of every square of the grids, by convolving them with neighbour_mask.
+    Positions outside a grid are not selected.
     """
-    neighbours = []
-    max_row, max_col = nr_of_squares_in_row, nr_of_squares_in_row
-
-    # Potential neighbor positions
-    potential_neighbours = [
-        (row, col - 1),  # Left
-        (row, col + 1),  # Right
-        (row - 1, col),  # Above
-        (row + 1, col),  # Below
-        (row + 1, col - 1),  # Below Left
-        (row + 1, col + 1),  # Below Right
-        (row - 1, col - 1),  # Above Left
-        (row - 1, col + 1),  # Above Right
-    ]
-
-    # Filter valid positions within bounds
-    for nb_row, nb_col in potential_neighbours:
-        if 1 <= nb_row <= max_row and 1 <= nb_col <= max_col:
-            neighbours.append((nb_row, nb_col))
-
-    return neighbours
+
+    nr_of_rows, nr_of_cols = selected_grid.shape[-2:]
+    padded_grid = np.pad(selected_grid, [(0, 0)] * (selected_grid.ndim - 2) + [(1, 1), (1, 1)])
+    nr_of_selected_neighbours = np.zeros(selected_grid.shape, dtype=np.int8)
+    for mask_row, mask_col in zip(*np.nonzero(neighbour_mask)):
+        nr_of_selected_neighbours += padded_grid[..., mask_row:mask_row + nr_of_rows, mask_col:mask_col + nr_of_cols]
+    return nr_of_selected_neighbours
 
 
 def label_selected_squares(df_squares):
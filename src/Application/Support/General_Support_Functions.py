@@ -8,6 +8,12 @@ import pandas as pd
 from PIL import Image, ImageTk
 import tkinter as tk
 
+from src.Application.Support.Paint_Schema import (
+    RECORDINGS_SCHEMA,
+    SQUARES_SCHEMA,
+    apply_schema,
+    read_csv_with_schema)
+from src.Application.Support.Track_Store import TRACK_STORE_NAMES, tracks_exist
 from src.Fiji.LoggerConfig import paint_logger
 
 pd.options.mode.copy_on_write = True
@@ -28,7 +34,7 @@ def read_experiment_file(experiment_file_path: str, only_records_to_process: boo
     """
 
     try:
-        df_experiment = pd.read_csv(experiment_file_path, header=0, skiprows=[])
+        df_experiment = read_csv_with_schema(experiment_file_path, RECORDINGS_SCHEMA, compact=False)
     except IOError:
         return None
 
@@ -36,7 +42,6 @@ def read_experiment_file(experiment_file_path: str, only_records_to_process: boo
         df_experiment = df_experiment[df_experiment['Process'].str.lower().isin(['yes', 'y'])]
 
     df_experiment.set_index('Ext Recording Name', inplace=True, drop=False)
-    df_experiment['Experiment Date'] = df_experiment['Experiment Date'].astype(str)
 
     return df_experiment
 
@@ -54,14 +59,7 @@ def correct_all_recordings_column_types(file_path):
 
     try:
         df_experiment = pd.read_csv(file_path, header=0, skiprows=[])
-        df_experiment['Recording Sequence Nr'] = df_experiment['Recording Sequence Nr'].astype(int)
-        df_experiment['Condition Nr'] = df_experiment['Condition Nr'].astype(int)
-        df_experiment['Replicate Nr'] = df_experiment['Replicate Nr'].astype(int)
-        df_experiment['Experiment Date'] = df_experiment['Experiment Date'].astype(str)
-        df_experiment['Threshold'] = df_experiment['Threshold'].astype(int)
-        df_experiment['Min Tracks for Tau'] = df_experiment['Min Tracks for Tau'].astype(int)
-        df_experiment['Min Required R Squared'] = df_experiment['Min Required R Squared'].astype(float)
-        df_experiment['Nr of Squares in Row'] = df_experiment['Nr of Squares in Row'].astype(int)
+        df_experiment = apply_schema(df_experiment, RECORDINGS_SCHEMA, compact=False, strict=True)
         df_experiment.to_csv(file_path, index=False)
     except (ValueError, TypeError):
         return False
@@ -70,13 +68,11 @@ def correct_all_recordings_column_types(file_path):
 
 def read_squares_from_file(squares_file_path):
     try:
-        df_squares = pd.read_csv(squares_file_path, header=0, dtype={'Experiment Name': str})
+        df_squares = read_csv_with_schema(squares_file_path, SQUARES_SCHEMA)
     except IOError:
         paint_logger.error(f'Read_squares from_file: file {squares_file_path} could not be opened.')
         exit(-1)
 
-    df_squares['Experiment Date'] = df_squares['Experiment Date'].astype(str)
-
     df_squares.set_index('Unique Key', inplace=True, drop=False)
     return df_squares
 
@@ -179,7 +175,7 @@ def classify_directory_work(directory_path):
     experiment_files = {"Experiment Info.csv", "All Recordings.csv"}
     required_dirs = {"Brightfield Images", "TrackMate Images"}
     optional_file = "All Squares.csv"
-    optional_files = {"All Squares.csv", "All Tracks.csv", "Paint.json"}
+    optional_files = {"All Squares.csv", "Paint.json"} | set(TRACK_STORE_NAMES.values())
     output_dir = directory / "Output"
 
     has_experiment_files = all((directory / file).is_file() for file in experiment_files)
@@ -211,9 +207,9 @@ def classify_directory_work(directory_path):
 
     # Check for project directory
     experiment_dirs = [item for item in contents if item.is_dir() and classify_directory_work(item)["type"] == "Experiment"]
-    project_files = {"All Recordings.csv", "All Tracks.csv", "All Squares.csv"}
+    project_files = {"All Recordings.csv", "All Squares.csv"}
 
-    has_project_files = all((directory / file).is_file() for file in project_files)
+    has_project_files = all((directory / file).is_file() for file in project_files) and tracks_exist(directory)
 
     if experiment_dirs:
         additional_dirs = [item for item in contents if item.is_dir() and item != output_dir and item not in experiment_dirs]
@@ -0,0 +1,202 @@
+import numpy as np
+import pandas as pd
+
+from src.Fiji.LoggerConfig import paint_logger
+
+# ----------------------------------------------------------------------------------------------------
+# The column types of the All Tracks, All Squares and All Recordings files, used by every reader of these
+# files instead of letting pandas infer the types. Strings that repeat for every track or square (the
+# Recording name, Probe, Cell Type, ...) are read as categoricals and counts and numbers as 32-bit integers.
+# Measured values stay 64-bit floats: single precision would change the Tau, Density and statistics that
+# are calculated from them. Columns declared INFERRED can hold integers or floats (or are empty), depending
+# on the data; for these pandas decides, so that a file that is read and written again does not change.
+#
+# Categoricals save most memory, but a new value can not be assigned to a categorical column. Readers of
+# data that is modified pass compact=False, in which case the categorical columns are read as strings.
+# ----------------------------------------------------------------------------------------------------
+
+CATEGORY = 'category'
+INFERRED = None
+
+TRACKS_SCHEMA = {
+    'Unique Key': str,
+    'Ext Recording Name': CATEGORY,
+    'Track Id': 'int32',
+    'Track Label': str,
+    'Nr Spots': 'int32',
+    'Nr Gaps': 'int32',
+    'Longest Gap': 'int32',
+    'Track Duration': 'float64',
+    'Track X Location': 'float64',
+    'Track Y Location': 'float64',
+    'Track Displacement': 'float64',
+    'Track Total Distance': 'float64',
+    'Track Max Speed': 'float64',
+    'Track Median Speed': 'float64',
+    'Track Mean Speed': 'float64',
+    'Diffusion Coefficient': 'float64',
+    'Diffusion Coefficient Ext': 'float64',
+    'Square Nr': INFERRED,
+    'Label Nr': INFERRED}
+
+# The square and label of each track, stored next to the tracks (see Track_Store)
+TRACK_SQUARES_SCHEMA = {
+    'Ext Recording Name': CATEGORY,
+    'Track Id': 'int32',
+    'Square Nr': 'Int64',
+    'Label Nr': 'Int64'}
+
+# The duration histogram of each square, stored next to the squares (see Duration_Histograms)
+SQUARE_HISTOGRAMS_SCHEMA = {
+    'Ext Recording Name': CATEGORY,
+    'Square Nr': 'int32',
+    'Track Duration': 'float64',
+    'Frequency': 'int64'}
+
+SQUARES_SCHEMA = {
+    'Unique Key': str,
+    'Recording Sequence Nr': 'int32',
+    'Ext Recording Name': CATEGORY,
+    'Experiment Name': str,
+    'Experiment Date': str,
+    'Condition Nr': 'int32',
+    'Replicate Nr': 'int32',
+    'Square Nr': 'int32',
+    'Probe': CATEGORY,
+    'Probe Type': CATEGORY,
+    'Cell Type': CATEGORY,
+    'Adjuvant': CATEGORY,
+    'Concentration': INFERRED,
+    'Threshold': INFERRED,
+    'Row Nr': 'int32',
+    'Col Nr': 'int32',
+    'Label Nr': INFERRED,
+    'Cell Id': 'int32',
+    'Nr Spots': 'int32',
+    'Nr Tracks': 'int32',
+    'X0': 'float64',
+    'Y0': 'float64',
+    'X1': 'float64',
+    'Y1': 'float64',
+    'Selected': bool,
+    'Variability': 'float64',
+    'Density': 'float64',
+    'Density Ratio': 'float64',
+    'Tau': INFERRED,
+    'R Squared': 'float64',
+    'Tau CI Low': INFERRED,
+    'Tau CI High': INFERRED,
+    'Median Diffusion Coefficient': 'float64',
+    'Mean Diffusion Coefficient': 'float64',
+    'Median Diffusion Coefficient Ext': 'float64',
+    'Mean Diffusion Coefficient Ext': 'float64',
+    'Median Long Track Duration': 'float64',
+    'Median Short Track Duration': 'float64',
+    'Median Displacement': 'float64',
+    'Max Displacement': 'float64',
+    'Total Displacement': 'float64',
+    'Median Max Speed': 'float64',
+    'Max Max Speed': 'float64',
+    'Median Mean Speed': 'float64',
+    'Max Mean Speed': 'float64',
+    'Max Track Duration': 'float64',
+    'Total Track Duration': 'float64',
+    'Median Track Duration': 'float64',
+    'Square Manually Excluded': bool,
+    'Image Excluded': bool}
+
+RECORDINGS_SCHEMA = {
+    'Recording Sequence Nr': 'int32',
+    'Recording Name': str,
+    'Experiment Date': str,
+    'Experiment Name': str,
+    'Condition Nr': 'int32',
+    'Replicate Nr': 'int32',
+    'Probe': str,
+    'Probe Type': str,
+    'Cell Type': str,
+    'Adjuvant': str,
+    'Concentration': INFERRED,
+    'Threshold': 'int32',
+    'Process': str,
+    'Nr Spots': INFERRED,
+    'Nr Tracks': INFERRED,
+    'Run Time': INFERRED,
+    'Ext Recording Name': str,
+    'Recording Size': INFERRED,
+    'Time Stamp': INFERRED,
+    'Max Frame Gap': INFERRED,
+    'Gap Closing Max Distance': INFERRED,
+    'Linking Max Distance': INFERRED,
+    'Median Filtering': INFERRED,
+    'Nr Spots in All Tracks': INFERRED,
+    'Min Tracks for Tau': 'int32',
+    'Min Required R Squared': 'float64',
+    'Nr of Squares in Row': 'int32',
+    'Max Allowable Variability': 'float64',
+    'Min Required Density Ratio': 'float64',
+    'Exclude': INFERRED,
+    'Neighbour Mode': str,
+    'Tau': INFERRED,
+    'Density': INFERRED,
+    'R Squared': INFERRED,
+    'Tau CI Low': INFERRED,
+    'Tau CI High': INFERRED}
+
+
+def get_dtypes(schema: dict, compact: bool = True) -> dict:
+    """
+    The dtype argument for pd.read_csv: the declared columns, with categoricals read as strings if not compact
+    """
+
+    return {column: (dtype if compact or dtype != CATEGORY else str)
+            for column, dtype in schema.items() if dtype is not INFERRED}
+
+
+def apply_schema(df: pd.DataFrame, schema: dict, compact: bool = True, strict: bool = False) -> pd.DataFrame:
+    """
+    Convert the columns of a DataFrame that was read without the schema to their declared type.
+    A column that can not be converted (for instance an integer column with empty cells) keeps its type, unless
+    strict is set, in which case the error is raised.
+    """
+
+    for column, dtype in get_dtypes(schema, compact).items():
+        if column not in df.columns:
+            continue
+        try:
+            if dtype is str:
+                df[column] = df[column].astype(str).where(df[column].notna())
+            else:
+                df[column] = df[column].astype(dtype)
+        except (ValueError, TypeError):
+            if strict:
+                raise
+    return df
+
+
+def read_csv_with_schema(file_path: str, schema: dict, compact: bool = True, **read_csv_arguments) -> pd.DataFrame:
+    """
+    Read a Paint csv file with the column types of its schema.
+    When a column does not hold its declared type, the file is read with inferred types, which are then converted
+    where possible.
+    """
+
+    try:
+        return pd.read_csv(file_path, dtype=get_dtypes(schema, compact), **read_csv_arguments)
+    except (ValueError, TypeError) as e:
+        paint_logger.debug(f"{file_path} does not match its schema ({e}), the column types are inferred")
+    df = pd.read_csv(file_path, **read_csv_arguments)
+    return apply_schema(df, schema, compact)
+
+
+def common_column_dtype(dtype_1: np.dtype, dtype_2: np.dtype) -> np.dtype:
+    """
+    The dtype that pd.concat gives a column that has values of both dtypes: numbers are combined into the wider
+    number type, anything else (including booleans mixed with numbers) becomes object
+    """
+
+    if dtype_1 == dtype_2:
+        return dtype_1
+    if dtype_1.kind in 'iuf' and dtype_2.kind in 'iuf':
+        return np.result_type(dtype_1, dtype_2)
+    return np.dtype(object)
@@ -0,0 +1,719 @@
+import os
+import shutil
+import tempfile
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Support.Paint_Schema import (
+    TRACKS_SCHEMA,
+    TRACK_SQUARES_SCHEMA,
+    apply_schema,
+    common_column_dtype,
+    read_csv_with_schema)
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import (
+    get_paint_attribute_with_default,
+    set_mode_of_replacement_file)
+
+# pyarrow is only needed for the columnar track stores. Without it, tracks are stored in All Tracks.csv.
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+    pyarrow_available = True
+except ImportError:
+    pyarrow_available = False
+
+# ----------------------------------------------------------------------------------------------------
+# All reading and writing of the tracks of an Experiment or Project goes through this module.
+# Tracks are stored either in the 'All Tracks.csv' file or in a columnar store: an 'All Tracks.parquet' or
+# 'All Tracks.feather' directory that holds one file per Recording. The file names start with a sequence
+# number, which keeps the order of the Recordings, followed by the (URL encoded) Ext Recording Name, so
+# that the tracks of some Recordings can be read without touching the others. Only the requested columns
+# are read from a columnar store. The format is selected with 'Track Store' in the 'Paint' section of
+# Paint.json. Tracks are read from whichever store is present, preferring the selected one, and a write
+# removes the columnar stores in the other formats. 'All Tracks.csv' is what Run TrackMate writes and other
+# programs read, so it is kept next to a columnar store, unless 'Remove CSV After Conversion' is set. When
+# the CSV file is newer than the columnar store (TrackMate ran again), the store is out of date and the CSV
+# file is read instead, until the tracks are converted again.
+#
+# The tracks are not changed after Run TrackMate has written them. The square and label that Generate
+# Squares and the Recording Viewer assign to each track are stored separately, in a small 'Track Squares'
+# file next to the tracks, keyed by Ext Recording Name and Track Id. Reading the tracks adds its Square Nr
+# and Label Nr columns, so that readers see the tracks as if the columns were part of them.
+# ----------------------------------------------------------------------------------------------------
+
+TRACKS_CSV_FILE_NAME = 'All Tracks.csv'
+TRACK_STORE_NAMES = {
+    'CSV': TRACKS_CSV_FILE_NAME,
+    'Parquet': 'All Tracks.parquet',
+    'Feather': 'All Tracks.feather'}
+TRACK_FILE_EXTENSIONS = {
+    'Parquet': '.parquet',
+    'Feather': '.feather'}
+TRACK_SQUARES_NAMES = {
+    'CSV': 'Track Squares.csv',
+    'Parquet': 'Track Squares.parquet',
+    'Feather': 'Track Squares.feather'}
+
+TRACK_KEY_COLUMNS = ['Ext Recording Name', 'Track Id']
+TRACK_SQUARE_COLUMNS = ['Square Nr', 'Label Nr']
+TRACK_SQUARES_COLUMNS = TRACK_KEY_COLUMNS + TRACK_SQUARE_COLUMNS
+
+TRACKS_CHUNK_SIZE = 100000
+
+_warned_for_missing_pyarrow = False
+
+
+def get_track_store_format() -> str:
+    """
+    The format in which tracks are written: 'CSV' (default), 'Parquet' or 'Feather'
+    """
+
+    global _warned_for_missing_pyarrow
+
+    track_format = get_paint_attribute_with_default('Paint', 'Track Store', 'CSV')
+    if track_format not in TRACK_STORE_NAMES:
+        paint_logger.error(f"Unknown Track Store '{track_format}' in Paint.json, tracks are stored in CSV")
+        return 'CSV'
+    if track_format != 'CSV' and not pyarrow_available:
+        if not _warned_for_missing_pyarrow:
+            paint_logger.warning(f"The {track_format} Track Store requires pyarrow, tracks are stored in CSV")
+            _warned_for_missing_pyarrow = True
+        return 'CSV'
+    return track_format
+
+
+def find_tracks(directory: str) -> tuple:
+    """
+    Find the tracks in an Experiment or Project directory
+
+    :return: The format and path of the store, the selected format first, or (None, None) if there are no tracks
+    """
+
+    track_format, path = find_in_track_formats(directory, TRACK_STORE_NAMES)
+    if track_format not in (None, 'CSV'):
+        csv_path = os.path.join(directory, TRACKS_CSV_FILE_NAME)
+        if os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(path):
+            return 'CSV', csv_path
+    return track_format, path
+
+
+def find_in_track_formats(directory: str, names: dict) -> tuple:
+    selected_format = get_track_store_format()
+    track_formats = [selected_format] + [track_format for track_format in names if track_format != selected_format]
+    for track_format in track_formats:
+        if track_format != 'CSV' and not pyarrow_available:
+            continue
+        path = os.path.join(directory, names[track_format])
+        if os.path.exists(path):
+            return track_format, path
+    return None, None
+
+
+def tracks_exist(directory: str) -> bool:
+    return find_tracks(directory)[0] is not None
+
+
+def get_tracks_size(directory: str) -> tuple:
+    """
+    :return: The format of the tracks in the directory and their size on disk in bytes
+    """
+
+    track_format, path = find_tracks(directory)
+    if track_format is None:
+        return None, 0
+    if track_format == 'CSV':
+        return track_format, os.path.getsize(path)
+    return track_format, sum(os.path.getsize(file_path) for _, file_path in list_track_files(path, track_format))
+
+
+def list_track_files(path: str, track_format: str) -> list:
+    """
+    :return: The (recording_name, file_path) of the files of a columnar store, in the order of the Recordings
+    """
+
+    extension = TRACK_FILE_EXTENSIONS[track_format]
+    track_files = []
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith(extension) and '-' in file_name:
+            recording_name = unquote(file_name[:-len(extension)].split('-', 1)[1])
+            track_files.append((recording_name, os.path.join(path, file_name)))
+    return track_files
+
+
+def read_tracks(
+        directory: str,
+        columns: list = None,
+        recording_names: list = None,
+        with_track_squares: bool = True) -> pd.DataFrame:
+    """
+    Read the tracks of an Experiment or Project
+
+    :param columns: The columns to read, all if None. The columns are returned in the order of the store.
+    :param recording_names: The Recordings (Ext Recording Names) to read the tracks of, all if None
+    :param with_track_squares: Add the Square Nr and Label Nr from the Track Squares file, if there is one
+    :return: The tracks, with the column types of the schema, or None if there are no tracks in the directory
+    """
+
+    track_format, path = find_tracks(directory)
+    if track_format is None:
+        return None
+
+    df_track_squares = read_track_squares(directory, recording_names) if with_track_squares else None
+    if df_track_squares is None:
+        return read_track_store(track_format, path, columns, recording_names)
+
+    # The square columns come from the Track Squares file, the key columns are needed to join them
+    read_columns = columns
+    if columns is not None:
+        read_columns = ([column for column in columns if column not in TRACK_SQUARE_COLUMNS] +
+                        [column for column in TRACK_KEY_COLUMNS if column not in columns])
+    df_tracks = join_track_squares(
+        read_track_store(track_format, path, read_columns, recording_names), df_track_squares)
+    if columns is not None:
+        df_tracks = df_tracks[[column for column in df_tracks.columns if column in columns]]
+    return df_tracks
+
+
+def read_track_store(track_format: str, path: str, columns: list = None, recording_names: list = None) -> pd.DataFrame:
+    if track_format == 'CSV':
+        if os.path.getsize(path) == 0:
+            return pd.DataFrame()
+        if recording_names is None:
+            return read_csv_with_schema(path, TRACKS_SCHEMA, usecols=columns)
+        read_columns = None if columns is None else list(set(columns) | {'Ext Recording Name'})
+        df_tracks = read_csv_with_schema(path, TRACKS_SCHEMA, usecols=read_columns)
+        df_tracks = df_tracks[df_tracks['Ext Recording Name'].isin(recording_names)].reset_index(drop=True)
+        if columns is not None:
+            df_tracks = df_tracks[[column for column in df_tracks.columns if column in columns]]
+        return df_tracks
+
+    all_track_files = list_track_files(path, track_format)
+    if not all_track_files:
+        return pd.DataFrame(columns=columns)
+    track_files = all_track_files
+    if recording_names is not None:
+        recording_names = set(recording_names)
+        track_files = [track_file for track_file in all_track_files if track_file[0] in recording_names]
+    if not track_files:
+        # None of the Recordings has tracks, the first file still provides the columns
+        return apply_schema(
+            read_track_file(all_track_files[0][1], track_format, columns).slice(0, 0).to_pandas(), TRACKS_SCHEMA)
+    tables = [read_track_file(file_path, track_format, columns) for _, file_path in track_files]
+    return apply_schema(pyarrow.concat_tables(tables, promote_options='permissive').to_pandas(), TRACKS_SCHEMA)
+
+
+def read_track_file(file_path: str, track_format: str, columns: list = None):
+    if columns is not None:
+        schema_names = get_track_file_columns(file_path, track_format)
+        columns = [column for column in schema_names if column in columns]
+    if track_format == 'Parquet':
+        return pyarrow.parquet.read_table(file_path, columns=columns)
+    return pyarrow.feather.read_table(file_path, columns=columns)
+
+
+def get_track_file_columns(file_path: str, track_format: str) -> list:
+    if track_format == 'Parquet':
+        return pyarrow.parquet.read_schema(file_path).names
+    with pyarrow.ipc.open_file(file_path) as reader:
+        return reader.schema.names
+
+
+def read_track_columns(directory: str) -> list:
+    """
+    :return: The names of the columns of the tracks, without reading the tracks, or None if there are no tracks
+    """
+
+    track_format, path = find_tracks(directory)
+    if track_format is None:
+        return None
+    if track_format == 'CSV':
+        return list(pd.read_csv(path, nrows=0).columns)
+    track_files = list_track_files(path, track_format)
+    return get_track_file_columns(track_files[0][1], track_format) if track_files else []
+
+
+def write_tracks(df_tracks: pd.DataFrame, directory: str, track_format: str = None) -> None:
+    """
+    Write the tracks of an Experiment or Project in the selected format, replacing the tracks in other formats (see
+    remove_other_track_stores)
+    """
+
+    track_format = track_format or get_track_store_format()
+    if track_format == 'CSV':
+        df_tracks.to_csv(os.path.join(directory, TRACKS_CSV_FILE_NAME), index=False)
+    else:
+        parts_directory = tempfile.mkdtemp(prefix='.All Tracks ', dir=directory)
+        try:
+            if len(df_tracks) == 0 or 'Ext Recording Name' not in df_tracks.columns:
+                write_track_file(df_tracks, os.path.join(parts_directory, make_track_file_name(0, '', track_format)),
+                                 track_format)
+            else:
+                for seq_nr, (recording_name, df_tracks_of_recording) in enumerate(
+                        df_tracks.groupby('Ext Recording Name', sort=False, dropna=False, observed=True)):
+                    write_track_file(
+                        df_tracks_of_recording,
+                        os.path.join(parts_directory, make_track_file_name(seq_nr, recording_name, track_format)),
+                        track_format)
+            replace_track_store(parts_directory, directory, track_format)
+        finally:
+            shutil.rmtree(parts_directory, ignore_errors=True)
+    remove_other_track_stores(directory, track_format)
+
+
+def make_track_file_name(seq_nr: int, recording_name: str, track_format: str) -> str:
+    return f"{seq_nr:05d}-{quote(str(recording_name), safe='')}{TRACK_FILE_EXTENSIONS[track_format]}"
+
+
+def write_track_file(df_tracks: pd.DataFrame, file_path: str, track_format: str) -> None:
+    # The columns are stored with the types of the schema, the Recording name as a dictionary
+    table = pyarrow.Table.from_pandas(apply_schema(df_tracks.copy(deep=False), TRACKS_SCHEMA), preserve_index=False)
+
+    # Columns without any value are stored as numbers, which is what reading them from a CSV file gives
+    for i, field in enumerate(table.schema):
+        if pyarrow.types.is_null(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pyarrow.float64()))
+    if track_format == 'Parquet':
+        pyarrow.parquet.write_table(table, file_path)
+    else:
+        pyarrow.feather.write_feather(table, file_path)
+
+
+def replace_track_store(new_store_path: str, directory: str, track_format: str) -> None:
+    """
+    Make the directory new_store_path, which must be in the same directory, the columnar store of the directory,
+    replacing the previous store in one step
+    """
+
+    store_path = os.path.join(directory, TRACK_STORE_NAMES[track_format])
+    old_store_path = None
+    if os.path.exists(store_path):
+        old_store_path = tempfile.mkdtemp(prefix='.All Tracks ', dir=directory)
+        os.rmdir(old_store_path)
+        os.replace(store_path, old_store_path)
+    os.replace(new_store_path, store_path)
+    if old_store_path is not None:
+        shutil.rmtree(old_store_path, ignore_errors=True)
+
+
+def remove_other_track_stores(directory: str, track_format: str) -> None:
+    """
+    Remove the tracks in the formats other than track_format. All Tracks.csv is only removed when 'Remove CSV After
+    Conversion' is set in Paint.json.
+    """
+
+    remove_csv = get_paint_attribute_with_default('Paint', 'Remove CSV After Conversion', False)
+    for other_format, store_name in TRACK_STORE_NAMES.items():
+        store_path = os.path.join(directory, store_name)
+        if other_format == track_format or not os.path.exists(store_path):
+            continue
+        if other_format == 'CSV' and not remove_csv:
+            continue
+        paint_logger.info(f"Removed {store_path}, the tracks are now stored in {TRACK_STORE_NAMES[track_format]}")
+        if os.path.isdir(store_path):
+            shutil.rmtree(store_path)
+        else:
+            os.remove(store_path)
+
+
+def convert_tracks(directory: str) -> None:
+    """
+    Store the tracks of an Experiment in the selected format, when they are stored in another format (Run TrackMate
+    writes All Tracks.csv). The Track Squares file is converted with them.
+    """
+
+    track_format, _ = find_tracks(directory)
+    selected_format = get_track_store_format()
+    if track_format is None or track_format == selected_format:
+        return
+
+    track_scan = scan_tracks(directory)
+    if track_scan is None:
+        return
+    paint_logger.info(f"Converting the {track_format} tracks in {directory} to {selected_format}")
+    if not track_scan['Contiguous']:
+        write_tracks(read_tracks(directory, with_track_squares=False), directory, selected_format)
+    else:
+        track_writer = TrackWriter(directory, selected_format)
+        try:
+            for seq_nr, (recording_name, df_tracks_of_recording) in enumerate(
+                    read_tracks_by_recording(directory, track_scan, with_track_squares=False)):
+                track_writer.add(seq_nr, recording_name, df_tracks_of_recording)
+            track_writer.commit(list(track_writer.parts))
+        finally:
+            track_writer.discard()
+
+    squares_format, _ = find_track_squares(directory)
+    if squares_format not in (None, selected_format):
+        write_track_squares(read_track_squares(directory), directory, selected_format)
+
+
+# ----------------------------------------------------------------------------------------------------
+# The Track Squares file: the Square Nr and Label Nr of every track, for the tracks of the Recordings that
+# Generate Squares processed. It is written in the format of the tracks, as a single file, and replaced as a
+# whole, which takes a fraction of the time of writing the tracks.
+# ----------------------------------------------------------------------------------------------------
+
+def find_track_squares(directory: str) -> tuple:
+    """
+    :return: The format and path of the Track Squares file, or (None, None) if there is none
+    """
+
+    return find_in_track_formats(directory, TRACK_SQUARES_NAMES)
+
+
+def track_squares_exist(directory: str) -> bool:
+    return find_track_squares(directory)[0] is not None
+
+
+def read_track_squares(directory: str, recording_names: list = None) -> pd.DataFrame:
+    """
+    Read the Square Nr and Label Nr of the tracks of an Experiment or Project
+
+    :return: The Ext Recording Name, Track Id, Square Nr and Label Nr of the tracks, or None if there is no Track
+             Squares file
+    """
+
+    squares_format, path = find_track_squares(directory)
+    if squares_format is None:
+        return None
+    if squares_format == 'CSV':
+        df_track_squares = read_csv_with_schema(path, TRACK_SQUARES_SCHEMA)
+    elif squares_format == 'Parquet':
+        df_track_squares = apply_schema(pyarrow.parquet.read_table(path).to_pandas(), TRACK_SQUARES_SCHEMA)
+    else:
+        df_track_squares = apply_schema(pyarrow.feather.read_table(path).to_pandas(), TRACK_SQUARES_SCHEMA)
+    if recording_names is not None:
+        df_track_squares = df_track_squares[
+            df_track_squares['Ext Recording Name'].isin(recording_names)].reset_index(drop=True)
+    return df_track_squares
+
+
+def write_track_squares(df_tracks: pd.DataFrame, directory: str, track_format: str = None) -> None:
+    """
+    Write the Square Nr and Label Nr of the tracks to the Track Squares file, replacing the one in other formats.
+    Only the key and square columns of df_tracks are written.
+    """
+
+    track_format = track_format or get_track_store_format()
+    df_track_squares = apply_schema(df_tracks[TRACK_SQUARES_COLUMNS].reset_index(drop=True), TRACK_SQUARES_SCHEMA)
+
+    # Written to a temporary file first, so that a reader never sees a partly written file
+    file_descriptor, new_file_path = tempfile.mkstemp(prefix='.Track Squares ', dir=directory)
+    os.close(file_descriptor)
+    try:
+        if track_format == 'CSV':
+            df_track_squares.to_csv(new_file_path, index=False)
+        else:
+            table = pyarrow.Table.from_pandas(df_track_squares, preserve_index=False)
+            if track_format == 'Parquet':
+                pyarrow.parquet.write_table(table, new_file_path)
+            else:
+                pyarrow.feather.write_feather(table, new_file_path)
+        set_mode_of_replacement_file(new_file_path, os.path.join(directory, TRACK_SQUARES_NAMES[track_format]))
+        os.replace(new_file_path, os.path.join(directory, TRACK_SQUARES_NAMES[track_format]))
+    finally:
+        if os.path.exists(new_file_path):
+            os.remove(new_file_path)
+    remove_track_squares(directory, keep_format=track_format)
+
+
+def remove_track_squares(directory: str, keep_format: str = None) -> None:
+    for squares_format, file_name in TRACK_SQUARES_NAMES.items():
+        file_path = os.path.join(directory, file_name)
+        if squares_format != keep_format and os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def join_track_squares(df_tracks: pd.DataFrame, df_track_squares: pd.DataFrame) -> pd.DataFrame:
+    """
+    Set the Square Nr and Label Nr columns of the tracks from the Track Squares, matching on Ext Recording Name and
+    Track Id. Tracks that are not in the Track Squares (of Recordings that were not processed) get neither.
+    """
+
+    if not set(TRACK_KEY_COLUMNS).issubset(df_tracks.columns):
+        return df_tracks
+
+    square_keys = pd.MultiIndex.from_arrays([
+        df_track_squares['Ext Recording Name'].astype(str).to_numpy(),
+        df_track_squares['Track Id'].to_numpy(np.int64)])
+    if not square_keys.is_unique:
+        keep = ~square_keys.duplicated(keep='last')
+        df_track_squares = df_track_squares[keep]
+        square_keys = square_keys[keep]
+    positions = square_keys.get_indexer(pd.MultiIndex.from_arrays([
+        df_tracks['Ext Recording Name'].astype(str).to_numpy(),
+        df_tracks['Track Id'].to_numpy(np.int64)]))
+    for column in TRACK_SQUARE_COLUMNS:
+        df_tracks[column] = df_track_squares[column].array.take(positions, allow_fill=True)
+    return df_tracks
+
+
+def export_tracks_to_csv(directory: str, csv_file_path: str = None) -> str:
+    """
+    Write the tracks, with their Square Nr and Label Nr, to a CSV file (by default 'All Tracks.csv' in an 'Output'
+    directory), for programs that read the tracks themselves. The store itself is left as it is.
+
+    :return: The path of the CSV file, or None if there are no tracks
+    """
+
+    track_format, path = find_tracks(directory)
+    if track_format is None:
+        paint_logger.error(f"No tracks found in {directory}")
+        return None
+    if csv_file_path is None:
+        csv_file_path = os.path.join(directory, 'Output', TRACKS_CSV_FILE_NAME)
+    os.makedirs(os.path.dirname(os.path.abspath(csv_file_path)), exist_ok=True)
+    if track_format == 'CSV' and not track_squares_exist(directory):
+        shutil.copyfile(path, csv_file_path)
+        return csv_file_path
+
+    # One Recording at a time, so that a large store does not have to fit in memory
+    track_scan = scan_tracks(directory)
+    if track_scan is None:
+        paint_logger.error(f"The tracks in {directory} could not be read")
+        return None
+    if not track_scan['Contiguous']:
+        read_tracks(directory).to_csv(csv_file_path, index=False)
+        return csv_file_path
+    with open(csv_file_path, 'w', newline='') as csv_file:
+        header = True
+        for _, df_tracks_of_recording in read_tracks_by_recording(directory, track_scan):
+            df_tracks_of_recording.to_csv(csv_file, index=False, header=header)
+            header = False
+        if header:
+            make_empty_tracks(track_scan).to_csv(csv_file, index=False)
+    return csv_file_path
+
+
+def concat_tracks(output_directory: str, input_directories: list) -> None:
+    """
+    Combine the tracks of several Experiments, with their Track Squares, into the tracks of the Project in
+    output_directory
+    """
+
+    track_format = get_track_store_format()
+    input_stores = [find_tracks(directory) for directory in input_directories]
+    input_columns = [read_track_columns(directory) for directory in input_directories]
+
+    if (all(input_format == track_format for input_format, _ in input_stores) and
+            all(columns == input_columns[0] for columns in input_columns)):
+        if track_format == 'CSV':
+            from src.Application.Support.General_Support_Functions import concat_csv_files
+            concat_csv_files(os.path.join(output_directory, TRACKS_CSV_FILE_NAME),
+                             [path for _, path in input_stores])
+        else:
+            # The files of the Recordings are copied, renumbered to keep the order of the Experiments
+            parts_directory = tempfile.mkdtemp(prefix='.All Tracks ', dir=output_directory)
+            try:
+                seq_nr = 0
+                for _, path in input_stores:
+                    for recording_name, file_path in list_track_files(path, track_format):
+                        shutil.copyfile(file_path, os.path.join(
+                            parts_directory, make_track_file_name(seq_nr, recording_name, track_format)))
+                        seq_nr += 1
+                replace_track_store(parts_directory, output_directory, track_format)
+            finally:
+                shutil.rmtree(parts_directory, ignore_errors=True)
+        remove_other_track_stores(output_directory, track_format)
+    else:
+        # Experiments with tracks in different formats, or with the square columns in the tracks when they were
+        # processed before there were Track Squares files, are read and written in the format of the Project
+        df_tracks = pd.concat([read_tracks(directory, with_track_squares=False).drop(
+            columns=['Unique Key'] + TRACK_SQUARE_COLUMNS, errors='ignore') for directory in input_directories],
+            ignore_index=True)
+        write_tracks(df_tracks, output_directory, track_format)
+
+    # Experiments processed before there were Track Squares files have the square columns in their tracks
+    track_squares = []
+    for directory, columns in zip(input_directories, input_columns):
+        df_track_squares = read_track_squares(directory)
+        if df_track_squares is None and set(TRACK_SQUARES_COLUMNS).issubset(columns or []):
+            df_track_squares = read_tracks(directory, columns=TRACK_SQUARES_COLUMNS)
+        if df_track_squares is not None:
+            track_squares.append(df_track_squares)
+    if track_squares:
+        write_track_squares(pd.concat(track_squares, ignore_index=True), output_directory, track_format)
+    else:
+        remove_track_squares(output_directory)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Reading and writing the tracks one Recording at a time, for Experiments that do not fit in memory.
+# The store is first scanned to find the column types that reading all tracks at once gives and the order of
+# the Recordings, then the tracks are handed out per Recording with those column types. For a CSV file, this
+# requires that the tracks of a Recording are stored together, which is how Paint writes the file.
+# ----------------------------------------------------------------------------------------------------
+
+def scan_tracks(directory: str, chunk_size: int = TRACKS_CHUNK_SIZE) -> dict:
+    """
+    Scan the tracks of an Experiment, one chunk or Recording at a time
+
+    :return: None if there are no tracks or they can not be read, otherwise a dictionary with the 'Format', the
+             'Path', the 'Columns', the 'Dtypes' that reading all tracks at once gives, the 'Recording Names' in the
+             order of the store and whether the tracks of each Recording are 'Contiguous'
+    """
+
+    track_format, path = find_tracks(directory)
+    if track_format is None or (track_format == 'CSV' and os.path.getsize(path) == 0):
+        return None
+
+    columns = None
+    dtypes = {}
+    recording_names = []
+    contiguous = True
+
+    def add_chunk(df_chunk):
+        nonlocal columns, dtypes, contiguous
+        if columns is None:
+            columns = list(df_chunk.columns)
+            dtypes = dict(df_chunk.dtypes)
+        else:
+            dtypes = {column: common_column_dtype(dtypes[column], df_chunk[column].dtype) for column in columns}
+
+        # Record the runs of Recording names; a name that comes back after another name is not contiguous
+        names = df_chunk['Ext Recording Name'].to_numpy()
+        run_starts = np.flatnonzero(np.concatenate(([True], names[1:] != names[:-1])))
+        for name in names[run_starts]:
+            if recording_names and recording_names[-1] == name:
+                continue
+            if name in recording_names:
+                contiguous = False
+            else:
+                recording_names.append(name)
+
+    try:
+        if track_format == 'CSV':
+            for df_chunk in pd.read_csv(path, chunksize=chunk_size):
+                add_chunk(df_chunk)
+        else:
+            for _, file_path in list_track_files(path, track_format):
+                add_chunk(read_track_file(file_path, track_format).to_pandas())
+    except Exception as e:
+        paint_logger.error(f"Error scanning the tracks in {directory}: {str(e)}")
+        return None
+
+    if columns is None:
+        return None
+    return {'Format': track_format, 'Path': path, 'Columns': columns, 'Dtypes': dtypes,
+            'Recording Names': recording_names, 'Contiguous': contiguous}
+
+
+def read_tracks_by_recording(
+        directory: str,
+        track_scan: dict,
+        with_track_squares: bool = True,
+        chunk_size: int = TRACKS_CHUNK_SIZE):
+    """
+    Read the tracks of an Experiment and yield (recording_name, df_tracks_of_recording) in the order of the store.
+    The tracks have the column types of reading all tracks at once, so that results are the same as when the
+    Experiment is processed at once. With with_track_squares, the Square Nr and Label Nr from the Track Squares file
+    are added, as read_tracks does.
+    """
+
+    df_track_squares = read_track_squares(directory) if with_track_squares else None
+    if df_track_squares is None:
+        yield from read_store_by_recording(track_scan, chunk_size)
+        return
+
+    positions_of_recording = df_track_squares.groupby('Ext Recording Name', sort=False, observed=True).indices
+    no_positions = np.array([], dtype=np.int64)
+    for recording_name, df_tracks_of_recording in read_store_by_recording(track_scan, chunk_size):
+        df_track_squares_of_recording = df_track_squares.iloc[positions_of_recording.get(recording_name, no_positions)]
+        yield recording_name, join_track_squares(df_tracks_of_recording, df_track_squares_of_recording)
+
+
+def read_store_by_recording(track_scan: dict, chunk_size: int = TRACKS_CHUNK_SIZE):
+    track_format, path = track_scan['Format'], track_scan['Path']
+
+    if track_format != 'CSV':
+        dtypes = track_scan['Dtypes']
+        for recording_name, file_path in list_track_files(path, track_format):
+            df_tracks_of_recording = read_track_file(file_path, track_format).to_pandas()
+            if len(df_tracks_of_recording) > 0:
+                yield recording_name, df_tracks_of_recording.astype(dtypes)
+        return
+
+    # Columns that reading all at once makes object are read as text, the others with the type found in the scan
+    dtypes = {column: (str if dtype == np.dtype(object) else dtype) for column, dtype in track_scan['Dtypes'].items()}
+
+    pending_name = None
+    pending_blocks = []
+    for df_chunk in pd.read_csv(path, chunksize=chunk_size, dtype=dtypes):
+        names = df_chunk['Ext Recording Name'].to_numpy()
+        boundaries = np.flatnonzero(names[1:] != names[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(names)]))
+        for start, end in zip(starts, ends):
+            name = names[start]
+            if name != pending_name and pending_blocks:
+                yield pending_name, pd.concat(pending_blocks, ignore_index=True)
+                pending_blocks = []
+            pending_name = name
+            pending_blocks.append(df_chunk.iloc[start:end])
+
+    if pending_blocks:
+        yield pending_name, pd.concat(pending_blocks, ignore_index=True)
+
+
+def make_empty_tracks(track_scan: dict) -> pd.DataFrame:
+    """
+    An empty tracks DataFrame with the columns and column types of the scanned tracks
+    """
+
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in track_scan['Dtypes'].items()})
+
+
+class TrackWriter:
+    """
+    Collects the tracks of an Experiment one Recording at a time in a temporary directory and stores them all in
+    one step when commit is called, so that the tracks that are being read are not replaced before they have been read
+    """
+
+    def __init__(self, directory: str, track_format: str = None):
+        self.directory = directory
+        self.track_format = track_format or get_track_store_format()
+        self.parts_directory = tempfile.mkdtemp(prefix='.All Tracks ', dir=directory)
+        self.parts = {}
+
+    def add(self, key, recording_name: str, df_tracks_of_recording: pd.DataFrame) -> None:
+        part_path = os.path.join(self.parts_directory, f"part {len(self.parts)}")
+        if self.track_format == 'CSV':
+            df_tracks_of_recording.to_csv(part_path, index=False)
+        else:
+            write_track_file(df_tracks_of_recording, part_path, self.track_format)
+        self.parts[key] = (recording_name, part_path)
+
+    def commit(self, keys: list) -> None:
+        """
+        Store the tracks of the parts in the order of keys, replacing the tracks of the Experiment
+        """
+
+        if self.track_format == 'CSV':
+            new_tracks_file_path = os.path.join(self.parts_directory, TRACKS_CSV_FILE_NAME)
+            with open(new_tracks_file_path, 'wb') as new_tracks_file:
+                for part_nr, key in enumerate(keys):
+                    with open(self.parts[key][1], 'rb') as part_file:
+                        if part_nr > 0:
+                            part_file.readline()
+                        shutil.copyfileobj(part_file, new_tracks_file)
+            os.replace(new_tracks_file_path, os.path.join(self.directory, TRACKS_CSV_FILE_NAME))
+        else:
+            store_directory = tempfile.mkdtemp(prefix='.All Tracks ', dir=self.directory)
+            try:
+                for seq_nr, key in enumerate(keys):
+                    recording_name, part_path = self.parts[key]
+                    os.replace(part_path, os.path.join(
+                        store_directory, make_track_file_name(seq_nr, recording_name, self.track_format)))
+                replace_track_store(store_directory, self.directory, self.track_format)
+            finally:
+                shutil.rmtree(store_directory, ignore_errors=True)
+        remove_other_track_stores(self.directory, self.track_format)
+        self.discard()
+
+    def discard(self) -> None:
+        shutil.rmtree(self.parts_directory, ignore_errors=True)
@@ -0,0 +1,100 @@
+"""
+Benchmark of the typed schema for the All Tracks and All Squares files: memory use and read time of a read with
+inferred column types against a read with the column types of Paint_Schema.
+An Experiment or Project directory can be given on the command line, otherwise synthetic files are used.
+
+Run from the root of the repository:  python -m src.Benchmarks.Benchmark_Schema [<Experiment or Project directory>]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Support.Paint_Schema import (
+    SQUARES_SCHEMA,
+    TRACKS_SCHEMA,
+    read_csv_with_schema)
+
+NR_OF_RECORDINGS = 20
+NR_OF_TRACKS_PER_RECORDING = 20000
+NR_OF_SQUARES_IN_ROW = 20
+
+
+def make_tracks(rng: np.random.Generator) -> pd.DataFrame:
+    nr_of_tracks = NR_OF_RECORDINGS * NR_OF_TRACKS_PER_RECORDING
+    recording_names = np.repeat([f"230214-Exp-{i + 1}-1-threshold-5" for i in range(NR_OF_RECORDINGS)],
+                                NR_OF_TRACKS_PER_RECORDING)
+    track_ids = np.tile(np.arange(NR_OF_TRACKS_PER_RECORDING), NR_OF_RECORDINGS)
+    df_tracks = pd.DataFrame({
+        'Unique Key': [f"{name}-{track_id}" for name, track_id in zip(recording_names, track_ids)],
+        'Ext Recording Name': recording_names,
+        'Track Id': track_ids,
+        'Track Label': [f"Track_{track_id}" for track_id in track_ids],
+        'Nr Spots': rng.integers(3, 200, nr_of_tracks),
+        'Nr Gaps': rng.integers(0, 3, nr_of_tracks),
+        'Longest Gap': rng.integers(0, 3, nr_of_tracks)})
+    for column in ['Track Duration', 'Track X Location', 'Track Y Location', 'Track Displacement',
+                   'Track Total Distance', 'Track Max Speed', 'Track Median Speed', 'Track Mean Speed',
+                   'Diffusion Coefficient', 'Diffusion Coefficient Ext']:
+        df_tracks[column] = rng.uniform(0, 80, nr_of_tracks)
+    return df_tracks
+
+
+def make_squares(rng: np.random.Generator) -> pd.DataFrame:
+    nr_of_squares = NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW
+    df_squares = pd.DataFrame({column: rng.uniform(0, 100, nr_of_squares * NR_OF_RECORDINGS)
+                               for column, dtype in SQUARES_SCHEMA.items() if dtype == 'float64'})
+    df_squares['Ext Recording Name'] = np.repeat(
+        [f"230214-Exp-{i + 1}-1-threshold-5" for i in range(NR_OF_RECORDINGS)], nr_of_squares)
+    df_squares['Experiment Date'] = '230214'
+    df_squares['Probe'] = '1 Mono'
+    df_squares['Probe Type'] = 'Simple'
+    df_squares['Cell Type'] = 'BMDC'
+    df_squares['Adjuvant'] = 'LPS'
+    df_squares['Square Nr'] = np.tile(np.arange(nr_of_squares), NR_OF_RECORDINGS)
+    df_squares['Nr Tracks'] = rng.integers(0, 100, len(df_squares))
+    df_squares['Selected'] = rng.random(len(df_squares)) < 0.5
+    return df_squares
+
+
+def compare_reads(file_path: str, schema: dict):
+    start_time = time.perf_counter()
+    df_inferred = pd.read_csv(file_path)
+    inferred_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    df_schema = read_csv_with_schema(file_path, schema)
+    schema_time = time.perf_counter() - start_time
+
+    inferred_memory = df_inferred.memory_usage(deep=True).sum() / (1024 * 1024)
+    schema_memory = df_schema.memory_usage(deep=True).sum() / (1024 * 1024)
+    print(f"{os.path.basename(file_path)}: {len(df_inferred)} rows")
+    print(f"    Inferred: {inferred_memory:8.1f} MB, read in {inferred_time:6.2f} s")
+    print(f"    Schema:   {schema_memory:8.1f} MB, read in {schema_time:6.2f} s, "
+          f"memory reduced {inferred_memory / schema_memory:4.1f} x")
+
+
+def main():
+    if len(sys.argv) > 1:
+        directory = sys.argv[1]
+        for file_name, schema in [('All Tracks.csv', TRACKS_SCHEMA), ('All Squares.csv', SQUARES_SCHEMA)]:
+            if os.path.isfile(os.path.join(directory, file_name)):
+                compare_reads(os.path.join(directory, file_name), schema)
+        return
+
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as directory:
+        tracks_file_path = os.path.join(directory, 'All Tracks.csv')
+        squares_file_path = os.path.join(directory, 'All Squares.csv')
+        make_tracks(rng).to_csv(tracks_file_path, index=False)
+        make_squares(rng).to_csv(squares_file_path, index=False)
+        compare_reads(tracks_file_path, TRACKS_SCHEMA)
+        compare_reads(squares_file_path, SQUARES_SCHEMA)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark of collecting the squares of an Experiment: the original accumulation with pd.concat against the SquareTable.
+
+Two levels are measured:
+- Experiment: the squares of every Recording are added to the squares of the Experiment
+  (pd.concat onto a growing DataFrame against SquareTable.add_rows)
+- Recording: the data of every square is added to the squares of the Recording
+  (pd.concat of one-row DataFrames against SquareTable.add_record)
+
+Time is measured with perf_counter, memory with tracemalloc (numpy and pandas report their allocations to it).
+Run from the root of the repository:  python -m src.Benchmarks.Benchmark_Square_Table
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Generate_Squares.Square_Table import SquareTable
+
+NR_OF_RECORDINGS = 100
+NR_OF_SQUARES_IN_ROW = 30
+NR_OF_RECORDINGS_PER_SQUARE = 2  # The one-row concat is slow, so fewer Recordings are used at the square level
+
+
+def make_square_records(recording_nr: int, nr_of_squares_in_row: int, rng: np.random.Generator) -> list:
+    """
+    Make square data with the columns and value types that process_square produces
+    """
+
+    nr_total_squares = nr_of_squares_in_row * nr_of_squares_in_row
+    width = 82.0864 / nr_of_squares_in_row
+    records = []
+    for square_seq_nr in range(nr_total_squares):
+        row_nr, col_nr = divmod(square_seq_nr, nr_of_squares_in_row)
+        nr_tracks = int(rng.integers(0, 60))
+        records.append({
+            'Recording Sequence Nr': recording_nr,
+            'Ext Recording Name': f'240104-Exp-{recording_nr}-A1-1-threshold-5',
+            'Experiment Name': '240104',
+            'Experiment Date': '240104',
+            'Condition Nr': 1,
+            'Replicate Nr': recording_nr,
+            'Square Nr': square_seq_nr,
+            'Probe': '6 Mono',
+            'Probe Type': 'Simple',
+            'Cell Type': 'BMDC',
+            'Adjuvant': 'No',
+            'Concentration': 10,
+            'Threshold': 5,
+            'Row Nr': row_nr + 1,
+            'Col Nr': col_nr + 1,
+            'Label Nr': 0,
+            'Cell Id': 0,
+            'Nr Spots': 340441,
+            'Nr Tracks': nr_tracks,
+            'X0': round(col_nr * width, 2),
+            'Y0': round(row_nr * width, 2),
+            'X1': round((col_nr + 1) * width, 2),
+            'Y1': round((row_nr + 1) * width, 2),
+            'Selected': True,
+            'Variability': round(float(rng.uniform(0, 10)), 2),
+            'Density': round(float(rng.uniform(0, 1)), 5),
+            'Density Ratio': 0.0,
+            'Tau': round(float(rng.uniform(50, 500)), 0) if nr_tracks >= 20 else -1,
+            'R Squared': round(float(rng.uniform(0.8, 1)), 2) if nr_tracks >= 20 else 0,
+            'Median Diffusion Coefficient': round(float(rng.uniform(0, 0.2)), 4),
+            'Mean Diffusion Coefficient': round(float(rng.uniform(0, 0.2)), 4),
+            'Median Diffusion Coefficient Ext': round(float(rng.uniform(0, 0.2)), 4),
+            'Mean Diffusion Coefficient Ext': round(float(rng.uniform(0, 0.2)), 4),
+            'Median Long Track Duration': round(float(rng.uniform(0, 5)), 3),
+            'Median Short Track Duration': round(float(rng.uniform(0, 1)), 3),
+            'Median Displacement': round(float(rng.uniform(0, 1)), 3),
+            'Max Displacement': round(float(rng.uniform(0, 2)), 3),
+            'Total Displacement': round(float(rng.uniform(0, 20)), 3),
+            'Median Max Speed': round(float(rng.uniform(0, 3)), 3),
+            'Max Max Speed': round(float(rng.uniform(0, 6)), 3),
+            'Median Mean Speed': round(float(rng.uniform(0, 2)), 3),
+            'Max Mean Speed': round(float(rng.uniform(0, 4)), 3),
+            'Max Track Duration': round(float(rng.uniform(0, 10)), 3),
+            'Total Track Duration': round(float(rng.uniform(0, 50)), 3),
+            'Median Track Duration': round(float(rng.uniform(0, 1)), 3),
+            'Square Manually Excluded': False,
+            'Image Excluded': False})
+    return records
+
+
+def measure(function, *args) -> tuple:
+    """
+    Run the function and return its result, the run time in seconds and the peak memory allocated in MB
+    """
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_time = time.perf_counter()
+    result = function(*args)
+    run_time = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, run_time, peak / 1024 ** 2
+
+
+def concat_recordings(squares_of_recordings: list) -> pd.DataFrame:
+    df_squares_of_experiment = pd.DataFrame()
+    for df_squares_of_recording in squares_of_recordings:
+        df_squares_of_experiment = pd.concat([df_squares_of_experiment, df_squares_of_recording], ignore_index=True)
+    return df_squares_of_experiment
+
+
+def table_recordings(squares_of_recordings: list) -> pd.DataFrame:
+    squares_of_experiment = SquareTable(sum(len(df_squares) for df_squares in squares_of_recordings))
+    for df_squares_of_recording in squares_of_recordings:
+        squares_of_experiment.add_rows(df_squares_of_recording)
+    return squares_of_experiment.to_dataframe()
+
+
+def concat_squares(square_records_of_recordings: list) -> list:
+    squares_of_recordings = []
+    for square_records in square_records_of_recordings:
+        df_squares_of_recording = pd.DataFrame()
+        for square_data in square_records:
+            df_squares_of_recording = pd.concat([df_squares_of_recording, pd.DataFrame.from_records([square_data])])
+        squares_of_recordings.append(df_squares_of_recording)
+    return squares_of_recordings
+
+
+def table_squares(square_records_of_recordings: list) -> list:
+    squares_of_recordings = []
+    for square_records in square_records_of_recordings:
+        squares_of_recording = SquareTable(len(square_records))
+        for square_data in square_records:
+            squares_of_recording.add_record(square_data)
+        squares_of_recordings.append(squares_of_recording.to_dataframe())
+    return squares_of_recordings
+
+
+def report(level: str, concat_measurement: tuple, table_measurement: tuple) -> None:
+    _, concat_time, concat_peak = concat_measurement
+    _, table_time, table_peak = table_measurement
+    print(f"{level:12s} pd.concat  : {concat_time:8.3f} s  peak {concat_peak:8.1f} MB")
+    print(f"{level:12s} SquareTable: {table_time:8.3f} s  peak {table_peak:8.1f} MB")
+    print(f"{level:12s} speed up {concat_time / table_time:6.1f} x, peak memory {table_peak / concat_peak:6.2f} x")
+
+
+def main():
+    rng = np.random.default_rng(1)
+    square_records_of_recordings = [make_square_records(recording_nr, NR_OF_SQUARES_IN_ROW, rng)
+                                    for recording_nr in range(1, NR_OF_RECORDINGS + 1)]
+    squares_of_recordings = [pd.DataFrame.from_records(square_records)
+                             for square_records in square_records_of_recordings]
+
+    print(f"{NR_OF_RECORDINGS} recordings x {NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW} squares")
+
+    concat_measurement = measure(concat_recordings, squares_of_recordings)
+    table_measurement = measure(table_recordings, squares_of_recordings)
+    pd.testing.assert_frame_equal(concat_measurement[0], table_measurement[0])
+    report('Experiment', concat_measurement, table_measurement)
+
+    square_records_of_recordings = square_records_of_recordings[:NR_OF_RECORDINGS_PER_SQUARE]
+    concat_measurement = measure(concat_squares, square_records_of_recordings)
+    table_measurement = measure(table_squares, square_records_of_recordings)
+    for df_concat, df_table in zip(concat_measurement[0], table_measurement[0]):
+        pd.testing.assert_frame_equal(df_concat.reset_index(drop=True), df_table)
+    report(f'Recording x{NR_OF_RECORDINGS_PER_SQUARE}', concat_measurement, table_measurement)
+
+
+if __name__ == '__main__':
+    main()
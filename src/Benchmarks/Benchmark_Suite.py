@@ -0,0 +1,338 @@
+"""
+Micro-benchmarks of the square engine on synthetic recordings (see Synthetic_Project): the per square path
+(process_square), the vectorised engine (generate_squares_of_recording), calc_variability, calculate_tau, the median
+long and short track durations per square and for all squares at once, the duration histograms of the squares and
+the Recording Tau and Density from them, the bootstrap confidence intervals of the Tau of the squares,
+select_squares_with_parameters, label_selected_squares_and_tracks and create_unique_key_for_squares.
+
+Every benchmark is run for each of the track counts, a number of times, and the minimum, median and mean run times are
+written to a JSON file together with the commit and the versions of Python, NumPy and pandas. With --compare, the
+results are compared to an earlier results file, so that changes in speed between commits show up.
+
+Run from the root of the repository:
+    python -m src.Benchmarks.Benchmark_Suite [--tracks 1000 10000 100000] [--repeats 5] [--output <file>]
+                                             [--compare <earlier results file>] [--only <benchmark> ...]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Generate_Squares.Fit_Cache import get_fit_cache
+from src.Application.Generate_Squares.Duration_Histograms import DurationHistograms
+from src.Application.Generate_Squares.Generate_Squares import (
+    process_square,
+    calculate_tau_and_density_for_recording)
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
+    calc_area_of_square,
+    calc_variability,
+    calculate_median_long_and_short_tracks_of_squares,
+    calculate_median_long_track,
+    calculate_median_short_track,
+    calculate_tau,
+    calculate_taus_from_histograms,
+    calculate_tau_confidence_intervals,
+    create_unique_key_for_squares,
+    get_row_and_column,
+    pack_select_parameters)
+from src.Application.Generate_Squares.Square_Engine import (
+    assign_square_nrs,
+    generate_squares_of_recording)
+from src.Application.Recording_Viewer.Select_Squares import (
+    select_squares_with_parameters,
+    label_selected_squares_and_tracks)
+from src.Benchmarks.Synthetic_Project import (
+    make_experiment_info,
+    make_tracks_of_recording)
+
+TRACK_COUNTS = [1000, 10000, 100000]
+NR_OF_SQUARES_IN_ROW = 20
+NR_OF_REPEATS = 5
+MIN_TRACKS_FOR_TAU = 20
+MIN_REQUIRED_R_SQUARED = 0.1
+GRANULARITY = 10
+BACKGROUND_FRACTION = 0.1
+TAU = 0.3
+NR_OF_BOOTSTRAP_REPLICATES = 200
+SELECT_PARAMETERS = pack_select_parameters(
+    min_required_density_ratio=2,
+    max_allowable_variability=10,
+    min_track_duration=0,
+    max_track_duration=100000,
+    min_required_r_squared=MIN_REQUIRED_R_SQUARED,
+    neighbour_mode='Strict')
+DEFAULT_OUTPUT_FILE = 'Benchmark Results.json'
+
+
+# ----------------------------------------------------------------------------------------------------
+# The data of a benchmark: one synthetic recording with its tracks, its squares and the tracks of each square
+# ----------------------------------------------------------------------------------------------------
+
+def make_recording(nr_of_tracks: int, seed: int = 1) -> dict:
+    rng = np.random.default_rng(seed)
+    recording_data = make_experiment_info('240101', 1, 1).iloc[0].copy()
+    recording_data['Ext Recording Name'] = f"{recording_data['Recording Name']}-threshold-5"
+    recording_data['Nr Spots'] = nr_of_tracks * 10
+
+    df_tracks = make_tracks_of_recording(recording_data['Ext Recording Name'], nr_of_tracks, TAU, rng)
+    df_tracks['Unique Key'] = np.arange(nr_of_tracks)
+    df_tracks.set_index('Unique Key', inplace=True, drop=False)
+    df_tracks['Square Nr'] = None
+    df_tracks['Label Nr'] = None
+
+    square_nrs = assign_square_nrs(df_tracks['Track X Location'], df_tracks['Track Y Location'], NR_OF_SQUARES_IN_ROW)
+    tracks_of_squares = {square_nr: df_tracks[square_nrs == square_nr]
+                         for square_nr in np.unique(square_nrs[square_nrs >= 0])}
+
+    # The squares as Generate Squares makes them before the selection
+    df_squares, df_tracks_with_squares = generate_squares_of_recording(
+        df_tracks.copy(), recording_data, NR_OF_SQUARES_IN_ROW, float(recording_data['Concentration']),
+        MIN_REQUIRED_R_SQUARED, MIN_TRACKS_FOR_TAU, calc_area_of_square(NR_OF_SQUARES_IN_ROW))
+    df_squares['Density Ratio'] = round(df_squares['Nr Tracks'] / max(df_squares['Nr Tracks'].median(), 1), 1)
+
+    return {
+        'Recording Data': recording_data,
+        'Tracks': df_tracks,
+        'Tracks of Squares': tracks_of_squares,
+        'Squares': df_squares,
+        'Tracks with Squares': df_tracks_with_squares}
+
+
+# ----------------------------------------------------------------------------------------------------
+# The benchmarks. Each gets the recording and returns a function that runs the benchmarked code once; what
+# has to be prepared for every run (copies of data that the code changes) is done outside the timing.
+# ----------------------------------------------------------------------------------------------------
+
+def benchmark_process_square(recording: dict):
+    df_tracks = recording['Tracks'].copy()
+    square_area = calc_area_of_square(NR_OF_SQUARES_IN_ROW)
+    concentration = float(recording['Recording Data']['Concentration'])
+
+    def run():
+        get_fit_cache().clear()
+        for square_seq_nr in range(NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW):
+            row_nr, col_nr = get_row_and_column(square_seq_nr, NR_OF_SQUARES_IN_ROW)
+            process_square(df_tracks, df_tracks, recording['Recording Data'], NR_OF_SQUARES_IN_ROW, concentration,
+                           MIN_REQUIRED_R_SQUARED, MIN_TRACKS_FOR_TAU, square_area, square_seq_nr, row_nr, col_nr)
+    return run
+
+
+def benchmark_generate_squares_of_recording(recording: dict):
+    df_tracks = recording['Tracks'].copy()
+    square_area = calc_area_of_square(NR_OF_SQUARES_IN_ROW)
+    concentration = float(recording['Recording Data']['Concentration'])
+
+    def run():
+        get_fit_cache().clear()
+        generate_squares_of_recording(df_tracks, recording['Recording Data'], NR_OF_SQUARES_IN_ROW, concentration,
+                                      MIN_REQUIRED_R_SQUARED, MIN_TRACKS_FOR_TAU, square_area)
+    return run
+
+
+def benchmark_calc_variability(recording: dict):
+    def run():
+        for square_nr, df_tracks_of_square in recording['Tracks of Squares'].items():
+            calc_variability(df_tracks_of_square, square_nr, NR_OF_SQUARES_IN_ROW, GRANULARITY)
+    return run
+
+
+def benchmark_calculate_tau(recording: dict):
+    def run():
+        get_fit_cache().clear()
+        for df_tracks_of_square in recording['Tracks of Squares'].values():
+            calculate_tau(df_tracks_of_square, MIN_TRACKS_FOR_TAU, MIN_REQUIRED_R_SQUARED)
+    return run
+
+
+def benchmark_median_long_and_short_track(recording: dict):
+    def run():
+        for df_tracks_of_square in recording['Tracks of Squares'].values():
+            calculate_median_long_track(df_tracks_of_square.copy(), BACKGROUND_FRACTION)
+            calculate_median_short_track(df_tracks_of_square.copy(), BACKGROUND_FRACTION)
+    return run
+
+
+def benchmark_median_long_and_short_tracks_of_squares(recording: dict):
+    df_tracks = recording['Tracks']
+    square_nrs = assign_square_nrs(df_tracks['Track X Location'], df_tracks['Track Y Location'], NR_OF_SQUARES_IN_ROW)
+
+    def run():
+        calculate_median_long_and_short_tracks_of_squares(
+            df_tracks['Track Duration'].to_numpy(), square_nrs, NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW,
+            BACKGROUND_FRACTION)
+    return run
+
+
+def benchmark_duration_histograms(recording: dict):
+    def run():
+        DurationHistograms.from_tracks(recording['Tracks with Squares'], NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW,
+                                       limit_dc=False)
+    return run
+
+
+def benchmark_recording_tau_from_histograms(recording: dict):
+    # A change of the selection, as in the Recording Viewer: the histograms of the squares are already made
+    df_squares = recording['Squares'].copy()
+    duration_histograms = DurationHistograms.from_tracks(
+        recording['Tracks with Squares'], NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW, limit_dc=False)
+    concentration = float(recording['Recording Data']['Concentration'])
+
+    def run():
+        get_fit_cache().clear()
+        calculate_tau_and_density_for_recording(
+            df_squares, recording['Tracks with Squares'], MIN_TRACKS_FOR_TAU, MIN_REQUIRED_R_SQUARED,
+            NR_OF_SQUARES_IN_ROW, concentration, SELECT_PARAMETERS, duration_histograms)
+    return run
+
+
+def benchmark_tau_bootstrap(recording: dict):
+    duration_histograms = DurationHistograms.from_tracks(
+        recording['Tracks with Squares'], NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW, limit_dc=False)
+    histograms = duration_histograms.histograms_of_squares(np.flatnonzero(duration_histograms.nr_tracks_per_square))
+    taus, _ = calculate_taus_from_histograms(histograms, MIN_TRACKS_FOR_TAU, MIN_REQUIRED_R_SQUARED, 'Batched')
+
+    def run():
+        calculate_tau_confidence_intervals(histograms, taus, NR_OF_BOOTSTRAP_REPLICATES, 0.95, 'Batched')
+    return run
+
+
+def benchmark_select_squares_with_parameters(recording: dict):
+    df_squares = recording['Squares'].copy()
+
+    def run():
+        select_squares_with_parameters(df_squares, SELECT_PARAMETERS, NR_OF_SQUARES_IN_ROW, only_valid_tau=True)
+    return run
+
+
+def benchmark_label_selected_squares_and_tracks(recording: dict):
+    df_squares = recording['Squares'].copy()
+    select_squares_with_parameters(df_squares, SELECT_PARAMETERS, NR_OF_SQUARES_IN_ROW, only_valid_tau=True)
+    df_squares = create_unique_key_for_squares(df_squares)
+
+    def run():
+        label_selected_squares_and_tracks(df_squares.copy(), recording['Tracks with Squares'].copy())
+    return run
+
+
+def benchmark_create_unique_key_for_squares(recording: dict):
+    def run():
+        create_unique_key_for_squares(recording['Squares'].copy())
+    return run
+
+
+BENCHMARKS = {
+    'process_square': benchmark_process_square,
+    'generate_squares_of_recording': benchmark_generate_squares_of_recording,
+    'calc_variability': benchmark_calc_variability,
+    'calculate_tau': benchmark_calculate_tau,
+    'median_long_and_short_track': benchmark_median_long_and_short_track,
+    'median_long_and_short_tracks_of_squares': benchmark_median_long_and_short_tracks_of_squares,
+    'duration_histograms': benchmark_duration_histograms,
+    'recording_tau_from_histograms': benchmark_recording_tau_from_histograms,
+    'tau_bootstrap': benchmark_tau_bootstrap,
+    'select_squares_with_parameters': benchmark_select_squares_with_parameters,
+    'label_selected_squares_and_tracks': benchmark_label_selected_squares_and_tracks,
+    'create_unique_key_for_squares': benchmark_create_unique_key_for_squares}
+
+
+# ----------------------------------------------------------------------------------------------------
+# Running, saving and comparing
+# ----------------------------------------------------------------------------------------------------
+
+def time_benchmark(run, nr_of_repeats: int) -> list:
+    run_times = []
+    for _ in range(nr_of_repeats):
+        start_time = time.perf_counter()
+        run()
+        run_times.append(time.perf_counter() - start_time)
+    return run_times
+
+
+def get_commit() -> str:
+    """
+    The commit of the repository the benchmarks run from, with '+' appended when there are local changes
+    """
+
+    try:
+        repository = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repository, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repository,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('+' if changes else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(track_counts: list, nr_of_repeats: int, benchmark_names: list) -> dict:
+    results = []
+    for nr_of_tracks in track_counts:
+        recording = make_recording(nr_of_tracks)
+        for benchmark_name in benchmark_names:
+            run = BENCHMARKS[benchmark_name](recording)
+            run()  # Warm up
+            run_times = time_benchmark(run, nr_of_repeats)
+            result = {
+                'Benchmark': benchmark_name,
+                'Nr of Tracks': nr_of_tracks,
+                'Nr of Squares in Row': NR_OF_SQUARES_IN_ROW,
+                'Repeats': nr_of_repeats,
+                'Min (s)': min(run_times),
+                'Median (s)': statistics.median(run_times),
+                'Mean (s)': statistics.mean(run_times)}
+            results.append(result)
+            print(f"{benchmark_name:36s} {nr_of_tracks:9d} tracks: min {result['Min (s)']:9.5f} s, "
+                  f"median {result['Median (s)']:9.5f} s")
+    return {
+        'Commit': get_commit(),
+        'Time Stamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'Python': platform.python_version(),
+        'NumPy': np.__version__,
+        'pandas': pd.__version__,
+        'Platform': platform.platform(),
+        'Results': results}
+
+
+def compare_results(results: dict, earlier_results: dict) -> None:
+    """
+    Print the ratio of the median run times of the benchmarks that are in both results (above 1 is slower now)
+    """
+
+    earlier = {(result['Benchmark'], result['Nr of Tracks']): result for result in earlier_results['Results']}
+    print(f"\nCompared to {earlier_results['Commit']} ({earlier_results['Time Stamp']}):")
+    for result in results['Results']:
+        key = (result['Benchmark'], result['Nr of Tracks'])
+        if key in earlier:
+            ratio = result['Median (s)'] / earlier[key]['Median (s)']
+            print(f"{key[0]:36s} {key[1]:9d} tracks: {ratio:6.2f} x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the square engine on synthetic recordings')
+    parser.add_argument('--tracks', type=int, nargs='+', default=TRACK_COUNTS, help='The track counts of a recording')
+    parser.add_argument('--repeats', type=int, default=NR_OF_REPEATS, help='The number of timed runs per benchmark')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='The benchmarks to run')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_FILE, help='The JSON file the results are written to')
+    parser.add_argument('--compare', help='An earlier results file to compare with')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.tracks, args.repeats, args.only)
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=4)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as compare_file:
+            compare_results(results, json.load(compare_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark of the Tau fitting: curve_fit_and_plot for every square against curve_fit_batch for all squares at once.
+The duration histograms are made from exponentially distributed track durations, with the frame time of a
+recording, so they look like the histograms of squares with a range of track counts.
+Then every registered Tau fitter is compared with 'Curve Fit' on wall time, failed fits and agreement of the Tau, and
+the number of function evaluations of curve_fit with numerical differentiation from the fixed p0 is compared with that
+of the trust region fit with the analytic Jacobian from the estimated starting point.
+
+Run from the root of the repository:  python -m src.Benchmarks.Benchmark_Tau_Fitter
+"""
+
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+
+from src.Application.Generate_Squares.Curvefit_and_Plot import (
+    curve_fit_and_plot,
+    curve_fit_batch,
+    fit_mono_exp_trust_region,
+    mono_exp,
+    tau_fitters)
+
+NR_OF_SQUARES = 10000
+FRAME_TIME = 0.05
+MIN_REQUIRED_R_SQUARED = 0.9
+
+
+def make_histograms(nr_of_squares: int, rng: np.random.Generator) -> list:
+    """
+    Make a duration histogram for every square: the durations that occur, in ascending order, with their frequency
+    """
+
+    histograms = []
+    for _ in range(nr_of_squares):
+        nr_tracks = int(rng.integers(20, 400))
+        tau = rng.uniform(0.1, 1.0)
+        durations = np.round(FRAME_TIME * np.ceil(rng.exponential(tau, nr_tracks) / FRAME_TIME + 2), 2)
+        durations, frequencies = np.unique(durations, return_counts=True)
+        histograms.append((durations, frequencies))
+    return histograms
+
+
+def fit_per_square(histograms: list) -> tuple:
+    fits = [curve_fit_and_plot(plot_data=pd.DataFrame({'Frequency': frequencies, 'Track Duration': durations}))
+            for durations, frequencies in histograms]
+    return np.array([tau for tau, _ in fits], dtype=float), np.array([r_squared for _, r_squared in fits], dtype=float)
+
+
+def count_function_evaluations(histograms: list) -> tuple:
+    """
+    :return: The number of function evaluations of every fit, with curve_fit as curve_fit_and_plot calls it and with
+             fit_mono_exp_trust_region; -1 where the fit failed
+    """
+
+    curve_fit_evaluations = []
+    trust_region_evaluations = []
+    for durations, frequencies in histograms:
+        x, y = np.asarray(durations, dtype=float), np.asarray(frequencies, dtype=float)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                _, _, info, _, _ = curve_fit(mono_exp, x, y, [2000, 4, 10], full_output=True)
+            curve_fit_evaluations.append(info['nfev'])
+        except Exception:
+            curve_fit_evaluations.append(-1)
+        params, nr_evaluations = fit_mono_exp_trust_region(x, y)
+        trust_region_evaluations.append(nr_evaluations if params is not None else -1)
+    return np.array(curve_fit_evaluations), np.array(trust_region_evaluations)
+
+
+def compare_fitters(histograms: list) -> None:
+    results = {}
+    for tau_fitter, (fit_histograms, _) in tau_fitters.items():
+        start_time = time.perf_counter()
+        fits = fit_histograms(histograms)
+        results[tau_fitter] = (time.perf_counter() - start_time,
+                               np.array([tau for tau, _ in fits], dtype=float),
+                               np.array([r_squared for _, r_squared in fits], dtype=float))
+
+    _, reference_taus, reference_r_squareds = results['Curve Fit']
+    reference_valid = (reference_taus != -2) & (reference_r_squareds >= MIN_REQUIRED_R_SQUARED)
+    print(f"\n{'Fitter':20s} {'Time (s)':>9s} {'Failed':>7s} {'R2 >= ' + str(MIN_REQUIRED_R_SQUARED):>10s} "
+          f"{'Median |dTau| / Tau vs Curve Fit':>34s}")
+    for tau_fitter, (run_time, taus, r_squareds) in results.items():
+        valid = (taus != -2) & (r_squareds >= MIN_REQUIRED_R_SQUARED)
+        both_valid = valid & reference_valid
+        difference = np.median(np.abs(taus[both_valid] - reference_taus[both_valid]) / reference_taus[both_valid]) \
+            if np.any(both_valid) else np.nan
+        print(f"{tau_fitter:20s} {run_time:9.2f} {np.sum(taus == -2):7d} {np.sum(valid):10d} {difference:34.1e}")
+
+    curve_fit_evaluations, trust_region_evaluations = count_function_evaluations(histograms)
+    print(f"\nFunction evaluations (median, 90th percentile, failed fits): "
+          f"curve_fit {np.median(curve_fit_evaluations[curve_fit_evaluations >= 0]):.0f}, "
+          f"{np.percentile(curve_fit_evaluations[curve_fit_evaluations >= 0], 90):.0f}, "
+          f"{np.sum(curve_fit_evaluations < 0)}; "
+          f"trust region {np.median(trust_region_evaluations[trust_region_evaluations >= 0]):.0f}, "
+          f"{np.percentile(trust_region_evaluations[trust_region_evaluations >= 0], 90):.0f}, "
+          f"{np.sum(trust_region_evaluations < 0)}")
+
+
+def main():
+    rng = np.random.default_rng(1)
+    histograms = make_histograms(NR_OF_SQUARES, rng)
+
+    start_time = time.perf_counter()
+    taus, r_squareds = fit_per_square(histograms)
+    per_square_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch_taus, batch_r_squareds = curve_fit_batch(histograms)
+    batch_time = time.perf_counter() - start_time
+
+    print(f"{NR_OF_SQUARES} squares: per square {per_square_time:7.2f} s, batched {batch_time:7.2f} s, "
+          f"speed up {per_square_time / batch_time:5.1f} x")
+    print(f"Failed fits: per square {np.sum(taus == -2)}, batched {np.sum(batch_taus == -2)}")
+
+    # Compare the fits that both fitters consider reliable, as Generate Squares reports them
+    reliable = (taus != -2) & (batch_taus != -2) & (r_squareds >= MIN_REQUIRED_R_SQUARED)
+    relative_difference = np.abs(batch_taus[reliable] - taus[reliable]) / taus[reliable]
+    print(f"Fits with R2 >= {MIN_REQUIRED_R_SQUARED}: {np.sum(reliable)}, "
+          f"rounded Tau differs for {np.sum(np.round(batch_taus[reliable]) != np.round(taus[reliable]))}, "
+          f"max relative Tau difference {np.max(relative_difference):.1e}, "
+          f"max R2 difference {np.max(np.abs(batch_r_squareds[reliable] - r_squareds[reliable])):.1e}")
+    both_reliable = reliable & (batch_r_squareds >= MIN_REQUIRED_R_SQUARED)
+    print(f"Tau valid in both: {np.sum(both_reliable)} of {np.sum(reliable)}")
+
+    compare_fitters(histograms)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark of the variability calculation: calc_variability for every non-empty square against
+calc_variability_of_squares for all squares of a Recording at once.
+The results are compared for several granularities, the run time for the default granularity of 10.
+
+Run from the root of the repository:  python -m src.Benchmarks.Benchmark_Variability
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
+    calc_variability,
+    calc_variability_of_squares)
+from src.Application.Generate_Squares.Square_Engine import assign_square_nrs
+
+NR_OF_TRACKS = 20000
+NR_OF_SQUARES_IN_ROW = 30
+GRANULARITIES = [5, 10, 20]
+
+
+def make_tracks(nr_of_tracks: int, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Make track locations that are clustered, as they are on cells, with a uniform background
+    """
+
+    nr_of_clustered_tracks = nr_of_tracks // 2
+    centres = rng.uniform(10, 72, size=(10, 2))
+    cluster = rng.integers(0, len(centres), size=nr_of_clustered_tracks)
+    clustered = centres[cluster] + rng.normal(0, 4, size=(nr_of_clustered_tracks, 2))
+    background = rng.uniform(0, 82.0864, size=(nr_of_tracks - nr_of_clustered_tracks, 2))
+    locations = np.clip(np.vstack([clustered, background]), 0, 82.08)
+    return pd.DataFrame({'Track X Location': locations[:, 0], 'Track Y Location': locations[:, 1]})
+
+
+def variability_per_square(df_tracks: pd.DataFrame, square_nrs: np.ndarray, granularity: int) -> np.ndarray:
+    variability = np.zeros(NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW)
+    for square_nr in np.unique(square_nrs[square_nrs >= 0]):
+        df_tracks_of_square = df_tracks[square_nrs == square_nr]
+        variability[square_nr] = calc_variability(df_tracks_of_square, square_nr, NR_OF_SQUARES_IN_ROW, granularity)
+    return variability
+
+
+def variability_of_all_squares(df_tracks: pd.DataFrame, square_nrs: np.ndarray, granularity: int) -> np.ndarray:
+    return calc_variability_of_squares(
+        df_tracks['Track X Location'], df_tracks['Track Y Location'], square_nrs, NR_OF_SQUARES_IN_ROW, granularity)
+
+
+def main():
+    rng = np.random.default_rng(1)
+    df_tracks = make_tracks(NR_OF_TRACKS, rng)
+    square_nrs = assign_square_nrs(df_tracks['Track X Location'], df_tracks['Track Y Location'], NR_OF_SQUARES_IN_ROW)
+
+    print(f"{NR_OF_TRACKS} tracks in {NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW} squares")
+    for granularity in GRANULARITIES:
+        start_time = time.perf_counter()
+        per_square = variability_per_square(df_tracks, square_nrs, granularity)
+        per_square_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        all_squares = variability_of_all_squares(df_tracks, square_nrs, granularity)
+        all_squares_time = time.perf_counter() - start_time
+
+        max_difference = np.max(np.abs(per_square - all_squares))
+        print(f"Granularity {granularity:2d}: per square {per_square_time:7.3f} s, all squares {all_squares_time:7.4f} s, "
+              f"speed up {per_square_time / all_squares_time:7.0f} x, max difference {max_difference:.1e}")
+        assert np.allclose(per_square, all_squares, rtol=1e-12, atol=1e-12)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Parity check of the vectorised square engine against the per square path. For synthetic recordings (see
+Synthetic_Project) with a range of track counts and seeds, the squares are generated with process_square, square by
+square as 'Square Engine' = 'Per Square' does, and with generate_squares_of_recording. The two are written to csv as
+All Squares is, and the columns in which they differ are reported, with the number of squares that differ.
+
+The engine adds the values of a square in another order than process_square, so the sums and means are not compared
+bit for bit. Before rounding they must agree within a relative difference of RELATIVE_TOLERANCE; in the csv they may
+differ by one unit in their last decimal (a value on a rounding boundary). All other columns must be identical.
+
+Run from the root of the repository:
+    python -m src.Benchmarks.Square_Engine_Parity [--tracks 1000 10000 100000] [--seeds 1 2 3]
+                                                  [--nr-of-squares-in-row 20]
+"""
+
+import argparse
+import io
+import sys
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Generate_Squares.Generate_Squares import process_square
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
+    calc_area_of_square,
+    get_row_and_column,
+    get_square_coordinates)
+from src.Application.Generate_Squares.Square_Engine import (
+    assign_square_nrs,
+    generate_squares_of_recording,
+    sum_per_square)
+from src.Application.Generate_Squares.Square_Table import SquareTable
+from src.Benchmarks.Synthetic_Project import (
+    make_experiment_info,
+    make_tracks_of_recording)
+
+TRACK_COUNTS = [1000, 10000, 100000]
+SEEDS = [1, 2, 3]
+NR_OF_SQUARES_IN_ROW = 20
+MIN_TRACKS_FOR_TAU = 20
+MIN_REQUIRED_R_SQUARED = 0.1
+TAU = 0.3
+RELATIVE_TOLERANCE = 1e-12
+
+# The columns of All Squares that are sums or means of the track values, with the track column they come from
+SUMMED_COLUMNS = {
+    'Mean Diffusion Coefficient': 'Diffusion Coefficient',
+    'Mean Diffusion Coefficient Ext': 'Diffusion Coefficient Ext',
+    'Total Displacement': 'Track Displacement',
+    'Total Track Duration': 'Track Duration'}
+
+
+def make_tracks(recording_data: pd.Series, nr_of_tracks: int, seed: int) -> pd.DataFrame:
+    df_tracks = make_tracks_of_recording(
+        recording_data['Ext Recording Name'], nr_of_tracks, TAU, np.random.default_rng(seed))
+    df_tracks['Unique Key'] = np.arange(nr_of_tracks)
+    df_tracks.set_index('Unique Key', inplace=True, drop=False)
+    df_tracks['Square Nr'] = None
+    df_tracks['Label Nr'] = None
+    return df_tracks
+
+
+def squares_per_square(df_tracks: pd.DataFrame, recording_data: pd.Series, nr_of_squares_in_row: int) -> pd.DataFrame:
+    """
+    The squares as process_recording makes them with 'Square Engine' set to 'Per Square'
+    """
+
+    nr_total_squares = nr_of_squares_in_row * nr_of_squares_in_row
+    squares = SquareTable(nr_total_squares)
+    for square_seq_nr in range(nr_total_squares):
+        row_nr, col_nr = get_row_and_column(square_seq_nr, nr_of_squares_in_row)
+        squares.add_record(process_square(
+            df_tracks, df_tracks, recording_data, nr_of_squares_in_row, float(recording_data['Concentration']),
+            MIN_REQUIRED_R_SQUARED, MIN_TRACKS_FOR_TAU, calc_area_of_square(nr_of_squares_in_row), square_seq_nr,
+            row_nr, col_nr))
+    return squares.to_dataframe()
+
+
+def compare_squares(df_per_square: pd.DataFrame, df_vectorised: pd.DataFrame) -> dict:
+    """
+    Compare the squares as they are written to All Squares. The summed columns may differ by one unit in their last
+    decimal, all other columns must be identical.
+
+    :return: For every column that differs, the number of squares in which it differs
+    """
+
+    df_per_square = pd.read_csv(io.StringIO(df_per_square.to_csv(index=False)), dtype=str, keep_default_na=False)
+    df_vectorised = pd.read_csv(io.StringIO(df_vectorised.to_csv(index=False)), dtype=str, keep_default_na=False)
+    if list(df_per_square.columns) != list(df_vectorised.columns) or len(df_per_square) != len(df_vectorised):
+        return {'Columns or Rows': 1}
+    differences = {}
+    for column in df_per_square.columns:
+        differs = (df_per_square[column] != df_vectorised[column]).to_numpy().copy()
+        if column in SUMMED_COLUMNS:
+            differs &= ~within_last_decimal(df_per_square[column], df_vectorised[column])
+        if differs.any():
+            differences[column] = int(differs.sum())
+    return differences
+
+
+def within_last_decimal(values_1: pd.Series, values_2: pd.Series) -> np.ndarray:
+    """
+    Whether the values written to csv are at most one unit in their last decimal apart
+    """
+
+    nr_of_decimals = np.maximum(decimals_of(values_1), decimals_of(values_2))
+    numbers_1 = pd.to_numeric(values_1, errors='coerce').to_numpy()
+    numbers_2 = pd.to_numeric(values_2, errors='coerce').to_numpy()
+    return np.abs(numbers_1 - numbers_2) <= 1.5 * 10.0 ** -nr_of_decimals
+
+
+def decimals_of(values: pd.Series) -> np.ndarray:
+    return values.str.partition('.')[2].str.len().to_numpy()
+
+
+def compare_sums(df_tracks: pd.DataFrame, nr_of_squares_in_row: int) -> dict:
+    """
+    Compare the unrounded sums of the engine with those of process_square, which sums the tracks of each square with
+    Series.sum
+
+    :return: For every track column whose sums differ by more than RELATIVE_TOLERANCE, the number of squares
+    """
+
+    nr_total_squares = nr_of_squares_in_row * nr_of_squares_in_row
+    square_nrs = assign_square_nrs(df_tracks['Track X Location'], df_tracks['Track Y Location'], nr_of_squares_in_row)
+    in_grid = square_nrs >= 0
+    differences = {}
+    for column in SUMMED_COLUMNS.values():
+        sums, _ = sum_per_square(df_tracks[column].to_numpy(dtype=float)[in_grid], square_nrs[in_grid],
+                                 nr_total_squares)
+        reference_sums = np.zeros(nr_total_squares)
+        for square_seq_nr in range(nr_total_squares):
+            x0, y0, x1, y1 = get_square_coordinates(nr_of_squares_in_row, square_seq_nr)
+            df_tracks_in_square = df_tracks[
+                (df_tracks['Track X Location'] >= x0) & (df_tracks['Track X Location'] < x1) &
+                (df_tracks['Track Y Location'] >= y0) & (df_tracks['Track Y Location'] < y1)]
+            reference_sums[square_seq_nr] = df_tracks_in_square[column].sum()
+        nr_differing = int((~np.isclose(sums, reference_sums, rtol=RELATIVE_TOLERANCE, atol=0)).sum())
+        if nr_differing:
+            differences[column] = nr_differing
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the vectorised square engine with the per square path')
+    parser.add_argument('--tracks', type=int, nargs='+', default=TRACK_COUNTS)
+    parser.add_argument('--seeds', type=int, nargs='+', default=SEEDS)
+    parser.add_argument('--nr-of-squares-in-row', type=int, default=NR_OF_SQUARES_IN_ROW)
+    args = parser.parse_args()
+
+    recording_data = make_experiment_info('240101', 1, 1).iloc[0].copy()
+    recording_data['Ext Recording Name'] = f"{recording_data['Recording Name']}-threshold-5"
+
+    nr_of_differences = 0
+    for nr_of_tracks in args.tracks:
+        for seed in args.seeds:
+            recording_data['Nr Spots'] = nr_of_tracks * 10
+            df_tracks = make_tracks(recording_data, nr_of_tracks, seed)
+            df_per_square = squares_per_square(df_tracks.copy(), recording_data, args.nr_of_squares_in_row)
+            df_vectorised, _ = generate_squares_of_recording(
+                df_tracks.copy(), recording_data, args.nr_of_squares_in_row, float(recording_data['Concentration']),
+                MIN_REQUIRED_R_SQUARED, MIN_TRACKS_FOR_TAU, calc_area_of_square(args.nr_of_squares_in_row))
+            differences = compare_squares(df_per_square, df_vectorised)
+            differences.update(compare_sums(df_tracks, args.nr_of_squares_in_row))
+            nr_of_differences += len(differences)
+            print(f"{nr_of_tracks:>7} tracks, seed {seed}: {'matches' if not differences else differences}")
+
+    sys.exit(1 if nr_of_differences else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+Generator of synthetic Paint data: an Experiment, or a Project of Experiments, with the Experiment Info, All Recordings
+and All Tracks files that Run TrackMate would produce, so that Generate Squares and the benchmarks can be run without
+the sample data.
+
+The tracks of a recording imitate cells: most tracks lie in a few elliptical clusters, the rest is spread uniformly
+over the image as background. Track durations are exponentially distributed (with a Tau that differs per condition)
+and rounded to whole frames, as TrackMate reports them. The tracks are written one recording at a time, so
+Experiments with millions of tracks can be generated without holding them all in memory.
+
+Run from the root of the repository:
+    python -m src.Benchmarks.Synthetic_Project <directory> [--tracks N] [--recordings N] [--experiments N] [--seed N]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+IMAGE_SIZE = 82.0864            # The width and height of a recording in micrometer
+FRAME_TIME = 0.05               # The time between frames in seconds
+MIN_SPOTS_IN_TRACK = 3
+BACKGROUND_FRACTION = 0.3       # The fraction of tracks that lie outside the cells
+NR_OF_CELLS = 4
+CELL_RADIUS = (5.0, 12.0)       # The range of the radius of a cell in micrometer
+TAU_OF_CONDITION = [0.15, 0.25, 0.4, 0.6]   # The mean track duration in seconds, per condition
+PROBES = ['1 Mono', '2 Mono', '6 Mono', '1 Bi']
+ADJUVANTS = ['No', 'LPS', 'CpG', 'MPLA']
+TIME_STAMP = 'Mon Jan  6 14:45:13 2025'    # Fixed, so that the same seed gives the same files
+
+
+def make_tracks_of_recording(
+        ext_recording_name: str,
+        nr_of_tracks: int,
+        tau: float,
+        rng: np.random.Generator,
+        nr_of_cells: int = NR_OF_CELLS,
+        background_fraction: float = BACKGROUND_FRACTION) -> pd.DataFrame:
+    """
+    Make the tracks of one recording, with the columns of the All Tracks file (without Square Nr and Label Nr)
+
+    :param ext_recording_name: The name the tracks are given in 'Ext Recording Name'
+    :param nr_of_tracks: The number of tracks
+    :param tau: The mean track duration in seconds
+    :param rng: The random generator
+    :param nr_of_cells: The number of cells the clustered tracks are spread over
+    :param background_fraction: The fraction of tracks that is spread uniformly over the image
+    :return: The tracks dataframe
+    """
+
+    # Place the tracks on cells, each an ellipse with its own size, orientation and share of the tracks
+    nr_of_background_tracks = int(round(nr_of_tracks * background_fraction))
+    nr_of_cell_tracks = nr_of_tracks - nr_of_background_tracks
+    centres = rng.uniform(0.2 * IMAGE_SIZE, 0.8 * IMAGE_SIZE, size=(nr_of_cells, 2))
+    radii = rng.uniform(*CELL_RADIUS, size=(nr_of_cells, 2))
+    angles = rng.uniform(0, np.pi, size=nr_of_cells)
+    cells = rng.choice(nr_of_cells, size=nr_of_cell_tracks, p=rng.dirichlet(np.full(nr_of_cells, 2.0)))
+    distances = np.sqrt(rng.uniform(0, 1, nr_of_cell_tracks))
+    directions = rng.uniform(0, 2 * np.pi, nr_of_cell_tracks)
+    u = distances * np.cos(directions) * radii[cells, 0]
+    v = distances * np.sin(directions) * radii[cells, 1]
+    x = centres[cells, 0] + u * np.cos(angles[cells]) - v * np.sin(angles[cells])
+    y = centres[cells, 1] + u * np.sin(angles[cells]) + v * np.cos(angles[cells])
+    x = np.concatenate([x, rng.uniform(0, IMAGE_SIZE, nr_of_background_tracks)])
+    y = np.concatenate([y, rng.uniform(0, IMAGE_SIZE, nr_of_background_tracks)])
+    order = rng.permutation(nr_of_tracks)
+    x = np.clip(x[order], 0, np.nextafter(IMAGE_SIZE, 0))
+    y = np.clip(y[order], 0, np.nextafter(IMAGE_SIZE, 0))
+
+    # Exponentially distributed durations, in whole frames. A track has at least the minimum number of spots, which
+    # span one frame less, as TrackMate keeps them
+    nr_of_frames = np.floor(rng.exponential(tau, nr_of_tracks) / FRAME_TIME).astype(int) + MIN_SPOTS_IN_TRACK - 1
+    nr_spots = nr_of_frames + 1
+    nr_gaps = rng.binomial(nr_of_frames, 0.02)
+    track_duration = np.round(nr_of_frames * FRAME_TIME, 2)
+
+    # Diffusion: a few immobile tracks with a zero diffusion coefficient, the others gamma distributed
+    diffusion_coefficient = np.where(rng.random(nr_of_tracks) < 0.05, 0.0, rng.gamma(2.0, 0.05, nr_of_tracks))
+    mean_speed = rng.gamma(2.0, 0.5, nr_of_tracks)
+    displacement = np.sqrt(4 * diffusion_coefficient * track_duration) * rng.rayleigh(0.7, nr_of_tracks)
+
+    track_ids = np.arange(nr_of_tracks)
+    return pd.DataFrame({
+        'Ext Recording Name': ext_recording_name,
+        'Track Id': track_ids,
+        'Track Label': 'Track_' + pd.Series(track_ids).astype(str),
+        'Nr Spots': nr_spots,
+        'Nr Gaps': nr_gaps,
+        'Longest Gap': np.minimum(nr_gaps, rng.integers(0, 3, nr_of_tracks)),
+        'Track Duration': track_duration,
+        'Track X Location': np.round(x, 4),
+        'Track Y Location': np.round(y, 4),
+        'Track Displacement': np.round(displacement, 4),
+        'Track Total Distance': np.round(mean_speed * track_duration, 4),
+        'Track Max Speed': np.round(mean_speed * rng.uniform(1.5, 4.0, nr_of_tracks), 4),
+        'Track Median Speed': np.round(mean_speed * rng.uniform(0.8, 1.0, nr_of_tracks), 4),
+        'Track Mean Speed': np.round(mean_speed, 4),
+        'Diffusion Coefficient': np.round(diffusion_coefficient, 6),
+        'Diffusion Coefficient Ext': np.round(diffusion_coefficient * rng.uniform(1.0, 1.2, nr_of_tracks), 6)})
+
+
+def make_experiment_info(experiment_name: str, nr_of_recordings: int, nr_of_conditions: int) -> pd.DataFrame:
+    """
+    Make the Experiment Info of an Experiment, with the recordings spread over the conditions as replicates
+    """
+
+    experiment_date = experiment_name[:6] if experiment_name[:6].isdigit() else '240101'
+    recordings = []
+    for seq_nr in range(nr_of_recordings):
+        condition_nr = seq_nr % nr_of_conditions + 1
+        replicate_nr = seq_nr // nr_of_conditions + 1
+        recordings.append({
+            'Recording Sequence Nr': seq_nr + 1,
+            'Recording Name': f"{experiment_date}-Exp-{condition_nr}-A1-{replicate_nr}",
+            'Experiment Date': experiment_date,
+            'Experiment Name': experiment_name,
+            'Condition Nr': condition_nr,
+            'Replicate Nr': replicate_nr,
+            'Probe': PROBES[(condition_nr - 1) % len(PROBES)],
+            'Probe Type': 'Simple',
+            'Cell Type': 'BMDC',
+            'Adjuvant': ADJUVANTS[(condition_nr - 1) // len(PROBES) % len(ADJUVANTS)],
+            'Concentration': 10,
+            'Threshold': 5,
+            'Process': 'Yes'})
+    return pd.DataFrame(recordings)
+
+
+def make_experiment(
+        experiment_path: str,
+        nr_of_tracks: int = 100000,
+        nr_of_recordings: int = 8,
+        nr_of_conditions: int = 4,
+        seed: int = 1) -> None:
+    """
+    Write a synthetic Experiment: the Experiment Info, All Recordings and All Tracks files.
+    The tracks are divided over the recordings, with some variation in the number per recording.
+
+    :param experiment_path: The Experiment directory, created if needed. Its name is the Experiment name, of which
+                            the first six digits are taken as the Experiment date
+    :param nr_of_tracks: The total number of tracks of the Experiment
+    :param nr_of_recordings: The number of recordings
+    :param nr_of_conditions: The number of conditions the recordings are spread over
+    :param seed: The seed of the random generator, the same seed gives the same files
+    """
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(experiment_path, exist_ok=True)
+    experiment_name = os.path.basename(os.path.normpath(experiment_path))
+
+    df_experiment = make_experiment_info(experiment_name, nr_of_recordings, nr_of_conditions)
+    df_experiment.to_csv(os.path.join(experiment_path, 'Experiment Info.csv'), index=False)
+
+    # Divide the tracks over the recordings
+    shares = rng.uniform(0.5, 1.5, nr_of_recordings)
+    tracks_per_recording = np.floor(nr_of_tracks * shares / shares.sum()).astype(int)
+    tracks_per_recording[:nr_of_tracks - tracks_per_recording.sum()] += 1
+
+    # Write the tracks one recording at a time and add what Run TrackMate adds to All Recordings
+    tracks_file_path = os.path.join(experiment_path, 'All Tracks.csv')
+    df_recordings = df_experiment.copy()
+    for index, recording_data in df_experiment.iterrows():
+        ext_recording_name = f"{recording_data['Recording Name']}-threshold-{recording_data['Threshold']}"
+        tau = TAU_OF_CONDITION[(recording_data['Condition Nr'] - 1) % len(TAU_OF_CONDITION)]
+        df_tracks = make_tracks_of_recording(ext_recording_name, int(tracks_per_recording[index]), tau, rng)
+        df_tracks.to_csv(tracks_file_path, index=False, mode='w' if index == 0 else 'a', header=index == 0)
+
+        nr_spots_in_tracks = int(df_tracks['Nr Spots'].sum())
+        df_recordings.at[index, 'Nr Spots'] = int(nr_spots_in_tracks * rng.uniform(1.2, 1.6))
+        df_recordings.at[index, 'Nr Tracks'] = len(df_tracks)
+        df_recordings.at[index, 'Run Time'] = round(len(df_tracks) / 20000 + rng.uniform(5, 15), 1)
+        df_recordings.at[index, 'Ext Recording Name'] = ext_recording_name
+        df_recordings.at[index, 'Recording Size'] = 1057996800
+        df_recordings.at[index, 'Time Stamp'] = TIME_STAMP
+        df_recordings.at[index, 'Max Frame Gap'] = 3
+        df_recordings.at[index, 'Gap Closing Max Distance'] = 1.2
+        df_recordings.at[index, 'Linking Max Distance'] = 0.6
+        df_recordings.at[index, 'Median Filtering'] = False
+        df_recordings.at[index, 'Nr Spots in All Tracks'] = nr_spots_in_tracks
+    df_recordings = df_recordings.astype({'Nr Spots': int, 'Nr Tracks': int, 'Recording Size': int,
+                                          'Max Frame Gap': int, 'Nr Spots in All Tracks': int})
+    df_recordings.to_csv(os.path.join(experiment_path, 'All Recordings.csv'), index=False)
+
+
+def make_project(
+        project_path: str,
+        nr_of_experiments: int = 2,
+        nr_of_tracks: int = 100000,
+        nr_of_recordings: int = 8,
+        nr_of_conditions: int = 4,
+        seed: int = 1) -> list:
+    """
+    Write a synthetic Project with nr_of_experiments Experiments, each as make_experiment writes it
+
+    :return: The paths of the Experiments
+    """
+
+    experiment_paths = []
+    for experiment_nr in range(nr_of_experiments):
+        experiment_path = os.path.join(project_path, f"2401{experiment_nr + 1:02d}")
+        make_experiment(experiment_path, nr_of_tracks, nr_of_recordings, nr_of_conditions, seed + experiment_nr)
+        experiment_paths.append(experiment_path)
+    return experiment_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic Paint Experiment or Project')
+    parser.add_argument('directory', help='The Experiment directory, or the Project directory with --experiments')
+    parser.add_argument('--tracks', type=int, default=100000, help='The number of tracks per Experiment')
+    parser.add_argument('--recordings', type=int, default=8, help='The number of recordings per Experiment')
+    parser.add_argument('--conditions', type=int, default=4, help='The number of conditions per Experiment')
+    parser.add_argument('--experiments', type=int, default=0, help='Write a Project with this many Experiments')
+    parser.add_argument('--seed', type=int, default=1, help='The seed of the random generator')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.experiments > 0:
+        make_project(args.directory, args.experiments, args.tracks, args.recordings, args.conditions, args.seed)
+    else:
+        make_experiment(args.directory, args.tracks, args.recordings, args.conditions, args.seed)
+    print(f"Written {args.directory} in {time.time() - start_time:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Parity report of the maximum likelihood Tau estimator against the curve fit. For every square of an Experiment or
+Project with enough tracks, the Tau and R2 are determined from its duration histogram with curve_fit_and_plot and with
+maximum_likelihood_tau, and the run times, the number of failed and unreliable estimates and the agreement of the Taus
+are reported, for all squares and by the number of tracks in the square. The duration histograms are read from the
+Square Histograms file, or made from the tracks when the squares were generated before that file existed.
+
+Run from the root of the repository:
+    python -m src.Benchmarks.Tau_Estimator_Parity <Experiment or Project directory> [--min-tracks-for-tau 20]
+                                                  [--min-required-r-squared 0.9] [--output <file>]
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Generate_Squares.Curvefit_and_Plot import (
+    curve_fit_and_plot,
+    get_maximum_likelihood_settings,
+    maximum_likelihood_tau)
+from src.Application.Generate_Squares.Duration_Histograms import (
+    DurationHistograms,
+    read_square_histograms)
+from src.Application.Support.Track_Store import read_tracks
+
+MIN_TRACKS_FOR_TAU = 20
+MIN_REQUIRED_R_SQUARED = 0.9
+TRACK_COUNT_BINS = [(20, 50), (50, 100), (100, 200), (200, None)]
+DEFAULT_OUTPUT_FILE = 'Tau Estimator Parity.json'
+
+
+def read_histograms_of_squares(paint_path: str) -> list:
+    """
+    :return: The duration histogram of every square that holds tracks, as (durations, frequencies) pairs
+    """
+
+    df_square_histograms = read_square_histograms(paint_path)
+    if df_square_histograms is not None:
+        square_keys = [df_square_histograms['Ext Recording Name'].astype(str), df_square_histograms['Square Nr']]
+        return [(df_square['Track Duration'].to_numpy(), df_square['Frequency'].to_numpy())
+                for _, df_square in df_square_histograms.groupby(square_keys, sort=False)]
+
+    df_tracks = read_tracks(paint_path, columns=['Ext Recording Name', 'Track Duration', 'Square Nr'])
+    if df_tracks is None:
+        return []
+    histograms = []
+    for _, df_tracks_of_recording in df_tracks.groupby('Ext Recording Name', sort=False, observed=True):
+        duration_histograms = DurationHistograms.from_tracks(df_tracks_of_recording, 0, limit_dc=False)
+        histograms.extend(duration_histograms.histograms_of_squares(
+            np.flatnonzero(duration_histograms.nr_tracks_per_square)))
+    return histograms
+
+
+def summarise_estimator(taus: np.ndarray, r_squareds: np.ndarray, min_required_r_squared: float) -> dict:
+    return {
+        'Failed (-2)': int(np.sum(taus == -2)),
+        'R Squared Too Low (-3)': int(np.sum((taus != -2) & (r_squareds < min_required_r_squared))),
+        'Valid': int(np.sum((taus != -2) & (r_squareds >= min_required_r_squared))),
+        'Median R Squared': round(float(np.median(r_squareds[taus != -2])), 4) if np.any(taus != -2) else None}
+
+
+def compare_taus(fit_taus: np.ndarray, ml_taus: np.ndarray) -> dict:
+    if len(fit_taus) == 0:
+        return {'Nr Squares': 0}
+    relative_difference = np.abs(ml_taus - fit_taus) / fit_taus
+    return {
+        'Nr Squares': len(fit_taus),
+        'Median Relative Difference': round(float(np.median(relative_difference)), 4),
+        '90th Percentile Relative Difference': round(float(np.percentile(relative_difference, 90)), 4),
+        'Within 10%': round(float(np.mean(relative_difference <= 0.1)), 4),
+        'Within 25%': round(float(np.mean(relative_difference <= 0.25)), 4),
+        'Median Ratio (Maximum Likelihood / Curve Fit)': round(float(np.median(ml_taus / fit_taus)), 4),
+        'Correlation': round(float(np.corrcoef(fit_taus, ml_taus)[0, 1]), 4) if len(fit_taus) > 1 else None}
+
+
+def make_parity_report(histograms: list, min_tracks_for_tau: int, min_required_r_squared: float) -> dict:
+    histograms = [histogram for histogram in histograms if np.sum(histogram[1]) >= min_tracks_for_tau]
+    nr_tracks = np.array([int(np.sum(frequencies)) for _, frequencies in histograms])
+
+    start_time = time.perf_counter()
+    fits = [curve_fit_and_plot(plot_data=pd.DataFrame({'Frequency': frequencies, 'Track Duration': durations}))
+            for durations, frequencies in histograms]
+    fit_time = time.perf_counter() - start_time
+    fit_taus = np.array([tau for tau, _ in fits], dtype=float)
+    fit_r_squareds = np.array([r_squared for _, r_squared in fits], dtype=float)
+
+    frame_interval, min_duration = get_maximum_likelihood_settings()
+    start_time = time.perf_counter()
+    ml_taus, ml_r_squareds = maximum_likelihood_tau(histograms, frame_interval, min_duration)
+    ml_time = time.perf_counter() - start_time
+
+    fit_valid = (fit_taus != -2) & (fit_r_squareds >= min_required_r_squared)
+    ml_valid = (ml_taus != -2) & (ml_r_squareds >= min_required_r_squared)
+    both_valid = fit_valid & ml_valid
+
+    by_track_count = {}
+    for low, high in TRACK_COUNT_BINS:
+        in_bin = (nr_tracks >= low) & (nr_tracks < (high or np.inf))
+        by_track_count[f"{low}-{high or ''} Tracks"] = {
+            'Nr Squares': int(np.sum(in_bin)),
+            'Curve Fit': summarise_estimator(fit_taus[in_bin], fit_r_squareds[in_bin], min_required_r_squared),
+            'Maximum Likelihood': summarise_estimator(ml_taus[in_bin], ml_r_squareds[in_bin], min_required_r_squared),
+            'Both Valid': compare_taus(fit_taus[in_bin & both_valid], ml_taus[in_bin & both_valid])}
+
+    return {
+        'Min Tracks for Tau': min_tracks_for_tau,
+        'Min Required R Squared': min_required_r_squared,
+        'Frame Interval': frame_interval,
+        'Min Track Duration': min_duration,
+        'Nr Squares': len(histograms),
+        'Curve Fit': {'Run Time (s)': round(fit_time, 4),
+                      **summarise_estimator(fit_taus, fit_r_squareds, min_required_r_squared)},
+        'Maximum Likelihood': {'Run Time (s)': round(ml_time, 4),
+                               **summarise_estimator(ml_taus, ml_r_squareds, min_required_r_squared)},
+        'Both Valid': compare_taus(fit_taus[both_valid], ml_taus[both_valid]),
+        'Only Maximum Likelihood Valid': int(np.sum(ml_valid & ~fit_valid)),
+        'Only Curve Fit Valid': int(np.sum(fit_valid & ~ml_valid)),
+        'By Track Count': by_track_count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the maximum likelihood Tau with the curve fit')
+    parser.add_argument('paint_path', help='An Experiment or Project directory for which squares have been generated')
+    parser.add_argument('--min-tracks-for-tau', type=int, default=MIN_TRACKS_FOR_TAU)
+    parser.add_argument('--min-required-r-squared', type=float, default=MIN_REQUIRED_R_SQUARED)
+    parser.add_argument('--output', default=None,
+                        help=f"The file to write the report to, by default '{DEFAULT_OUTPUT_FILE}' in the directory")
+    args = parser.parse_args()
+
+    histograms = read_histograms_of_squares(args.paint_path)
+    if not histograms:
+        print(f"No squares with tracks found in {args.paint_path}")
+        return
+    report = make_parity_report(histograms, args.min_tracks_for_tau, args.min_required_r_squared)
+
+    output_file = args.output or os.path.join(args.paint_path, DEFAULT_OUTPUT_FILE)
+    with open(output_file, 'w') as report_file:
+        json.dump(report, report_file, indent=4)
+    print(json.dumps({key: value for key, value in report.items() if key != 'By Track Count'}, indent=4))
+    print(f"\nReport written to {output_file}")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,14 @@ CRITICAL = logging.CRITICAL
 
 paint_logger_file_name_assigned = False
 
+# Worker processes started by a process pool log through the main process. They must not open (and thereby truncate)
+# the log files of the main process. The import fails in Jython, which has no worker processes.
+try:
+    import multiprocessing
+    paint_logger_in_worker_process = multiprocessing.current_process().name != 'MainProcess'
+except ImportError:
+    paint_logger_in_worker_process = False
+
 # ----------------------------------------------------------
 # Set up the logging
 # ----------------------------------------------------------
@@ -33,17 +41,21 @@ console_handler.setFormatter(formatter)
 log_directory = os.path.join(os.path.expanduser('~'), 'Paint', 'Logger')
 if not os.path.exists(log_directory):
     os.makedirs(log_directory)
-file_handler = logging.FileHandler(os.path.join(os.path.expanduser('~'), 'Paint', 'Logger', 'paint.log'),
-                                   mode='w')  # Logs to a file   #ToDo
-file_handler.setLevel(logging.INFO)  # All logs at INFO level or higher go to the console
-file_handler.setFormatter(formatter)
+if paint_logger_in_worker_process:
+    file_handler = None
+else:
+    file_handler = logging.FileHandler(os.path.join(os.path.expanduser('~'), 'Paint', 'Logger', 'paint.log'),
+                                       mode='w')  # Logs to a file   #ToDo
+    file_handler.setLevel(logging.INFO)  # All logs at INFO level or higher go to the console
+    file_handler.setFormatter(formatter)
 
 # ----------------------------------------------------------
 # Add the handlers to the logger
 # ----------------------------------------------------------
 
 paint_logger.addHandler(console_handler)
-paint_logger.addHandler(file_handler)
+if file_handler is not None:
+    paint_logger.addHandler(file_handler)
 
 
 # ----------------------------------------------------------
@@ -84,6 +96,10 @@ def paint_logger_change_file_handler_name(file_name):
     global file_handler
     global paint_logger_file_name_assigned
 
+    if paint_logger_in_worker_process:
+        paint_logger_file_name_assigned = True
+        return
+
     paint_logger.removeHandler(file_handler)
 
     file_handler = logging.FileHandler(os.path.join(get_paint_logger_directory(), file_name), mode='w')  # Logs to a file
@@ -1,6 +1,10 @@
+import copy
 import json
 import os
 import sys
+import tempfile
+import threading
+from contextlib import contextmanager
 
 def get_paint_defaults_file_path():  # ToDo
     return os.path.join(os.path.expanduser('~'), 'Paint', 'Defaults', 'Paint.json')
@@ -27,7 +31,9 @@ default_data = {
     "Paint": {
         "Version": "1.0",
         "Image File Extension": ".nd2",
-        "Fiji Path": "/Applications/Fiji.app"
+        "Fiji Path": "/Applications/Fiji.app",
+        "Track Store": "CSV",
+        "Remove CSV After Conversion": False
     },
     "User Directories": {
         "Project Directory": "~",
@@ -38,6 +44,8 @@ default_data = {
     "Generate Squares": {
         "Plot to File": False,
         "Plot Max": 5,
+        "Plot Format": "PNG",
+        "Nr of Plot Workers": 1,
         "Fraction of Squares to Determine Background": 0.1,
         "Exclude zero DC tracks from Tau Calculation": False,
         "Neighbour Mode": "Free",
@@ -48,6 +56,18 @@ default_data = {
         'Min Required R Squared': 0.9,
         "Min Required Density Ratio": 2.0,
         "Max Allowable Variability": 10.0,
+        "Variability Granularity": 10,
+        "Square Engine": "Vectorised",
+        "Tau Fitter": "Curve Fit",
+        "Frame Interval": 0.05,
+        "Tau Bootstrap Replicates": 0,
+        "Tau Confidence Level": 0.95,
+        "Fit Cache Size": 10000,
+        "Fit Cache on Disk": False,
+        "Memory Budget (MB)": 8192,
+        "Nr of Workers": 1,
+        "Performance Report": False,
+        "Trace Memory in Performance Report": False,
 
         "logging": {
             "level": "INFO",
@@ -93,27 +113,91 @@ default_data = {
 }
 
 
-def load_paint_config(file_path):
-    global paint_configuration
+# ----------------------------------------------------------------------------------------------------
+# Paint.json is read once and kept in memory. Every lookup checks the modification time and size of the file
+# and reads it again only when it changed, so that edits made while an application runs are still picked up.
+# The configuration in memory is never changed: an update makes a new one. A snapshot therefore stays as it was
+# when it was taken, and can be used for a whole run (see use_paint_config_snapshot), in which case lookups do not
+# even check the file.
+#
+# Updates are written by reading the file, applying the updates and replacing the file with a new one, so that a
+# reader never sees a half written file. Inside use_paint_config_snapshot, updates are collected and written once,
+# at the end. Looking up an attribute never writes: an attribute that is missing gets the default value of the
+# caller, without adding it to Paint.json.
+#
+# This module is also used by the Fiji (Jython) scripts, so it is kept Python 2.7 compatible.
+# ----------------------------------------------------------------------------------------------------
 
+paint_configuration_file_state = None   # The (path, modification time, size) paint_configuration was read from
+pinned_snapshot = None                  # The snapshot used for all lookups in use_paint_config_snapshot
+pinned_depth = 0
+pending_updates = []                    # The (application, attribute, value) updates to write
+reported_missing_attributes = set()     # The (application, attribute) pairs reported as missing from Paint.json
+paint_configuration_lock = threading.RLock()
 
-    if file_path is None:
-        file_path = os.path.join(os.path.expanduser('~'), 'Paint', 'Defaults', 'paint.json')
+
+class PaintConfigSnapshot(object):
+    """
+    The configuration as it was read from Paint.json at one moment. It does not change when Paint.json changes.
+    """
+
+    def __init__(self, configuration, file_path):
+        self._configuration = configuration
+        self.file_path = file_path
+
+    def get(self, application, attribute_name, default_value=None):
+        """
+        The value of an attribute, as get_paint_attribute_with_default returns it (a missing attribute gets the
+        default value)
+        """
+
+        return lookup_paint_attribute(self, application, attribute_name, default_value)
+
+    def get_value(self, application, attribute_name):
+        """
+        The value of an attribute, or None when it is not in the configuration. Dictionaries and lists are copied,
+        so that the snapshot can not be changed through them.
+        """
+
+        section = self._configuration.get(application)
+        if not isinstance(section, dict):
+            return None
+        value = section.get(attribute_name)
+        if isinstance(value, (dict, list)):
+            value = copy.deepcopy(value)
+        return value
+
+    def has_application(self, application):
+        return isinstance(self._configuration.get(application), dict)
+
+
+def get_file_state(file_path):
+    try:
+        file_stat = os.stat(file_path)
+        return file_path, file_stat.st_mtime, file_stat.st_size
+    except OSError:
+        return None
+
+
+def read_paint_config_file(file_path):
+    """
+    Read Paint.json, after creating it with the default values if it does not exist
+
+    :return: The configuration, or None if it can not be read
+    """
 
     if not os.path.exists(file_path):
 
         # Make sure the directory exists
-        if not os.path.exists(os.path.join(os.path.expanduser('~'), 'Paint', 'Defaults')):
-            os.mkdir(os.path.join(os.path.expanduser('~'), 'Paint', 'Defaults'))
+        if not os.path.exists(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
         # Then create the file with default values
-        with open(file_path, "w") as file:
-            json.dump(default_data, file, indent=4)
+        write_paint_config_file(file_path, default_data)
         paint_logger.info("File '{}' created with default values.".format(file_path))
 
     try:
         with open(file_path, 'r') as config_file:
-            paint_configuration = json.load(config_file)
-        return paint_configuration
+            return json.load(config_file)
     except IOError:
         paint_logger.error("Error: Configuration file {} not found.".format(file_path))
         return None
@@ -125,47 +209,189 @@ def load_paint_config(file_path):
         return None
 
 
-def get_paint_attribute_with_default(application, attribute_name, default_value):
-    config = load_paint_config(get_paint_defaults_file_path())
-    if config is None:
-        paint_logger.error("Error: Configuration file {} not found.".format(get_paint_defaults_file_path()))
-        return None
+# mkstemp creates files that only the owner can read. A file that replaces another gets the permissions of the file
+# it replaces, a new file the permissions that open() gives it.
+try:
+    process_umask = os.umask(0)
+    os.umask(process_umask)
+except:
+    process_umask = 0o022
+
+
+def set_mode_of_replacement_file(temporary_path, file_path):
+    if os.path.exists(file_path):
+        mode = os.stat(file_path).st_mode & 0o777
     else:
-        application = config.get(application)
-        value = application.get(attribute_name, None)
-        if value is None:
-            paint_logger.error("Info: Attribute {} not found in configuration file {}.".format(attribute_name,
-                                                                                                get_paint_defaults_file_path()))
-            if default_value is not None:
-                paint_logger.error(
-                    "Info: Default value {} applied for Attribute {}.".format(default_value, attribute_name))
-                value = default_value
-                update_paint_attribute(application, attribute_name, value)
-            else:
-                paint_logger.error(
-                    "Error: Attribute {} not found in configuration file {} and application {} and no default value.".format(
-                        attribute_name, application, get_paint_defaults_file_path()))
-                sys.exit()
-        return value
+        mode = 0o666 & ~process_umask
+    os.chmod(temporary_path, mode)
 
 
-def update_paint_attribute(application, attribute_name, value):
+def write_paint_config_file(file_path, configuration):
+    """
+    Write the configuration to a temporary file next to Paint.json and then put it in place of Paint.json
+    """
+
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(file_path), prefix='.Paint-', suffix='.json')
     try:
-        # Load the current configuration
-        config = load_paint_config(get_paint_defaults_file_path())  # Ensure these functions are defined
-        if application in config:
-            # Check if the attribute exists, if not, create it
-            config[application][attribute_name] = value
+        with os.fdopen(file_descriptor, 'w') as file:
+            json.dump(configuration, file, indent=4)
+        set_mode_of_replacement_file(temporary_path, file_path)
+        if hasattr(os, 'replace'):
+            os.replace(temporary_path, file_path)
         else:
-            paint_logger.error("The '{}' section does not exist in the config file.".format(application))
+            # Python 2.7 (Jython): rename does not replace an existing file on Windows
+            if os.name == 'nt' and os.path.exists(file_path):
+                os.remove(file_path)
+            os.rename(temporary_path, file_path)
+    except:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def load_paint_config(file_path):
+    """
+    The configuration in Paint.json, read again only if the file changed since it was last read.
+    A copy is returned, which the caller may change.
+    """
+
+    if file_path is None:
+        file_path = get_paint_defaults_file_path()
+    snapshot = get_paint_config_snapshot(file_path)
+    if snapshot is None:
+        return None
+    return copy.deepcopy(snapshot._configuration)
+
+
+def get_paint_config_snapshot(file_path=None):
+    """
+    A snapshot of the configuration in Paint.json, read again only if the file changed since it was last read.
+    Inside use_paint_config_snapshot, the snapshot taken at its start.
+
+    :return: A PaintConfigSnapshot, or None when Paint.json can not be read
+    """
+
+    global paint_configuration, paint_configuration_file_state
+
+    if file_path is None:
+        file_path = get_paint_defaults_file_path()
+    snapshot = pinned_snapshot
+    if snapshot is not None and snapshot.file_path == file_path:
+        return snapshot
+    with paint_configuration_lock:
+        file_state = get_file_state(file_path)
+        if paint_configuration is None or file_state is None or file_state != paint_configuration_file_state:
+            configuration = read_paint_config_file(file_path)
+            if configuration is None:
+                return None
+            paint_configuration = configuration
+            paint_configuration_file_state = get_file_state(file_path)
+        return PaintConfigSnapshot(paint_configuration, file_path)
+
+
+@contextmanager
+def use_paint_config_snapshot():
+    """
+    Use one snapshot of Paint.json for all lookups in the with block, for instance for one run of Generate Squares,
+    and write the updates made in the block to Paint.json at the end, all at once
+    """
+
+    global pinned_snapshot, pinned_depth
+
+    with paint_configuration_lock:
+        if pinned_depth == 0:
+            pinned_snapshot = get_paint_config_snapshot()
+        pinned_depth += 1
+    try:
+        yield pinned_snapshot
+    finally:
+        with paint_configuration_lock:
+            pinned_depth -= 1
+            if pinned_depth == 0:
+                pinned_snapshot = None
+                flush_paint_attributes()
+
+
+def lookup_paint_attribute(snapshot, application, attribute_name, default_value):
+    if snapshot is None:
+        paint_logger.error("Error: Configuration file {} not found.".format(get_paint_defaults_file_path()))
+        return None
+
+    value = snapshot.get_value(application, attribute_name)
+    if value is None:
+        # An update that is not written yet
+        with paint_configuration_lock:
+            for pending_application, pending_attribute, pending_value in pending_updates:
+                if pending_application == application and pending_attribute == attribute_name:
+                    return pending_value
+
+        if default_value is not None:
+            # Reported once, as the same attribute is looked up many times in a run
+            with paint_configuration_lock:
+                if (application, attribute_name) not in reported_missing_attributes:
+                    reported_missing_attributes.add((application, attribute_name))
+                    paint_logger.info(
+                        "Attribute {} not found in configuration file {}, default value {} applied.".format(
+                            attribute_name, snapshot.file_path, default_value))
+            value = default_value
+        else:
+            paint_logger.error(
+                "Error: Attribute {} not found in configuration file {} and application {} and no default value.".format(
+                    attribute_name, application, snapshot.file_path))
+            sys.exit()
+    return value
+
+
+def get_paint_attribute_with_default(application, attribute_name, default_value):
+    return lookup_paint_attribute(get_paint_config_snapshot(), application, attribute_name, default_value)
+
+
+def stage_paint_attribute(application, attribute_name, value):
+    """
+    Add an update to the updates to be written, and write them unless use_paint_config_snapshot is active
+    """
+
+    with paint_configuration_lock:
+        pending_updates.append((application, attribute_name, value))
+        if pinned_depth == 0:
+            flush_paint_attributes()
+
+
+def flush_paint_attributes():
+    """
+    Write the pending updates to Paint.json in one go. The file is read again first, so that changes made to it
+    by others since it was read are kept.
+    """
+
+    global paint_configuration, paint_configuration_file_state
+
+    with paint_configuration_lock:
+        if not pending_updates:
             return
+        updates = list(pending_updates)
+        del pending_updates[:]
+
+        file_path = get_paint_defaults_file_path()
+        try:
+            configuration = read_paint_config_file(file_path)
+            if configuration is None:
+                return
+            for application, attribute_name, value in updates:
+                if application not in configuration:
+                    paint_logger.error("The '{}' section does not exist in the config file.".format(application))
+                    continue
+                configuration[application][attribute_name] = value
+            write_paint_config_file(file_path, configuration)
+            paint_configuration = configuration
+            paint_configuration_file_state = get_file_state(file_path)
+        except Exception as e:
+            paint_logger.error("An unexpected error occurred while saving the config file: {}".format(str(e)))
 
-        # Save the updated configuration back to the file
-        with open(get_paint_defaults_file_path(), "w") as file:
-            json.dump(config, file, indent=4)
 
-    except Exception as e:
-        paint_logger.error("An unexpected error occurred while saving the config file: {}".format(str(e)))
+def update_paint_attribute(application, attribute_name, value):
+    stage_paint_attribute(application, attribute_name, value)
+
 
 if __name__ == '__main__':
     config = load_paint_config(os.path.join(os.path.expanduser('~'), 'Paint', 'Defaults', 'paint.json'))
@@ -37,7 +37,7 @@ from ij.plugin.frame import RoiManager
 
 from FijiSupportFunctions import fiji_get_file_open_write_attribute
 from LoggerConfig import paint_logger
-from NewPaintConfig import get_paint_attribute_with_default
+from NewPaintConfig import get_paint_config_snapshot
 
 
 def own_median(data):
@@ -108,28 +108,29 @@ def execute_trackmate_in_Fiji(
         image_filename,
         first,
         kas_special):
-    max_frame_gap = get_paint_attribute_with_default('TrackMate', 'MAX_FRAME_GAP', 0.5)
-    linking_max_distance = get_paint_attribute_with_default('TrackMate', 'LINKING_MAX_DISTANCE', 0.5)
-    gap_closing_max_distance = get_paint_attribute_with_default('TrackMate', 'GAP_CLOSING_MAX_DISTANCE', 0.5)
+    # Read all TrackMate parameters from one snapshot of Paint.json
+    config = get_paint_config_snapshot()
+    max_frame_gap = config.get('TrackMate', 'MAX_FRAME_GAP', 0.5)
+    linking_max_distance = config.get('TrackMate', 'LINKING_MAX_DISTANCE', 0.5)
+    gap_closing_max_distance = config.get('TrackMate', 'GAP_CLOSING_MAX_DISTANCE', 0.5)
 
-    alternative_linking_cost_factor = get_paint_attribute_with_default('TrackMate', 'ALTERNATIVE_LINKING_COST_FACTOR',
-                                                                       1.05)
-    splitting_max_distance = get_paint_attribute_with_default('TrackMate', 'SPLITTING_MAX_DISTANCE', 13.0)
-    allow_gap_closing = get_paint_attribute_with_default('TrackMate', 'ALLOW_GAP_CLOSING', False)
-    allow_track_merging = get_paint_attribute_with_default('TrackMate', 'ALLOW_TRACK_MERGING', False)
-    allow_track_splitting = get_paint_attribute_with_default('TrackMate', 'ALLOW_TRACK_SPLITTING', False)
-    merging_max_distance = get_paint_attribute_with_default('TrackMate', 'MERGING_MAX_DISTANCE', 12.0)
+    alternative_linking_cost_factor = config.get('TrackMate', 'ALTERNATIVE_LINKING_COST_FACTOR', 1.05)
+    splitting_max_distance = config.get('TrackMate', 'SPLITTING_MAX_DISTANCE', 13.0)
+    allow_gap_closing = config.get('TrackMate', 'ALLOW_GAP_CLOSING', False)
+    allow_track_merging = config.get('TrackMate', 'ALLOW_TRACK_MERGING', False)
+    allow_track_splitting = config.get('TrackMate', 'ALLOW_TRACK_SPLITTING', False)
+    merging_max_distance = config.get('TrackMate', 'MERGING_MAX_DISTANCE', 12.0)
 
-    do_subpixel_localization = get_paint_attribute_with_default('TrackMate', 'DO_SUBPIXEL_LOCALIZATION', False)
-    radius = get_paint_attribute_with_default('TrackMate', 'RADIUS', 0.5)
-    target_channel = get_paint_attribute_with_default('TrackMate', 'TARGET_CHANNEL', 1)
-    do_median_filtering = get_paint_attribute_with_default('TrackMate', 'DO_MEDIAN_FILTERING', True)
+    do_subpixel_localization = config.get('TrackMate', 'DO_SUBPIXEL_LOCALIZATION', False)
+    radius = config.get('TrackMate', 'RADIUS', 0.5)
+    target_channel = config.get('TrackMate', 'TARGET_CHANNEL', 1)
+    do_median_filtering = config.get('TrackMate', 'DO_MEDIAN_FILTERING', True)
 
-    min_number_of_spots = get_paint_attribute_with_default('TrackMate', 'MIN_NR_SPOTS_IN_TRACK', 3)
+    min_number_of_spots = config.get('TrackMate', 'MIN_NR_SPOTS_IN_TRACK', 3)
 
-    max_nr_of_spots_in_image = get_paint_attribute_with_default('TrackMate', 'MAX_NR_SPOTS_IN_IMAGE', 2000000)
+    max_nr_of_spots_in_image = config.get('TrackMate', 'MAX_NR_SPOTS_IN_IMAGE', 2000000)
 
-    track_colouring = get_paint_attribute_with_default('TrackMate', 'TRACK_COLOURING', 'TRACK_DURATION')
+    track_colouring = config.get('TrackMate', 'TRACK_COLOURING', 'TRACK_DURATION')
     if track_colouring != 'TRACK_DURATION' and track_colouring != 'TRACK_INDEX':
         paint_logger.error('Invalid track colouring option in TrackMate configuration,default to TRACK_DURATION')
         track_colouring = 'TRACK_DURATION'
@@ -2,6 +2,7 @@ from __future__ import print_function
 
 import csv
 import os
+import shutil
 import sys
 import threading
 import time
@@ -84,6 +85,15 @@ def run_trackmate(experiment_directory, recording_source_directory, convert=True
             file_path = os.path.join(experiment_directory, 'All Tracks.csv')
             if os.path.exists(file_path):  # Check if the file exists
                 os.remove(file_path)
+            # Delete the tracks in a columnar store and the squares of the previous tracks, if they exist
+            for store_name in ['All Tracks.parquet', 'All Tracks.feather']:
+                store_path = os.path.join(experiment_directory, store_name)
+                if os.path.isdir(store_path):
+                    shutil.rmtree(store_path)
+            for file_name in ['Track Squares.csv', 'Track Squares.parquet', 'Track Squares.feather']:
+                file_path = os.path.join(experiment_directory, file_name)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
 
             # Initialise the All Recordings file with the column headers
             col_names = csv_reader.fieldnames
@@ -7,7 +7,7 @@ from src.Application.Support.General_Support_Functions import ToolTip
 
 
 def reset_root(root_dir):
-    files_to_remove = ['All Recordings.csv', 'All Squares.csv', 'All Tracks.csv',
+    files_to_remove = ['All Recordings.csv', 'All Squares.csv', 'All Tracks.csv', 'Track Squares.csv',
                        'Experiment TM.csv']  # Add file names you want to remove
     directories_to_remove = ['Brightfield Images', 'TrackMate Images']  # Add directory names you want to remove
 
@@ -2,6 +2,12 @@ import os
 
 import pandas as pd
 
+from src.Application.Support.Track_Store import (
+    TRACKS_CSV_FILE_NAME,
+    TRACK_STORE_NAMES,
+    find_track_squares,
+    find_tracks,
+    read_track_columns)
 from src.Fiji.LoggerConfig import paint_logger
 
 def check_integrity_project(project_path):
@@ -14,6 +20,7 @@ def check_integrity_project(project_path):
         entry for entry in os.listdir(project_path)
         if os.path.isfile(os.path.join(project_path, entry)) and not entry.startswith('.')
     ]
+    use_track_store_as_tracks_file(project_path, dirs, files)
 
     paint_logger.info("")
     paint_logger.info("-" * 80)
@@ -70,6 +77,7 @@ def check_integrity_experiment(experiment_path):
         entry for entry in os.listdir(experiment_path)
         if os.path.isfile(os.path.join(experiment_path, entry)) and not entry.startswith('.')
     ]
+    use_track_store_as_tracks_file(experiment_path, dirs, files)
 
     if set(expected_dirs) - set(dirs):
         paint_logger.error(
@@ -266,10 +274,23 @@ def check_all_squares_file(file):
 
     return error
 
+def use_track_store_as_tracks_file(path, dirs, files):
+    # A columnar track store (a directory) takes the place of the All Tracks file
+    track_format, _ = find_tracks(path)
+    if track_format not in (None, 'CSV'):
+        dirs.remove(TRACK_STORE_NAMES[track_format])
+        files.append(TRACKS_CSV_FILE_NAME)
+
+    # The Track Squares file belongs to the tracks and is checked with them
+    _, track_squares_path = find_track_squares(path)
+    if track_squares_path is not None:
+        files.remove(os.path.basename(track_squares_path))
+
+
 def check_all_tracks_file(file):
     expected_columns_1 = {
-        'Unique Key',
         'Ext Recording Name',
+        'Track Id',
         'Track Label',
         'Nr Spots',
         'Nr Gaps',
@@ -282,27 +303,36 @@ def check_all_tracks_file(file):
         'Track Max Speed',
         'Track Median Speed',
         'Track Mean Speed',
-        'Diffusion Coefficient'
+        'Diffusion Coefficient',
+        'Diffusion Coefficient Ext'
     }
 
+    # Tracks processed before there were Track Squares files have the square columns in the tracks
     expected_columns_2 = {
+        'Unique Key',
         'Square Nr',
         'Label Nr'
     }
 
-    df = pd.read_csv(file)
     error = False
 
-    actual_columns = df.columns
+    # Only the columns are needed, which also works for a columnar track store
+    directory = os.path.dirname(file)
+    actual_columns = read_track_columns(directory)
 
     if set(expected_columns_1) - set(actual_columns):
         paint_logger.error(
             f"All Tracks file '{file}' is missing columns: {set(expected_columns_1) - set(actual_columns)}")
         error = True
 
-    if set(actual_columns) - set(expected_columns_1)  != set(expected_columns_2):
+    if set(actual_columns) - set(expected_columns_1) - set(expected_columns_2):
         paint_logger.error(
-            f"All Tracks file '{file}' has excess columns: {set(actual_columns) - set(expected_columns_1)}")
+            f"All Tracks file '{file}' has excess columns: "
+            f"{set(actual_columns) - set(expected_columns_1) - set(expected_columns_2)}")
+        error = True
+
+    if find_track_squares(directory)[0] is None and not {'Square Nr', 'Label Nr'}.issubset(actual_columns):
+        paint_logger.error(f"No Square Nr and Label Nr for the tracks in '{directory}'")
         error = True
 
     return error
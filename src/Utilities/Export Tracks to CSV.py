@@ -0,0 +1,36 @@
+import os
+import sys
+
+from src.Application.Support.Track_Store import (
+    TRACKS_CSV_FILE_NAME,
+    export_tracks_to_csv,
+    find_tracks)
+from src.Fiji.LoggerConfig import (
+    paint_logger,
+    paint_logger_change_file_handler_name)
+
+paint_logger_change_file_handler_name('Export Tracks to CSV.log')
+
+
+def main():
+    # The Experiment or Project directory is specified on the command line, optionally followed by the CSV file
+
+    if len(sys.argv) < 2:
+        paint_logger.error("Usage: Export Tracks to CSV.py <Experiment or Project directory> [<CSV file>]")
+        sys.exit(1)
+
+    paint_directory = sys.argv[1]
+    csv_file_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(paint_directory, 'Output', TRACKS_CSV_FILE_NAME)
+
+    track_format, _ = find_tracks(paint_directory)
+    if track_format is None:
+        paint_logger.error(f"No tracks found in {paint_directory}.")
+        sys.exit(1)
+
+    if export_tracks_to_csv(paint_directory, csv_file_path) is None:
+        sys.exit(1)
+    paint_logger.info(f"The {track_format} tracks in {paint_directory} are exported to {csv_file_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,9 @@ from datetime import datetime
 
 from src.Application.Compile_Project.Compile_Project import compile_project_output
 from src.Application.Compile_Project.Copy_TM_Data_From_Source import copy_tm_data_from_paint_source_with_images
-from src.Application.Generate_Squares.Generate_Squares import process_project
+from src.Application.Generate_Squares.Generate_Squares import (
+    process_project,
+    process_project_with_grid_sizes)
 from src.Application.Generate_Squares.Generate_Squares_Support_Functions import pack_select_parameters
 from src.Application.Support.General_Support_Functions import (
     format_time_nicely,
@@ -39,8 +41,105 @@ def process_json_configuration_block(paint_source_dir,
                                      min_required_r_squared: float,
                                      min_tracks_for_tau: int,
                                      time_string: str,
-                                     paint_force: bool) -> bool:
+                                     paint_force: bool,
+                                     nr_of_workers: int = 1) -> bool:
     time_stamp = time.time()
+    log_configuration_block(project_name, probe, nr_of_squares_in_row, nr_to_process, current_process,
+                            select_parameters, min_required_r_squared, min_tracks_for_tau, paint_force, nr_of_workers)
+
+    if not prepare_project_directory(paint_source_dir, project_path):
+        return False
+
+    nr_experiments_processed = process_project(
+        project_path=project_path,
+        select_parameters=select_parameters,
+        nr_of_squares_in_row=nr_of_squares_in_row,
+        min_required_r_squared=min_required_r_squared,
+        min_tracks_for_tau=min_tracks_for_tau,
+        paint_force=paint_force,
+        nr_of_workers=nr_of_workers)
+
+    finish_project_directory(project_path, nr_experiments_processed, time_string)
+
+    paint_logger.info("")
+    paint_logger.info(
+        f"Processed block in {format_time_nicely(time.time() - time_stamp)}")
+    return True
+
+
+def process_json_configuration_group(paint_source_dir,
+                                     entries: list,
+                                     paint_data: str,
+                                     select_parameters: dict,
+                                     nr_to_process: int,
+                                     first_process: int,
+                                     time_string: str,
+                                     paint_force: bool,
+                                     nr_of_workers: int = 1) -> bool:
+    """
+    Processes configuration entries that differ only in project name and number of squares. The TrackMate data is
+    copied to every project, but the tracks of each experiment are read once and the squares of all grid sizes are
+    generated from them.
+    """
+
+    time_stamp = time.time()
+    project_paths = {}
+    for current_process, entry in enumerate(entries, start=first_process):
+        project_path = os.path.join(paint_data, entry['probe'], entry['project_name'])
+        log_configuration_block(entry['project_name'], entry['probe'], entry['nr_of_squares'], nr_to_process,
+                                current_process, select_parameters, entry['min_required_r_squared'],
+                                entry['min_tracks_for_tau'], paint_force, nr_of_workers)
+        if not prepare_project_directory(paint_source_dir, project_path):
+            return False
+        project_paths[entry['nr_of_squares']] = project_path
+
+    nr_experiments_processed = process_project_with_grid_sizes(
+        project_paths=project_paths,
+        select_parameters=select_parameters,
+        min_required_r_squared=entries[0]['min_required_r_squared'],
+        min_tracks_for_tau=entries[0]['min_tracks_for_tau'],
+        paint_force=paint_force,
+        nr_of_workers=nr_of_workers)
+
+    for project_path in project_paths.values():
+        finish_project_directory(project_path, nr_experiments_processed, time_string)
+
+    paint_logger.info("")
+    paint_logger.info(
+        f"Processed {len(entries)} blocks in {format_time_nicely(time.time() - time_stamp)}")
+    return True
+
+
+def group_configuration_entries(entries: list) -> list:
+    """
+    Groups the entries that differ only in project name and number of squares, keeping the order of the entries.
+    Every group has at most one entry for each number of squares.
+    """
+
+    groups = []
+    for entry in entries:
+        for group in groups:
+            if (all(group[0][key] == entry[key] for key in ['probe', 'min_required_density_ratio',
+                                                             'max_allowable_variability', 'min_required_r_squared',
+                                                             'min_tracks_for_tau']) and
+                    all(grouped_entry['nr_of_squares'] != entry['nr_of_squares'] for grouped_entry in group)):
+                group.append(entry)
+                break
+        else:
+            groups.append([entry])
+    return groups
+
+
+def log_configuration_block(project_name: str,
+                            probe: str,
+                            nr_of_squares_in_row: int,
+                            nr_to_process: int,
+                            current_process: int,
+                            select_parameters: dict,
+                            min_required_r_squared: float,
+                            min_tracks_for_tau: int,
+                            paint_force: bool,
+                            nr_of_workers: int) -> None:
     msg = f"{current_process} of {nr_to_process} - Processing {project_name}"
     paint_logger.info("")
     paint_logger.info("")
@@ -57,11 +156,14 @@ def process_json_configuration_block(paint_source_dir,
     paint_logger.info(f"Min Allowable R squared     : {min_required_r_squared}")
     paint_logger.info(f"Min tracks for tau          : {min_tracks_for_tau}")
     paint_logger.info(f"Paint Force                 : {paint_force}")
+    paint_logger.info(f"Nr of Workers               : {nr_of_workers}")
 
     paint_logger.info("")
     paint_logger.info("-" * 40)
     paint_logger.info("")
 
+
+def prepare_project_directory(paint_source_dir: str, project_path: str) -> bool:
     # Check if the Paint Source directory exists
     if not os.path.exists(paint_source_dir):
         paint_logger.error(f"Paint Source directory {paint_source_dir} does not exist.")
@@ -74,15 +176,10 @@ def process_json_configuration_block(paint_source_dir,
 
     # Copy the data from Paint Source to the appropriate directory in Paint Data
     copy_tm_data_from_paint_source_with_images(paint_source_dir, project_path)
+    return True
 
-    nr_experiments_processed = process_project(
-        project_path=project_path,
-        select_parameters=select_parameters,
-        nr_of_squares_in_row=nr_of_squares_in_row,
-        min_required_r_squared=min_required_r_squared,
-        min_tracks_for_tau=min_tracks_for_tau,
-        paint_force=paint_force)
 
+def finish_project_directory(project_path: str, nr_experiments_processed: int, time_string: str) -> None:
     # Compile the All Recordings and All Squares files
     if nr_experiments_processed > 0:
         compile_project_output(project_path, verbose=True)
@@ -96,16 +193,11 @@ def process_json_configuration_block(paint_source_dir,
     if time_string != '':
         specific_time = get_timestamp_from_string(time_string)
         if specific_time is None:
-            paint_logger.error(f"Time string '{time_stamp}' is not a valid date string.")
+            paint_logger.error(f"Time string '{time_string}' is not a valid date string.")
     else:
         specific_time = None
     set_directory_tree_timestamp(project_path, specific_time)
 
-    paint_logger.info("")
-    paint_logger.info(
-        f"Processed block in {format_time_nicely(time.time() - time_stamp)}")
-    return True
-
 
 def main():
     # Load the configuration file
@@ -142,6 +234,8 @@ def main():
     data_version = process_project_params['Version']
     time_string = process_project_params['Time String']
     paint_force = process_project_params['Force']
+    nr_of_workers = process_project_params.get('Nr of Workers', 1)
+    combine_grid_sizes = process_project_params.get('Combine Grid Sizes', False)
 
     paint_data = paint_data + ' - v' + data_version
 
@@ -165,40 +259,63 @@ def main():
     paint_logger.info(f"The Version is                          : {data_version}")
     paint_logger.info(f"The number of projects to process is    : {nr_to_process}")
     paint_logger.info(f"Paint force is                          : {paint_force}")
+    paint_logger.info(f"The number of workers is                : {nr_of_workers}")
+    paint_logger.info(f"Combine grid sizes is                   : {combine_grid_sizes}")
 
     nr_to_process = sum(1 for entry in config if entry['flag'])
 
     current_process_seq_nr = 0
     error_count = 0
 
-    for entry in config:
-        if entry['flag']:
-            paint_source_dir = os.path.join(paint_source, entry['probe'])
-            paint_data_dir = os.path.join(paint_data, entry['probe'], entry['project_name'])
-            current_process_seq_nr += 1
-
-            select_parameters = pack_select_parameters(
-                min_required_density_ratio=entry['min_required_density_ratio'],
-                max_allowable_variability=entry['max_allowable_variability'],
-                min_track_duration=get_paint_attribute_with_default('Generate Squares', 'Min Track Duration', 0),
-                max_track_duration=get_paint_attribute_with_default('Generate Squares', 'Max Track Duration', 100000),
-                min_required_r_squared=get_paint_attribute_with_default('Generate Squares', 'Min Required R Squared',0.9),
-                neighbour_mode=get_paint_attribute_with_default('Generate Squares', 'Neighbour Mode', 'Free'))
-
-            if not process_json_configuration_block(
+    # Entries that differ only in the number of squares can be processed together, reading the tracks once
+    entries = [entry for entry in config if entry['flag']]
+    if combine_grid_sizes:
+        entry_groups = group_configuration_entries(entries)
+    else:
+        entry_groups = [[entry] for entry in entries]
+
+    for entry_group in entry_groups:
+        entry = entry_group[0]
+        paint_source_dir = os.path.join(paint_source, entry['probe'])
+        paint_data_dir = os.path.join(paint_data, entry['probe'], entry['project_name'])
+        current_process_seq_nr += 1
+
+        select_parameters = pack_select_parameters(
+            min_required_density_ratio=entry['min_required_density_ratio'],
+            max_allowable_variability=entry['max_allowable_variability'],
+            min_track_duration=get_paint_attribute_with_default('Generate Squares', 'Min Track Duration', 0),
+            max_track_duration=get_paint_attribute_with_default('Generate Squares', 'Max Track Duration', 100000),
+            min_required_r_squared=get_paint_attribute_with_default('Generate Squares', 'Min Required R Squared',0.9),
+            neighbour_mode=get_paint_attribute_with_default('Generate Squares', 'Neighbour Mode', 'Free'))
+
+        if len(entry_group) > 1:
+            if not process_json_configuration_group(
                     paint_source_dir=paint_source_dir,
-                    project_name=entry['project_name'],
-                    project_path=paint_data_dir,
-                    probe=entry['probe'],
-                    nr_of_squares_in_row=entry['nr_of_squares'],
-                    nr_to_process=nr_to_process,
-                    current_process=current_process_seq_nr,
+                    entries=entry_group,
+                    paint_data=paint_data,
                     select_parameters=select_parameters,
-                    min_required_r_squared=entry['min_required_r_squared'],
-                    min_tracks_for_tau=entry['min_tracks_for_tau'],
+                    nr_to_process=nr_to_process,
+                    first_process=current_process_seq_nr,
                     time_string=time_string,
-                    paint_force=paint_force):
-                error_count += 1
+                    paint_force=paint_force,
+                    nr_of_workers=nr_of_workers):
+                error_count += len(entry_group)
+            current_process_seq_nr += len(entry_group) - 1
+        elif not process_json_configuration_block(
+                paint_source_dir=paint_source_dir,
+                project_name=entry['project_name'],
+                project_path=paint_data_dir,
+                probe=entry['probe'],
+                nr_of_squares_in_row=entry['nr_of_squares'],
+                nr_to_process=nr_to_process,
+                current_process=current_process_seq_nr,
+                select_parameters=select_parameters,
+                min_required_r_squared=entry['min_required_r_squared'],
+                min_tracks_for_tau=entry['min_tracks_for_tau'],
+                time_string=time_string,
+                paint_force=paint_force,
+                nr_of_workers=nr_of_workers):
+            error_count += 1
 
     # Report the time it took in hours, minutes, seconds
     run_time = time.time() - main_stamp
@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import time
+
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import pack_select_parameters
+from src.Application.Generate_Squares.Selection_Sweep import sweep_selection_parameters
+from src.Application.Support.General_Support_Functions import format_time_nicely
+from src.Fiji.LoggerConfig import (
+    paint_logger,
+    paint_logger_change_file_handler_name)
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+paint_logger_change_file_handler_name('Run Selection Sweep.log')
+
+
+def main():
+    # Load the configuration file, which can be specified on the command line
+
+    conf_file = sys.argv[1] if len(sys.argv) > 1 else '../Config/Selection Sweep.json'
+
+    try:
+        with open(conf_file, 'r') as file:
+            sweep_params = json.load(file)
+    except FileNotFoundError:
+        paint_logger.error(f"The configuration file {conf_file} was not found.")
+        sys.exit(1)
+    except json.JSONDecodeError:
+        paint_logger.error(f"Failed to decode JSON from the configuration file {conf_file}.")
+        sys.exit(1)
+
+    paint_directory = sweep_params['Paint Directory']
+    parameter_grid = sweep_params['Parameter Grid']
+    nr_of_workers = sweep_params.get('Nr of Workers', 1)
+    output_file = sweep_params.get('Output File', '') or os.path.join(paint_directory, 'Selection Sweep.csv')
+
+    if not os.path.isdir(paint_directory):
+        paint_logger.error(f"Paint directory {paint_directory} does not exist.")
+        sys.exit(1)
+
+    # The parameters that are not swept keep their value from Paint.json
+    default_parameters = pack_select_parameters(
+        min_required_density_ratio=get_paint_attribute_with_default('Generate Squares', 'Min Required Density Ratio', 2),
+        max_allowable_variability=get_paint_attribute_with_default('Generate Squares', 'Max Allowable Variability', 10),
+        min_track_duration=get_paint_attribute_with_default('Generate Squares', 'Min Track Duration', 0),
+        max_track_duration=get_paint_attribute_with_default('Generate Squares', 'Max Track Duration', 100000),
+        min_required_r_squared=get_paint_attribute_with_default('Generate Squares', 'Min Required R Squared', 0.9),
+        neighbour_mode=get_paint_attribute_with_default('Generate Squares', 'Neighbour Mode', 'Free'))
+
+    paint_logger.info(f"The Paint directory is          : {paint_directory}")
+    paint_logger.info(f"The parameter grid is           : {parameter_grid}")
+    paint_logger.info(f"The number of workers is        : {nr_of_workers}")
+    paint_logger.info(f"The results are written to      : {output_file}")
+
+    time_stamp = time.time()
+    try:
+        df_sweep = sweep_selection_parameters(paint_directory, parameter_grid, default_parameters, nr_of_workers)
+    except ValueError as e:
+        paint_logger.error(f"The selection sweep failed: {e}")
+        sys.exit(1)
+
+    if df_sweep.empty:
+        sys.exit(1)
+    df_sweep.to_csv(output_file, index=False)
+
+    paint_logger.info("")
+    paint_logger.info(f"Swept {df_sweep['Combination Nr'].nunique()} combinations in "
+                      f"{format_time_nicely(time.time() - time_stamp)}")
+
+
+if __name__ == '__main__':
+    main()